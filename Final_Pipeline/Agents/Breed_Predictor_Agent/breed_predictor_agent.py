@@ -13,6 +13,9 @@ from pathlib import Path
 
 # Add the current directory to path for imports
 sys.path.append(os.path.dirname(__file__))
+# The OpenAI rate limiter shared with the rest of the pipeline lives in Final_Pipeline/
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from openai_rate_limiter import rate_limited
 
 try:
     from predictor import BreedPredictor
@@ -23,6 +26,11 @@ except ImportError as e:
     ConfidenceScorer = None
 
 
+def count_order_lines(customer_orders: List[Dict[str, Any]]) -> int:
+    """Count order lines; an order entry summed per product carries its line count."""
+    return sum(int(order.get('line_count', 1)) for order in customer_orders)
+
+
 class BreedPredictorAgent:
     """
     Agent that predicts dog breeds for pets with unknown or mixed breeds.
@@ -152,7 +160,7 @@ class BreedPredictorAgent:
                     'age': pet_profile.get('age'),
                     'size': pet_profile.get('size'),
                     'gender': pet_profile.get('gender'),
-                    'order_count': len(customer_orders),
+                    'order_count': count_order_lines(customer_orders),
                     'health_indicators': pet_profile.get('health_indicators', [])
                 }
             }
@@ -183,45 +191,12 @@ class BreedPredictorAgent:
         Predict breed for a specific pet if conditions are met, using provided order data.
         Returns None if prediction is not needed or failed.
         """
-        if not self.available:
-            print(f"    ⚠️ Breed Predictor not available for {pet_name}")
+        if not self._should_run_prediction(pet_name, pet_data):
             return None
         
-        # Check if breed prediction is needed
-        if not self.should_predict_breed(pet_data):
-            print(f"    ℹ️ No breed prediction needed for {pet_name} (not a dog or breed known)")
-            return None
-        
-        print(f"    🐕 Predicting breed for {pet_name} (unknown/mixed breed dog)...")
-        
         try:
             if not customer_orders:
-                print(f"    ⚠️ No order data provided for customer {customer_id}")
-                print(f"    🔄 Using fallback prediction mode...")
-                
-                # Create minimal pet profile for fallback prediction
-                pet_profile = {
-                    'age': pet_data.get('LifeStage', 'unknown'),
-                    'size': pet_data.get('Weight', 'unknown'),
-                    'gender': pet_data.get('Gender', 'unknown'),
-                    'personality_traits': pet_data.get('PersonalityTraits', []),
-                    'health_indicators': []
-                }
-                
-                # Use fallback prediction from the predictor
-                distribution = self.predictor._fallback_prediction(
-                    pet_profile, 
-                    [],  # Empty health indicators for fallback
-                    list(self.predictor.breed_definitions.keys())  # All available breeds
-                )
-                confidence_result = {
-                    'score': 15.0,  # Low confidence for fallback mode
-                    'level': 'Very Low',
-                    'source': 'Fallback',
-                    'reliability_flags': ['No order data'],
-                    'recommendations': ['Get more purchase history for better predictions']
-                }
-                explanations = {"fallback": "This prediction is based on general breed characteristics due to limited data."}
+                pet_profile, distribution, confidence_result, explanations = self._no_orders_prediction(customer_id, pet_data)
             else:
                 # Create pet profile for prediction
                 pet_profile = self.create_pet_profile_for_prediction(pet_data, customer_orders)
@@ -230,49 +205,124 @@ class BreedPredictorAgent:
                 distribution, confidence_result, explanations = self._get_llm_predictions_direct(
                     pet_profile, customer_orders
                 )
+            return self._format_prediction_result(customer_id, pet_name, pet_profile, customer_orders,
+                                                  distribution, confidence_result, explanations)
             
-            # Format the results
-            prediction_result = {
-                'customer_id': customer_id,
-                'pet_name': pet_name,
-                'prediction_timestamp': pd.Timestamp.now().isoformat(),
-                'breed_distribution': distribution,
-                'confidence': {
-                    'score': confidence_result.get('score', 0),
-                    'level': confidence_result.get('level', 'Unknown'),
-                    'source': confidence_result.get('source', 'Unknown'),
-                    'reliability_flags': confidence_result.get('reliability_flags', []),
-                    'recommendations': confidence_result.get('recommendations', [])
-                },
-                'explanations': explanations,
-                'pet_profile_used': {
-                    'age': pet_profile.get('age'),
-                    'size': pet_profile.get('size'),
-                    'gender': pet_profile.get('gender'),
-                    'order_count': len(customer_orders),
-                    'health_indicators': pet_profile.get('health_indicators', [])
-                }
-            }
-            
-            # Get top breed
-            if distribution:
-                top_breed = max(distribution.items(), key=lambda x: x[1])
-                prediction_result['top_predicted_breed'] = {
-                    'breed': top_breed[0],
-                    'percentage': top_breed[1]
-                }
-            
-            print(f"    ✅ Breed prediction completed for {pet_name}")
-            if 'top_predicted_breed' in prediction_result:
-                top = prediction_result['top_predicted_breed']
-                print(f"    🏆 Top prediction: {top['breed']} ({top['percentage']:.1f}%)")
-            
-            return prediction_result
+        except Exception as e:
+            print(f"    ❌ Error predicting breed for {pet_name}: {e}")
+            return None
+    
+    async def predict_breed_for_pet_with_orders_async(self, llm, customer_id: str, pet_name: str,
+                                                      pet_data: Dict[str, Any],
+                                                      customer_orders: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Async version of predict_breed_for_pet_with_orders; llm is the pipeline's AsyncLLMClient."""
+        if not self._should_run_prediction(pet_name, pet_data):
+            return None
+        
+        try:
+            if not customer_orders:
+                pet_profile, distribution, confidence_result, explanations = self._no_orders_prediction(customer_id, pet_data)
+            else:
+                pet_profile = self.create_pet_profile_for_prediction(pet_data, customer_orders)
+                distribution, confidence_result, explanations = await self._get_llm_predictions_direct_async(
+                    llm, pet_profile, customer_orders
+                )
+            return self._format_prediction_result(customer_id, pet_name, pet_profile, customer_orders,
+                                                  distribution, confidence_result, explanations)
             
         except Exception as e:
             print(f"    ❌ Error predicting breed for {pet_name}: {e}")
             return None
     
+    def _should_run_prediction(self, pet_name: str, pet_data: Dict[str, Any]) -> bool:
+        """Check that the predictor is available and the pet needs a breed prediction."""
+        if not self.available:
+            print(f"    ⚠️ Breed Predictor not available for {pet_name}")
+            return False
+        
+        # Check if breed prediction is needed
+        if not self.should_predict_breed(pet_data):
+            print(f"    ℹ️ No breed prediction needed for {pet_name} (not a dog or breed known)")
+            return False
+        
+        print(f"    🐕 Predicting breed for {pet_name} (unknown/mixed breed dog)...")
+        return True
+    
+    def _no_orders_prediction(self, customer_id: str, pet_data: Dict[str, Any]) -> tuple:
+        """
+        Fallback prediction for a customer without order data.
+        Returns (pet_profile, distribution, confidence_result, explanations)
+        """
+        print(f"    ⚠️ No order data provided for customer {customer_id}")
+        print(f"    🔄 Using fallback prediction mode...")
+        
+        # Create minimal pet profile for fallback prediction
+        pet_profile = {
+            'age': pet_data.get('LifeStage', 'unknown'),
+            'size': pet_data.get('Weight', 'unknown'),
+            'gender': pet_data.get('Gender', 'unknown'),
+            'personality_traits': pet_data.get('PersonalityTraits', []),
+            'health_indicators': []
+        }
+        
+        # Use fallback prediction from the predictor
+        distribution = self.predictor._fallback_prediction(
+            pet_profile, 
+            [],  # Empty health indicators for fallback
+            list(self.predictor.breed_definitions.keys())  # All available breeds
+        )
+        confidence_result = {
+            'score': 15.0,  # Low confidence for fallback mode
+            'level': 'Very Low',
+            'source': 'Fallback',
+            'reliability_flags': ['No order data'],
+            'recommendations': ['Get more purchase history for better predictions']
+        }
+        explanations = {"fallback": "This prediction is based on general breed characteristics due to limited data."}
+        return pet_profile, distribution, confidence_result, explanations
+    
+    def _format_prediction_result(self, customer_id: str, pet_name: str, pet_profile: Dict[str, Any],
+                                  customer_orders: List[Dict[str, Any]], distribution: Dict[str, float],
+                                  confidence_result: Dict[str, Any], explanations: Dict[str, Any]) -> Dict[str, Any]:
+        """Format a breed distribution as the prediction result, with the top predicted breed."""
+        # Format the results
+        prediction_result = {
+            'customer_id': customer_id,
+            'pet_name': pet_name,
+            'prediction_timestamp': pd.Timestamp.now().isoformat(),
+            'breed_distribution': distribution,
+            'confidence': {
+                'score': confidence_result.get('score', 0),
+                'level': confidence_result.get('level', 'Unknown'),
+                'source': confidence_result.get('source', 'Unknown'),
+                'reliability_flags': confidence_result.get('reliability_flags', []),
+                'recommendations': confidence_result.get('recommendations', [])
+            },
+            'explanations': explanations,
+            'pet_profile_used': {
+                'age': pet_profile.get('age'),
+                'size': pet_profile.get('size'),
+                'gender': pet_profile.get('gender'),
+                'order_count': count_order_lines(customer_orders),
+                'health_indicators': pet_profile.get('health_indicators', [])
+            }
+        }
+        
+        # Get top breed
+        if distribution:
+            top_breed = max(distribution.items(), key=lambda x: x[1])
+            prediction_result['top_predicted_breed'] = {
+                'breed': top_breed[0],
+                'percentage': top_breed[1]
+            }
+        
+        print(f"    ✅ Breed prediction completed for {pet_name}")
+        if 'top_predicted_breed' in prediction_result:
+            top = prediction_result['top_predicted_breed']
+            print(f"    🏆 Top prediction: {top['breed']} ({top['percentage']:.1f}%)")
+        
+        return prediction_result
+    
     def _get_llm_predictions_direct(self, pet_profile: Dict[str, Any], 
                                   purchase_history: List[Dict[str, Any]]) -> tuple:
         """
@@ -280,60 +330,87 @@ class BreedPredictorAgent:
         Returns (distribution, confidence_result, explanations)
         """
         try:
-            # Extract health indicators from purchase data
-            health_indicators = self._extract_health_indicators_from_purchases(purchase_history)
-            existing_indicators = pet_profile.get('health_indicators', [])
-            all_health_indicators = list(set(health_indicators + existing_indicators))
-            
-            # Get breed list from breed definitions
-            breed_list = list(self.predictor.breed_definitions.keys())
-            breed_profiles = self.predictor._create_breed_health_profile()
-            
-            # Create comprehensive prompt for LLM
-            prompt = self.predictor._create_prediction_prompt(
-                pet_profile, purchase_history, all_health_indicators, breed_list, breed_profiles
-            )
+            request, breed_list = self._breed_prediction_request(pet_profile, purchase_history)
             
             # Call OpenAI API
-            response = self.predictor.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert canine geneticist and veterinary behaviorist with extensive experience in breed identification. Provide accurate, evidence-based breed predictions with detailed reasoning."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=2000
-            )
-            
-            # Parse breed distribution, explanations, and LLM confidence
-            llm_response = response.choices[0].message.content
-            distribution, explanations, llm_confidence = self.predictor._parse_breed_distribution_and_explanations(llm_response, breed_list)
-            
-            # Use LLM-generated confidence instead of confidence_scorer
-            confidence_result = {
-                'score': llm_confidence,
-                'level': self.predictor._get_confidence_level_from_score(llm_confidence),
-                'source': 'LLM-generated',
-                'reliability_flags': [],
-                'recommendations': []
-            }
-            
-            return distribution, confidence_result, explanations
+            response = rate_limited(self.predictor.client.chat.completions.create, request)
+            return self._breed_prediction_result(response.choices[0].message.content, breed_list)
             
         except Exception as e:
             print(f"    ⚠️ LLM prediction failed, using fallback: {e}")
-            # Use fallback prediction
-            breed_list = list(self.predictor.breed_definitions.keys())
-            distribution = self.predictor._fallback_prediction(pet_profile, [], breed_list)
-            explanations = {"fallback": "This prediction is based on general breed characteristics due to limited data."}
-            confidence_result = {
-                'score': 15.0,
-                'level': 'Very Low',
-                'source': 'Fallback',
-                'reliability_flags': ['LLM prediction failed'],
-                'recommendations': ['Consider manual breed assessment']
-            }
-            return distribution, confidence_result, explanations
+            return self._llm_fallback_prediction(pet_profile)
+    
+    async def _get_llm_predictions_direct_async(self, llm, pet_profile: Dict[str, Any],
+                                                purchase_history: List[Dict[str, Any]]) -> tuple:
+        """Async version of _get_llm_predictions_direct."""
+        try:
+            request, breed_list = self._breed_prediction_request(pet_profile, purchase_history)
+            llm_response = await llm.chat(**request)
+            return self._breed_prediction_result(llm_response, breed_list)
+        except Exception as e:
+            print(f"    ⚠️ LLM prediction failed, using fallback: {e}")
+            return self._llm_fallback_prediction(pet_profile)
+    
+    def _breed_prediction_request(self, pet_profile: Dict[str, Any], purchase_history: List[Dict[str, Any]]) -> tuple:
+        """
+        Build the chat completion request for a breed prediction.
+        Returns (request, breed_list)
+        """
+        # Extract health indicators from purchase data
+        health_indicators = self._extract_health_indicators_from_purchases(purchase_history)
+        existing_indicators = pet_profile.get('health_indicators', [])
+        all_health_indicators = list(set(health_indicators + existing_indicators))
+        
+        # Get breed list from breed definitions
+        breed_list = list(self.predictor.breed_definitions.keys())
+        breed_profiles = self.predictor._create_breed_health_profile()
+        
+        # Create comprehensive prompt for LLM
+        prompt = self.predictor._create_prediction_prompt(
+            pet_profile, purchase_history, all_health_indicators, breed_list, breed_profiles
+        )
+        request = {
+            'model': "gpt-4",
+            'messages': [
+                {"role": "system", "content": "You are an expert canine geneticist and veterinary behaviorist with extensive experience in breed identification. Provide accurate, evidence-based breed predictions with detailed reasoning."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.3,
+            'max_tokens': 2000
+        }
+        return request, breed_list
+    
+    def _breed_prediction_result(self, llm_response: str, breed_list: List[str]) -> tuple:
+        """
+        Parse breed distribution, explanations, and LLM confidence from the LLM response.
+        Returns (distribution, confidence_result, explanations)
+        """
+        distribution, explanations, llm_confidence = self.predictor._parse_breed_distribution_and_explanations(llm_response, breed_list)
+        
+        # Use LLM-generated confidence instead of confidence_scorer
+        confidence_result = {
+            'score': llm_confidence,
+            'level': self.predictor._get_confidence_level_from_score(llm_confidence),
+            'source': 'LLM-generated',
+            'reliability_flags': [],
+            'recommendations': []
+        }
+        
+        return distribution, confidence_result, explanations
+    
+    def _llm_fallback_prediction(self, pet_profile: Dict[str, Any]) -> tuple:
+        """Fallback prediction when the LLM call fails. Returns (distribution, confidence_result, explanations)"""
+        breed_list = list(self.predictor.breed_definitions.keys())
+        distribution = self.predictor._fallback_prediction(pet_profile, [], breed_list)
+        explanations = {"fallback": "This prediction is based on general breed characteristics due to limited data."}
+        confidence_result = {
+            'score': 15.0,
+            'level': 'Very Low',
+            'source': 'Fallback',
+            'reliability_flags': ['LLM prediction failed'],
+            'recommendations': ['Consider manual breed assessment']
+        }
+        return distribution, confidence_result, explanations
     
     def _extract_health_indicators_from_purchases(self, purchase_history: List[Dict[str, Any]]) -> List[str]:
         """Extract health-related keywords from purchase history."""
@@ -474,7 +551,7 @@ class BreedPredictorAgent:
             score += 20.0
         
         # Score for order count (more orders = more data)
-        order_count = len(customer_orders)
+        order_count = count_order_lines(customer_orders)
         if order_count >= 50:
             score += 30.0
         elif order_count >= 20:
@@ -8,6 +8,8 @@ Now includes trained breed characteristics model for improved accuracy.
 import json
 import pandas as pd
 import os
+import sys
+from pathlib import Path
 from openai import OpenAI
 from typing import Dict, List, Tuple
 import re
@@ -20,6 +22,10 @@ try:
 except ImportError:
     from .confidence_scorer import ConfidenceScorer
 
+# The OpenAI rate limiter shared with the rest of the pipeline lives in Final_Pipeline/
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from openai_rate_limiter import rate_limited
+
 # Load environment variables
 load_dotenv()
 
@@ -192,15 +198,15 @@ class BreedPredictor:
             
             prompt = self._create_prediction_prompt(pet_data, purchase_history, health_indicators, breed_list, breed_profiles)
             
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
+            response = rate_limited(self.client.chat.completions.create, {
+                'model': "gpt-4",
+                'messages': [
                     {"role": "system", "content": "You are an expert canine geneticist and veterinary behaviorist with extensive experience in breed identification. Provide accurate, evidence-based breed predictions with detailed reasoning."},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.3,
-                max_tokens=2000
-            )
+                'temperature': 0.3,
+                'max_tokens': 2000
+            })
             
             llm_response = response.choices[0].message.content
             distribution, explanations, llm_confidence = self._parse_breed_distribution_and_explanations(llm_response, breed_list)
@@ -1,12 +1,18 @@
 """Letter-based Image Generation Agent using OpenAI Image API"""
 import os
 import io
+import sys
 import json
 import openai
 import requests
+from pathlib import Path
 from PIL import Image
 from dotenv import load_dotenv
 
+# The OpenAI rate limiter shared with the rest of the pipeline lives in Final_Pipeline/
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from openai_rate_limiter import rate_limited
+
 
 def generate_image_from_prompt(visual_prompt: str = None, api_key: str = None, output_path: str = None, zip_aesthetics: dict = None, pet_details: list = None) -> str:
     """Generate an image from a visual prompt using OpenAI gpt-image-1."""
@@ -15,74 +21,94 @@ def generate_image_from_prompt(visual_prompt: str = None, api_key: str = None, o
     client = openai.OpenAI(api_key=api_key)
     
     try:
-        # Start with the visual prompt and add consistent art style
-        prompt = visual_prompt or ""
-        
-        # Add consistent art style to every image
-        art_style = " Sophisticated artistic pet portrait, wholesome and warm, joyous energy, refined illustration style, pets as the main focus, inviting atmosphere, elegant colors, cozy and cheerful mood, bright and well-lit with vibrant lighting, NOT cartoonish, artistic interpretation"
-        prompt += art_style
-        
-        # Add essential pet accuracy instructions (only if pet_details provided)
-        if pet_details:
-            total_pets = len(pet_details)
-            pet_summary = []
-            for pet in pet_details:
-                pet_type = pet['type'].lower()
-                breed = pet['breed'] if pet['breed'] and pet['breed'].lower() not in ['unknown', 'unk', 'other'] else 'domestic'
-                name = pet['name']
-                pet_summary.append(f"{name} the {breed} {pet_type}")
-            
-            # Add concise accuracy instructions
-            accuracy_note = f" IMPORTANT: Show exactly {total_pets} pets total: {', '.join(pet_summary)}. NO TEXT in image."
-            prompt += accuracy_note
+        response = rate_limited(client.images.generate, build_image_request(visual_prompt, zip_aesthetics, pet_details))
+        return _save_image_response(response, output_path)
         
-        # Add location context if available
-        if zip_aesthetics and zip_aesthetics.get('location_background'):
-            prompt += f" Setting: {zip_aesthetics['location_background']}."
+    except Exception as e:
+        print(f"❌ Error generating image: {e}")
+        return None
+
+
+async def generate_image_from_prompt_async(llm, visual_prompt: str = None, output_path: str = None, zip_aesthetics: dict = None, pet_details: list = None) -> str:
+    """Async version of generate_image_from_prompt; llm is the pipeline's AsyncLLMClient."""
+    try:
+        response = await llm.generate_image(**build_image_request(visual_prompt, zip_aesthetics, pet_details))
+        return _save_image_response(response, output_path)
         
-        # Ensure prompt stays within reasonable limits
-        if len(prompt) > 1500:
-            prompt = prompt[:1497] + "..."
+    except Exception as e:
+        print(f"❌ Error generating image: {e}")
+        return None
+
+
+def build_image_request(visual_prompt: str = None, zip_aesthetics: dict = None, pet_details: list = None) -> dict:
+    """Build the gpt-image-1 request from the visual prompt, pet details and location background."""
+    # Start with the visual prompt and add consistent art style
+    prompt = visual_prompt or ""
+    
+    # Add consistent art style to every image
+    art_style = " Sophisticated artistic pet portrait, wholesome and warm, joyous energy, refined illustration style, pets as the main focus, inviting atmosphere, elegant colors, cozy and cheerful mood, bright and well-lit with vibrant lighting, NOT cartoonish, artistic interpretation"
+    prompt += art_style
+    
+    # Add essential pet accuracy instructions (only if pet_details provided)
+    if pet_details:
+        total_pets = len(pet_details)
+        pet_summary = []
+        for pet in pet_details:
+            pet_type = pet['type'].lower()
+            breed = pet['breed'] if pet['breed'] and pet['breed'].lower() not in ['unknown', 'unk', 'other'] else 'domestic'
+            name = pet['name']
+            pet_summary.append(f"{name} the {breed} {pet_type}")
         
-        response = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt,
-            size="1024x1536",
-            n=1,
-        )
+        # Add concise accuracy instructions
+        accuracy_note = f" IMPORTANT: Show exactly {total_pets} pets total: {', '.join(pet_summary)}. NO TEXT in image."
+        prompt += accuracy_note
+    
+    # Add location context if available
+    if zip_aesthetics and zip_aesthetics.get('location_background'):
+        prompt += f" Setting: {zip_aesthetics['location_background']}."
+    
+    # Ensure prompt stays within reasonable limits
+    if len(prompt) > 1500:
+        prompt = prompt[:1497] + "..."
+    
+    return {
+        'model': "gpt-image-1",
+        'prompt': prompt,
+        'size': "1024x1536",
+        'n': 1,
+    }
+
+
+def _save_image_response(response, output_path: str = None) -> str:
+    """Get the image URL or base64 data from an image response, saving it when output_path is given."""
+    # Handle both URL and base64 responses
+    image_data = response.data[0]
+    if hasattr(image_data, 'url') and image_data.url:
+        # URL response
+        image_url = image_data.url
         
-        # Handle both URL and base64 responses
-        image_data = response.data[0]
-        if hasattr(image_data, 'url') and image_data.url:
-            # URL response
-            image_url = image_data.url
-            
-            # Download and save image if output path is provided
-            if output_path:
-                resp = requests.get(image_url)
-                if resp.status_code == 200:
-                    img = Image.open(io.BytesIO(resp.content))
-                    img.save(output_path)
-                    print(f"✅ Image saved to: {output_path}")
-            
-            return image_url
-        elif hasattr(image_data, 'b64_json') and image_data.b64_json:
-            # Base64 response - save directly if output path provided
-            if output_path:
-                import base64
-                image_bytes = base64.b64decode(image_data.b64_json)
-                with open(output_path, 'wb') as f:
-                    f.write(image_bytes)
+        # Download and save image if output path is provided
+        if output_path:
+            resp = requests.get(image_url)
+            if resp.status_code == 200:
+                img = Image.open(io.BytesIO(resp.content))
+                img.save(output_path)
                 print(f"✅ Image saved to: {output_path}")
-            
-            # Return the base64 data for pipeline processing
-            return image_data.b64_json
-        else:
-            print(f"❌ No image data found in response")
-            return None
         
-    except Exception as e:
-        print(f"❌ Error generating image: {e}")
+        return image_url
+    elif hasattr(image_data, 'b64_json') and image_data.b64_json:
+        # Base64 response - save directly if output path provided
+        if output_path:
+            import base64
+            image_bytes = base64.b64decode(image_data.b64_json)
+            with open(output_path, 'wb') as f:
+                f.write(image_bytes)
+            print(f"✅ Image saved to: {output_path}")
+        
+        # Return the base64 data for pipeline processing
+        return image_data.b64_json
+    else:
+        print(f"❌ No image data found in response")
         return None
 
 
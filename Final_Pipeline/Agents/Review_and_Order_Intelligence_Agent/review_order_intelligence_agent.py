@@ -12,15 +12,22 @@ Features:
 - Comprehensive LLM analysis for pet profiling
 """
 
+import asyncio
 import json
 import logging
 import os
 import re
+import sys
+from pathlib import Path
 from typing import Any, Dict, List
 
 import openai
 import pandas as pd
 
+# The OpenAI rate limiter shared with the rest of the pipeline lives in Final_Pipeline/
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from openai_rate_limiter import rate_limited
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -64,13 +71,26 @@ class ReviewOrderIntelligenceAgent:
         if not known_pet_profiles:
             return {'pet_names': [], 'pet_count_analysis': {}}
         
-        # Get registered pets from the known pet profiles (from Snowflake)
-        registered_pets = [pet['PetName'] for pet in known_pet_profiles if pet.get('PetName')]
-        
         # Enhanced detection of additional pets using LLM + hashmap approach
         pet_count_analysis = self._detect_additional_pets_with_llm(
             customer_reviews, known_pet_profiles or [], orders_df
         )
+        return self._customer_pet_names(known_pet_profiles, pet_count_analysis)
+    
+    async def _get_customer_pets_from_reviews_async(self, llm, customer_reviews: pd.DataFrame, known_pet_profiles: List[Dict] = None, orders_df: pd.DataFrame = None) -> Dict[str, Any]:
+        """Async version of _get_customer_pets_from_reviews; llm is the pipeline's AsyncLLMClient."""
+        if not known_pet_profiles:
+            return {'pet_names': [], 'pet_count_analysis': {}}
+        
+        pet_count_analysis = await self._detect_additional_pets_with_llm_async(
+            llm, customer_reviews, known_pet_profiles, orders_df
+        )
+        return self._customer_pet_names(known_pet_profiles, pet_count_analysis)
+    
+    def _customer_pet_names(self, known_pet_profiles: List[Dict], pet_count_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Combine the registered pets with the additional pets detected in reviews."""
+        # Get registered pets from the known pet profiles (from Snowflake)
+        registered_pets = [pet['PetName'] for pet in known_pet_profiles if pet.get('PetName')]
         
         # Get all pet names (registered + additional)
         all_pet_names = registered_pets + [pet['name'] for pet in pet_count_analysis.get('additional_pets', [])]
@@ -82,22 +102,11 @@ class ReviewOrderIntelligenceAgent:
     
     def _detect_additional_pets_with_llm(self, customer_reviews: pd.DataFrame, known_pet_profiles: List[Dict], orders_df: pd.DataFrame = None) -> Dict[str, Any]:
         """Detect additional pets mentioned in reviews using LLM analysis and hashmap approach."""
-        
-        # Extract current pet counts from known profiles
-        current_counts = {}
-        for profile in known_pet_profiles:
-            pet_type = profile.get('PetType', 'unknown').lower()
-            if pet_type != 'unknown' and pet_type != 'unk':
-                current_counts[pet_type] = current_counts.get(pet_type, 0) + 1
+        current_counts = self._known_pet_counts(known_pet_profiles)
         
         # If no reviews, return current state
         if customer_reviews.empty:
-            return {
-                'additional_pets': [],
-                'original_counts': current_counts,
-                'detected_counts': current_counts.copy(),
-                'updated_counts': current_counts.copy()
-            }
+            return self._merge_detected_pets(current_counts, current_counts.copy(), [], known_pet_profiles)
         
         # Use LLM to detect pet ownership mentions in reviews
         review_text = " ".join(customer_reviews['ReviewText'].fillna('').tolist())
@@ -111,6 +120,38 @@ class ReviewOrderIntelligenceAgent:
             detected_counts = current_counts.copy()
             named_pets = []
         
+        return self._merge_detected_pets(current_counts, detected_counts, named_pets, known_pet_profiles)
+    
+    async def _detect_additional_pets_with_llm_async(self, llm, customer_reviews: pd.DataFrame, known_pet_profiles: List[Dict], orders_df: pd.DataFrame = None) -> Dict[str, Any]:
+        """Async version of _detect_additional_pets_with_llm."""
+        current_counts = self._known_pet_counts(known_pet_profiles)
+        if customer_reviews.empty:
+            return self._merge_detected_pets(current_counts, current_counts.copy(), [], known_pet_profiles)
+        
+        review_text = " ".join(customer_reviews['ReviewText'].fillna('').tolist())
+        try:
+            llm_analysis = await self._analyze_pet_ownership_with_llm_async(llm, review_text, current_counts, orders_df)
+            detected_counts = llm_analysis['pet_counts']
+            named_pets = llm_analysis.get('named_pets', [])
+        except Exception as e:
+            logger.warning(f"🔄 LLM pet ownership analysis failed, using known counts: {e}")
+            detected_counts = current_counts.copy()
+            named_pets = []
+        
+        return self._merge_detected_pets(current_counts, detected_counts, named_pets, known_pet_profiles)
+    
+    def _known_pet_counts(self, known_pet_profiles: List[Dict]) -> Dict[str, int]:
+        """Extract current pet counts per species from known profiles."""
+        current_counts = {}
+        for profile in known_pet_profiles:
+            pet_type = profile.get('PetType', 'unknown').lower()
+            if pet_type != 'unknown' and pet_type != 'unk':
+                current_counts[pet_type] = current_counts.get(pet_type, 0) + 1
+        return current_counts
+    
+    def _merge_detected_pets(self, current_counts: Dict[str, int], detected_counts: Dict[str, int],
+                             named_pets: List[Dict[str, str]], known_pet_profiles: List[Dict]) -> Dict[str, Any]:
+        """Turn the counts and names detected in reviews into additional pet profiles."""
         # Find discrepancies and create additional pet profiles
         additional_pets = []
         updated_counts = current_counts.copy()
@@ -178,7 +219,25 @@ class ReviewOrderIntelligenceAgent:
     
     def _analyze_pet_ownership_with_llm(self, review_text: str, known_counts: Dict[str, int], customer_orders: pd.DataFrame = None) -> Dict[str, Any]:
         """Use LLM to analyze review text for pet ownership indicators and specific pet names."""
-        
+        try:
+            client = openai.OpenAI(api_key=self.openai_api_key)
+            response = rate_limited(client.chat.completions.create, self._pet_ownership_request(review_text, known_counts))
+            return self._parse_pet_ownership_response(response.choices[0].message.content, known_counts, customer_orders)
+        except Exception as e:
+            logger.error(f"❌ Error in LLM pet ownership analysis: {e}")
+            return {'pet_counts': known_counts, 'named_pets': []}
+    
+    async def _analyze_pet_ownership_with_llm_async(self, llm, review_text: str, known_counts: Dict[str, int], customer_orders: pd.DataFrame = None) -> Dict[str, Any]:
+        """Async version of _analyze_pet_ownership_with_llm."""
+        try:
+            llm_response = await llm.chat(**self._pet_ownership_request(review_text, known_counts))
+            return self._parse_pet_ownership_response(llm_response, known_counts, customer_orders)
+        except Exception as e:
+            logger.error(f"❌ Error in LLM pet ownership analysis: {e}")
+            return {'pet_counts': known_counts, 'named_pets': []}
+    
+    def _pet_ownership_request(self, review_text: str, known_counts: Dict[str, int]) -> Dict[str, Any]:
+        """Build the chat completion request for pet ownership analysis."""
         # Truncate review text to avoid token limits
         if len(review_text) > 3000:
             review_text = review_text[:3000] + "..."
@@ -219,58 +278,54 @@ If no clear information found, return:
     "named_pets": []
 }}"""
         
-        try:
-            client = openai.OpenAI(api_key=self.openai_api_key)
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert at analyzing text for pet ownership indicators. Return only valid JSON with pet counts."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=200
-            )
+        return {
+            'model': "gpt-4",
+            'messages': [
+                {"role": "system", "content": "You are an expert at analyzing text for pet ownership indicators. Return only valid JSON with pet counts."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.1,
+            'max_tokens': 200
+        }
+    
+    def _parse_pet_ownership_response(self, llm_response: str, known_counts: Dict[str, int], customer_orders: pd.DataFrame = None) -> Dict[str, Any]:
+        """Parse and validate the pet counts and named pets from the LLM response."""
+        llm_response = llm_response.strip()
+        
+        # Parse JSON response
+        import re
+        json_match = re.search(r'\{.*\}', llm_response, re.DOTALL)
+        if json_match:
+            detected_data = json.loads(json_match.group())
             
-            llm_response = response.choices[0].message.content.strip()
+            # Extract and validate pet counts
+            pet_counts = detected_data.get('pet_counts', known_counts)
+            validated_counts = {}
+            for pet_type, count in pet_counts.items():
+                if isinstance(count, int) and count >= 0 and pet_type.lower() in ['dog', 'cat', 'pet', 'bird', 'rabbit', 'fish', 'unknown']:
+                    validated_counts[pet_type.lower()] = count
             
-            # Parse JSON response
-            import re
-            json_match = re.search(r'\{.*\}', llm_response, re.DOTALL)
-            if json_match:
-                detected_data = json.loads(json_match.group())
-                
-                # Extract and validate pet counts
-                pet_counts = detected_data.get('pet_counts', known_counts)
-                validated_counts = {}
-                for pet_type, count in pet_counts.items():
-                    if isinstance(count, int) and count >= 0 and pet_type.lower() in ['dog', 'cat', 'pet', 'bird', 'rabbit', 'fish', 'unknown']:
-                        validated_counts[pet_type.lower()] = count
-                
-                # Extract named pets
-                named_pets = detected_data.get('named_pets', [])
-                validated_named_pets = []
-                for pet in named_pets:
-                    if isinstance(pet, dict) and 'name' in pet and 'species' in pet:
-                        species = str(pet['species']).lower().strip()
-                        # Try to infer species from order context if unknown
-                        if species == 'unknown':
-                            species = self._infer_species_from_orders(str(pet['name']).strip(), customer_orders or pd.DataFrame())
-                        
-                        validated_named_pets.append({
-                            'name': str(pet['name']).strip(),
-                            'species': species
-                        })
-                
-                return {
-                    'pet_counts': validated_counts if validated_counts else known_counts,
-                    'named_pets': validated_named_pets
-                }
-            else:
-                logger.warning("No JSON found in LLM response for pet ownership analysis")
-                return {'pet_counts': known_counts, 'named_pets': []}
-                
-        except Exception as e:
-            logger.error(f"❌ Error in LLM pet ownership analysis: {e}")
+            # Extract named pets
+            named_pets = detected_data.get('named_pets', [])
+            validated_named_pets = []
+            for pet in named_pets:
+                if isinstance(pet, dict) and 'name' in pet and 'species' in pet:
+                    species = str(pet['species']).lower().strip()
+                    # Try to infer species from order context if unknown
+                    if species == 'unknown':
+                        species = self._infer_species_from_orders(str(pet['name']).strip(), customer_orders or pd.DataFrame())
+                    
+                    validated_named_pets.append({
+                        'name': str(pet['name']).strip(),
+                        'species': species
+                    })
+            
+            return {
+                'pet_counts': validated_counts if validated_counts else known_counts,
+                'named_pets': validated_named_pets
+            }
+        else:
+            logger.warning("No JSON found in LLM response for pet ownership analysis")
             return {'pet_counts': known_counts, 'named_pets': []}
     
     def analyze_customer_with_cached_data(self, customer_id: str, pets_df: pd.DataFrame, orders_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Dict[str, Any]:
@@ -284,25 +339,14 @@ If no clear information found, return:
             logger.warning(f"No pets found for customer {customer_id}")
             return {}
         
-        # Convert pets DataFrame to list of dictionaries for the enhanced detection
-        known_pet_profiles = []
-        for _, pet_row in pets_df.iterrows():
-            known_pet_profiles.append({
-                'PetName': pet_row.get('PetName', 'Unknown'),
-                'PetType': pet_row.get('PetType', 'UNK'),
-                'PetBreed': pet_row.get('PetBreed', 'UNK'),
-                'Gender': pet_row.get('Gender', 'UNK'),
-                'PetAge': pet_row.get('PetAge', 'UNK'),
-                'Weight': pet_row.get('Weight', 'UNK'),
-                'Birthday': pet_row.get('Birthday', 'UNK')
-            })
-        
         # Use enhanced pet detection to get all pets (including additional ones from reviews)
+        known_pet_profiles = self._known_pet_profiles(pets_df)
         pet_detection_result = self._get_customer_pets_from_reviews(reviews_df, known_pet_profiles, orders_df)
         all_pet_names = pet_detection_result['pet_names']
         pet_count_analysis = pet_detection_result['pet_count_analysis']
         
         customer_results = {}
+        failed_pets = []
         
         # Log the pet count analysis results
         if pet_count_analysis.get('additional_pets'):
@@ -311,121 +355,199 @@ If no clear information found, return:
         
         for pet_name in all_pet_names:
             logger.info(f"  🐾 Analyzing pet {pet_name} for customer {customer_id}...")
-            
-            # Get structured pet profile data for this pet
-            structured_pet_data = None
-            pet_profile_row = pets_df[pets_df['PetName'] == pet_name]
-            if not pet_profile_row.empty:
-                structured_pet_data = pet_profile_row.iloc[0].to_dict()
-            else:
-                # This is an additional pet detected from reviews
-                additional_pet_info = next(
-                    (pet for pet in pet_count_analysis.get('additional_pets', []) if pet['name'] == pet_name),
-                    None
-                )
-                if additional_pet_info:
-                    structured_pet_data = {
-                        'PetName': pet_name,
-                        'PetType': additional_pet_info['type'].title(),
-                        'PetBreed': 'UNK',
-                        'Gender': 'UNK',
-                        'PetAge': 'UNK',
-                        'Weight': 'UNK',
-                        'Birthday': 'UNK',
-                        'source': additional_pet_info['source'],
-                        'confidence': additional_pet_info['confidence']
-                    }
-            
-            # Filter reviews for this pet
-            pet_reviews = pd.DataFrame()
-            if not reviews_df.empty:
-                if pet_name.startswith('Additional_') or pet_name.startswith('UNK_'):
-                    # For additional pets or unnamed species, include all reviews for LLM analysis
-                    pet_reviews = reviews_df.copy()
-                elif structured_pet_data and structured_pet_data.get('source') == 'detected_from_reviews':
-                    # For named pets detected from reviews, try to find specific mentions first
-                    specific_reviews = reviews_df[
-                        reviews_df['ReviewText'].str.contains(pet_name, case=False, na=False)
-                    ]
-                    if not specific_reviews.empty:
-                        pet_reviews = specific_reviews
-                    else:
-                        # If no specific mentions, use all reviews for context
-                        pet_reviews = reviews_df.copy()
-                else:
-                    # For registered pets, filter reviews that mention the pet name
-                    pet_reviews = reviews_df[
-                        reviews_df['ReviewText'].str.contains(pet_name, case=False, na=False)
-                    ]
-                    # If no specific reviews found, include all reviews for context
-                    if pet_reviews.empty:
-                        pet_reviews = reviews_df.copy()
+            structured_pet_data, pet_reviews = self._pet_analysis_inputs(pet_name, pets_df, reviews_df, pet_count_analysis)
             
             # Analyze pet attributes using LLM
             try:
                 insights = self._analyze_pet_attributes_with_llm(
                     pet_reviews, orders_df, pet_name, structured_pet_data
                 )
-                
-                # Create pet profile with enhanced information
-                pet_insight = {
-                    "PetName": pet_name,
-                    "PetType": insights.get("PetType", "UNK"),
-                    "PetTypeScore": insights.get("PetTypeScore", 0.0),
-                    "Breed": insights.get("Breed", "UNK"),
-                    "BreedScore": insights.get("BreedScore", 0.0),
-                    "LifeStage": insights.get("LifeStage", "UNK"),
-                    "LifeStageScore": insights.get("LifeStageScore", 0.0),
-                    "Gender": insights.get("Gender", "UNK"),
-                    "GenderScore": insights.get("GenderScore", 0.0),
-                    "SizeCategory": insights.get("SizeCategory", "UNK"),
-                    "SizeScore": insights.get("SizeScore", 0.0),
-                    "Weight": insights.get("Weight", "UNK"),
-                    "WeightScore": insights.get("WeightScore", 0.0),
-                    "Birthday": insights.get("Birthday", "UNK"),
-                    "BirthdayScore": insights.get("BirthdayScore", 0.0),
-                    "PersonalityTraits": insights.get("PersonalityTraits", []),
-                    "PersonalityScores": insights.get("PersonalityScores", {}),
-                    "FavoriteProductCategories": insights.get("FavoriteProductCategories", []),
-                    "CategoryScores": insights.get("CategoryScores", {}),
-                    "BrandPreferences": insights.get("BrandPreferences", []),
-                    "BrandScores": insights.get("BrandScores", {}),
-                    "DietaryPreferences": insights.get("DietaryPreferences", []),
-                    "DietaryScores": insights.get("DietaryScores", {}),
-                    "BehavioralCues": insights.get("BehavioralCues", []),
-                    "BehavioralScores": insights.get("BehavioralScores", {}),
-                    "HealthMentions": insights.get("HealthMentions", []),
-                    "HealthScores": insights.get("HealthScores", {}),
-                    "MostOrderedProducts": insights.get("MostOrderedProducts", [])
-                }
-                
-                # Add metadata for detected pets
-                if structured_pet_data and structured_pet_data.get('source') == 'detected_from_reviews':
-                    pet_insight["DetectionSource"] = "review_analysis"
-                    pet_insight["DetectionConfidence"] = structured_pet_data.get('confidence', 0.7)
-                    pet_insight["DetectionMethod"] = structured_pet_data.get('detection_method', 'enhanced_llm_detection')
-                    
-                    # Add specific metadata based on detection type
-                    if pet_name.startswith('Additional_'):
-                        pet_insight["DetectionType"] = "count_based"
-                    elif pet_name.startswith('UNK_'):
-                        pet_insight["DetectionType"] = "unnamed_species"
-                    else:
-                        pet_insight["DetectionType"] = "named_pet"
-                
-                customer_results[pet_name] = pet_insight
+                customer_results[pet_name] = self._build_pet_insight(pet_name, insights, structured_pet_data)
                 logger.info(f"    ✅ Completed analysis for {pet_name}")
                 
             except Exception as e:
                 logger.error(f"    ❌ Error analyzing pet {pet_name}: {e}")
+                failed_pets.append(pet_name)
                 continue
         
         # Add pet count analysis to the results metadata
         if pet_count_analysis:
             customer_results['_pet_count_analysis'] = pet_count_analysis
+        # Pets left out because their analysis failed, so the profile isn't kept as final
+        if failed_pets:
+            customer_results['_failed_pets'] = failed_pets
+        
+        logger.info(f"✅ Completed customer {customer_id} with {len(customer_results)} pets")
+        return customer_results
+    
+    async def analyze_customer_with_cached_data_async(self, llm, customer_id: str, pets_df: pd.DataFrame, orders_df: pd.DataFrame, reviews_df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Async version of analyze_customer_with_cached_data, for the pipeline's async mode.
+        The customer's pets are analyzed concurrently through llm (an AsyncLLMClient).
+        """
+        logger.info(f"Analyzing customer {customer_id} with cached data...")
+        
+        if pets_df.empty:
+            logger.warning(f"No pets found for customer {customer_id}")
+            return {}
+        
+        known_pet_profiles = self._known_pet_profiles(pets_df)
+        pet_detection_result = await self._get_customer_pets_from_reviews_async(llm, reviews_df, known_pet_profiles, orders_df)
+        all_pet_names = pet_detection_result['pet_names']
+        pet_count_analysis = pet_detection_result['pet_count_analysis']
+        
+        if pet_count_analysis.get('additional_pets'):
+            logger.info(f"  🔍 Detected {len(pet_count_analysis['additional_pets'])} additional pets from reviews")
+            logger.info(f"  📊 Pet count analysis: {pet_count_analysis['updated_counts']}")
+        
+        async def analyze_pet(pet_name: str) -> Dict[str, Any]:
+            structured_pet_data, pet_reviews = self._pet_analysis_inputs(pet_name, pets_df, reviews_df, pet_count_analysis)
+            insights = await self._analyze_pet_attributes_with_llm_async(
+                llm, pet_reviews, orders_df, pet_name, structured_pet_data
+            )
+            return self._build_pet_insight(pet_name, insights, structured_pet_data)
+        
+        customer_results = {}
+        failed_pets = []
+        pet_insights = await asyncio.gather(*(analyze_pet(pet_name) for pet_name in all_pet_names), return_exceptions=True)
+        for pet_name, pet_insight in zip(all_pet_names, pet_insights):
+            if isinstance(pet_insight, Exception):
+                logger.error(f"    ❌ Error analyzing pet {pet_name}: {pet_insight}")
+                failed_pets.append(pet_name)
+                continue
+            customer_results[pet_name] = pet_insight
+            logger.info(f"    ✅ Completed analysis for {pet_name}")
+        
+        if pet_count_analysis:
+            customer_results['_pet_count_analysis'] = pet_count_analysis
+        if failed_pets:
+            customer_results['_failed_pets'] = failed_pets
         
         logger.info(f"✅ Completed customer {customer_id} with {len(customer_results)} pets")
         return customer_results
+    
+    def _known_pet_profiles(self, pets_df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Convert the pets DataFrame to the profile dictionaries used by enhanced detection."""
+        known_pet_profiles = []
+        for _, pet_row in pets_df.iterrows():
+            known_pet_profiles.append({
+                'PetName': pet_row.get('PetName', 'Unknown'),
+                'PetType': pet_row.get('PetType', 'UNK'),
+                'PetBreed': pet_row.get('PetBreed', 'UNK'),
+                'Gender': pet_row.get('Gender', 'UNK'),
+                'PetAge': pet_row.get('PetAge', 'UNK'),
+                'Weight': pet_row.get('Weight', 'UNK'),
+                'Birthday': pet_row.get('Birthday', 'UNK')
+            })
+        return known_pet_profiles
+    
+    def _pet_analysis_inputs(self, pet_name: str, pets_df: pd.DataFrame, reviews_df: pd.DataFrame, pet_count_analysis: Dict[str, Any]) -> tuple:
+        """
+        Get the structured profile data and the relevant reviews for one pet.
+        
+        Returns:
+            tuple: (structured_pet_data or None, pet_reviews DataFrame)
+        """
+        # Get structured pet profile data for this pet
+        structured_pet_data = None
+        pet_profile_row = pets_df[pets_df['PetName'] == pet_name]
+        if not pet_profile_row.empty:
+            structured_pet_data = pet_profile_row.iloc[0].to_dict()
+        else:
+            # This is an additional pet detected from reviews
+            additional_pet_info = next(
+                (pet for pet in pet_count_analysis.get('additional_pets', []) if pet['name'] == pet_name),
+                None
+            )
+            if additional_pet_info:
+                structured_pet_data = {
+                    'PetName': pet_name,
+                    'PetType': additional_pet_info['type'].title(),
+                    'PetBreed': 'UNK',
+                    'Gender': 'UNK',
+                    'PetAge': 'UNK',
+                    'Weight': 'UNK',
+                    'Birthday': 'UNK',
+                    'source': additional_pet_info['source'],
+                    'confidence': additional_pet_info['confidence']
+                }
+        
+        # Filter reviews for this pet
+        pet_reviews = pd.DataFrame()
+        if not reviews_df.empty:
+            if pet_name.startswith('Additional_') or pet_name.startswith('UNK_'):
+                # For additional pets or unnamed species, include all reviews for LLM analysis
+                pet_reviews = reviews_df.copy()
+            elif structured_pet_data and structured_pet_data.get('source') == 'detected_from_reviews':
+                # For named pets detected from reviews, try to find specific mentions first
+                specific_reviews = reviews_df[
+                    reviews_df['ReviewText'].str.contains(pet_name, case=False, na=False)
+                ]
+                if not specific_reviews.empty:
+                    pet_reviews = specific_reviews
+                else:
+                    # If no specific mentions, use all reviews for context
+                    pet_reviews = reviews_df.copy()
+            else:
+                # For registered pets, filter reviews that mention the pet name
+                pet_reviews = reviews_df[
+                    reviews_df['ReviewText'].str.contains(pet_name, case=False, na=False)
+                ]
+                # If no specific reviews found, include all reviews for context
+                if pet_reviews.empty:
+                    pet_reviews = reviews_df.copy()
+        
+        return structured_pet_data, pet_reviews
+    
+    def _build_pet_insight(self, pet_name: str, insights: Dict[str, Any], structured_pet_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Create the pet profile from the LLM insights, with detection metadata for pets found in reviews."""
+        # Create pet profile with enhanced information
+        pet_insight = {
+            "PetName": pet_name,
+            "PetType": insights.get("PetType", "UNK"),
+            "PetTypeScore": insights.get("PetTypeScore", 0.0),
+            "Breed": insights.get("Breed", "UNK"),
+            "BreedScore": insights.get("BreedScore", 0.0),
+            "LifeStage": insights.get("LifeStage", "UNK"),
+            "LifeStageScore": insights.get("LifeStageScore", 0.0),
+            "Gender": insights.get("Gender", "UNK"),
+            "GenderScore": insights.get("GenderScore", 0.0),
+            "SizeCategory": insights.get("SizeCategory", "UNK"),
+            "SizeScore": insights.get("SizeScore", 0.0),
+            "Weight": insights.get("Weight", "UNK"),
+            "WeightScore": insights.get("WeightScore", 0.0),
+            "Birthday": insights.get("Birthday", "UNK"),
+            "BirthdayScore": insights.get("BirthdayScore", 0.0),
+            "PersonalityTraits": insights.get("PersonalityTraits", []),
+            "PersonalityScores": insights.get("PersonalityScores", {}),
+            "FavoriteProductCategories": insights.get("FavoriteProductCategories", []),
+            "CategoryScores": insights.get("CategoryScores", {}),
+            "BrandPreferences": insights.get("BrandPreferences", []),
+            "BrandScores": insights.get("BrandScores", {}),
+            "DietaryPreferences": insights.get("DietaryPreferences", []),
+            "DietaryScores": insights.get("DietaryScores", {}),
+            "BehavioralCues": insights.get("BehavioralCues", []),
+            "BehavioralScores": insights.get("BehavioralScores", {}),
+            "HealthMentions": insights.get("HealthMentions", []),
+            "HealthScores": insights.get("HealthScores", {}),
+            "MostOrderedProducts": insights.get("MostOrderedProducts", [])
+        }
+        
+        # Add metadata for detected pets
+        if structured_pet_data and structured_pet_data.get('source') == 'detected_from_reviews':
+            pet_insight["DetectionSource"] = "review_analysis"
+            pet_insight["DetectionConfidence"] = structured_pet_data.get('confidence', 0.7)
+            pet_insight["DetectionMethod"] = structured_pet_data.get('detection_method', 'enhanced_llm_detection')
+            
+            # Add specific metadata based on detection type
+            if pet_name.startswith('Additional_'):
+                pet_insight["DetectionType"] = "count_based"
+            elif pet_name.startswith('UNK_'):
+                pet_insight["DetectionType"] = "unnamed_species"
+            else:
+                pet_insight["DetectionType"] = "named_pet"
+        
+        return pet_insight
 
     # ============================================================================
     # LLM CONTEXT PREPARATION AND ANALYSIS
@@ -863,29 +985,44 @@ IMPORTANT: If structured data is provided (e.g., Breed: Birman, Gender: MALE), u
     
     def _analyze_pet_attributes_with_llm(self, pet_reviews: pd.DataFrame, customer_orders: pd.DataFrame, pet_name: str, structured_pet_data: Dict[str, Any] = None) -> Dict[str, Any]:
         """Use LLM to analyze pet attributes from reviews and orders."""
-        if not self.openai_api_key:
-            logger.error("❌ CRITICAL: No OpenAI API key provided. LLM analysis is required for this pipeline.")
-            raise ValueError("OpenAI API key is required for pet analysis. Please set OPENAI_API_KEY environment variable.")
-        
+        request = self._pet_attributes_request(pet_reviews, customer_orders, pet_name, structured_pet_data)
         try:
-            context = self._prepare_llm_context(pet_reviews, customer_orders, pet_name, structured_pet_data)
-            prompt = self._create_analysis_prompt(context, pet_name)
             client = openai.OpenAI(api_key=self.openai_api_key)
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are an expert pet behavior analyst specializing in review-based behavioral insights. Your focus is on extracting detailed personality traits, behavioral patterns, and emotional cues from customer reviews. IMPORTANT: If structured pet data is provided (like Breed, Gender, Pet Type), use those exact values with high confidence scores (0.9-1.0). Extract rich behavioral insights from review text including personality traits, behavioral patterns, emotional states, and owner-pet relationship dynamics. Look for clues like 'girl', 'boy', '125 lbs', 'large breed', 'loves to play', 'anxious', 'protective', etc. in review text. Only use information present in the data. If information is not available, use 'UNK' and score 0. CRITICAL: When categorizing products, ONLY assign products that are appropriate for the pet type. Dogs should only have dog products, cats should only have cat products."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=2000
-            )
+            response = rate_limited(client.chat.completions.create, request)
             llm_response = response.choices[0].message.content
             return self._parse_llm_response(llm_response)
         except Exception as e:
             logger.error(f"❌ CRITICAL: LLM analysis failed for pet {pet_name}: {e}")
             raise RuntimeError(f"LLM analysis failed for pet {pet_name}. This pipeline requires LLM analysis to function properly.")
     
+    async def _analyze_pet_attributes_with_llm_async(self, llm, pet_reviews: pd.DataFrame, customer_orders: pd.DataFrame, pet_name: str, structured_pet_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Async version of _analyze_pet_attributes_with_llm; llm is the pipeline's AsyncLLMClient."""
+        request = self._pet_attributes_request(pet_reviews, customer_orders, pet_name, structured_pet_data)
+        try:
+            llm_response = await llm.chat(**request)
+            return self._parse_llm_response(llm_response)
+        except Exception as e:
+            logger.error(f"❌ CRITICAL: LLM analysis failed for pet {pet_name}: {e}")
+            raise RuntimeError(f"LLM analysis failed for pet {pet_name}. This pipeline requires LLM analysis to function properly.")
+    
+    def _pet_attributes_request(self, pet_reviews: pd.DataFrame, customer_orders: pd.DataFrame, pet_name: str, structured_pet_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Build the chat completion request for pet attribute analysis."""
+        if not self.openai_api_key:
+            logger.error("❌ CRITICAL: No OpenAI API key provided. LLM analysis is required for this pipeline.")
+            raise ValueError("OpenAI API key is required for pet analysis. Please set OPENAI_API_KEY environment variable.")
+        
+        context = self._prepare_llm_context(pet_reviews, customer_orders, pet_name, structured_pet_data)
+        prompt = self._create_analysis_prompt(context, pet_name)
+        return {
+            'model': "gpt-4",
+            'messages': [
+                {"role": "system", "content": "You are an expert pet behavior analyst specializing in review-based behavioral insights. Your focus is on extracting detailed personality traits, behavioral patterns, and emotional cues from customer reviews. IMPORTANT: If structured pet data is provided (like Breed, Gender, Pet Type), use those exact values with high confidence scores (0.9-1.0). Extract rich behavioral insights from review text including personality traits, behavioral patterns, emotional states, and owner-pet relationship dynamics. Look for clues like 'girl', 'boy', '125 lbs', 'large breed', 'loves to play', 'anxious', 'protective', etc. in review text. Only use information present in the data. If information is not available, use 'UNK' and score 0. CRITICAL: When categorizing products, ONLY assign products that are appropriate for the pet type. Dogs should only have dog products, cats should only have cat products."},
+                {"role": "user", "content": prompt}
+            ],
+            'temperature': 0.1,
+            'max_tokens': 2000
+        }
+    
 
 
 if __name__ == "__main__":
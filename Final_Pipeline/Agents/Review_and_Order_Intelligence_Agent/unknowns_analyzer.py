@@ -113,11 +113,11 @@ class UnknownsAnalyzer:
             # Get pet profile data from cached data
             if hasattr(self, 'pipeline') and self.pipeline:
                 # Use pipeline's cached data
-                customer_data = self.pipeline._get_all_customer_data(customer_id)
+                customer_data = self.pipeline._get_cached_customer_data(customer_id, query_keys=['get_pet_profiles'])
                 pet_profile_data = customer_data.get('get_pet_profiles', [])
             else:
                 # Fallback to direct snowflake connector
-                customer_data = self.snowflake_connector.get_customer_data(customer_id)
+                customer_data = self.snowflake_connector.get_customer_data(customer_id, query_keys=['get_pet_profiles'])
                 pet_profile_data = customer_data.get('get_pet_profiles', [])
             
             if not pet_profile_data:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Async LLM Client for Chewy Playback Pipeline
+One AsyncOpenAI client shared by every customer in an async pipeline run, with a
+semaphore bounding how many chat and image requests are in flight at once.
+"""
+
+import os
+import time
+import asyncio
+from typing import Dict, Any
+from openai_rate_limiter import rate_limited_async
+from priority_lanes import current_priority, get_priority_lanes
+
+# Try to import the async OpenAI client
+try:
+    from openai import AsyncOpenAI
+    ASYNC_OPENAI_AVAILABLE = True
+except ImportError:
+    ASYNC_OPENAI_AVAILABLE = False
+
+DEFAULT_MAX_IN_FLIGHT = 64
+
+
+class AsyncLLMClient:
+    """
+    Semaphore-bounded wrapper around AsyncOpenAI.
+
+    Agents build the same request dictionaries for their blocking and async paths; the
+    async path hands them to chat() or generate_image(), which wait for a free slot so
+    thousands of pending calls across customers never exceed max_in_flight requests.
+    """
+
+    def __init__(self, api_key: str = None, max_in_flight: int = None):
+        """
+        Initialize the async client.
+
+        Args:
+            api_key (str, optional): OpenAI API key. Defaults to OPENAI_API_KEY
+            max_in_flight (int, optional): Concurrent OpenAI requests. Defaults to
+                OPENAI_MAX_IN_FLIGHT or 64, capped at the llm priority lane's slots for
+                this run's class so no request spins waiting for a lane slot
+        """
+        if not ASYNC_OPENAI_AVAILABLE:
+            raise ImportError("openai>=1.0 is required for async mode. Install with: pip install --upgrade openai")
+
+        self.client = AsyncOpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+        self.max_in_flight = max_in_flight or int(os.getenv('OPENAI_MAX_IN_FLIGHT', str(DEFAULT_MAX_IN_FLIGHT)))
+        lane_capacity = get_priority_lanes().capacity('llm')
+        if lane_capacity and self.max_in_flight > lane_capacity:
+            print(f"⚡ Capping OpenAI requests in flight at {lane_capacity}, the llm lane's slots for "
+                  f"{current_priority()} runs")
+            self.max_in_flight = lane_capacity
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.seconds = 0.0
+
+    async def _call(self, create, request: Dict[str, Any]):
+        """Run one OpenAI request once a slot and rate limit budget are free, and track concurrency."""
+        async with self.semaphore:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            start_time = time.time()
+            try:
+                return await rate_limited_async(create, request)
+            finally:
+                self.in_flight -= 1
+                self.calls += 1
+                self.seconds += time.time() - start_time
+
+    async def chat(self, **request) -> str:
+        """
+        Run a chat completion.
+
+        Args:
+            **request: chat.completions.create arguments (model, messages, max_tokens, ...)
+
+        Returns:
+            str: The first choice's message content
+        """
+        response = await self._call(self.client.chat.completions.create, request)
+        return response.choices[0].message.content
+
+    async def generate_image(self, **request):
+        """
+        Run an image generation.
+
+        Args:
+            **request: images.generate arguments (model, prompt, size, n)
+
+        Returns:
+            The images.generate response
+        """
+        return await self._call(self.client.images.generate, request)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get request counts, peak concurrency and total request time."""
+        return {
+            'calls': self.calls,
+            'max_in_flight': self.max_in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'request_seconds': round(self.seconds, 2),
+        }
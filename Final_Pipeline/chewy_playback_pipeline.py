@@ -11,10 +11,12 @@ Orchestrates the flow of data through all agents, pulling data directly from Sno
 import os
 import sys
 import json
+import asyncio
 import shutil
 import requests
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 # Add agent directories to path
@@ -29,8 +31,15 @@ from Agents.Narrative_Generation_Agent.pet_letter_llm_system import PetLetterLLM
 from Agents.Review_and_Order_Intelligence_Agent.add_confidence_score import ConfidenceScoreCalculator
 from Agents.Breed_Predictor_Agent.breed_predictor_agent import BreedPredictorAgent
 from Agents.Review_and_Order_Intelligence_Agent.unknowns_analyzer import UnknownsAnalyzer
-from Agents.Image_Generation_Agent.image_generation_agent import generate_image_from_prompt
-from snowflake_data_connector import SnowflakeDataConnector
+from Agents.Image_Generation_Agent.image_generation_agent import generate_image_from_prompt, generate_image_from_prompt_async
+from snowflake_data_connector import SnowflakeDataConnector, CustomerQueryResults, CustomerDataView
+from stage_graph import StageGraph
+from async_llm import AsyncLLMClient
+from pipeline_checkpoint import CustomerCheckpoint, fingerprint
+from customer_input import iter_customer_ids, select_customers, batched, parse_shard
+from openai_rate_limiter import rate_limited, get_rate_limiter
+from priority_lanes import PRIORITIES, BULK, set_priority, current_priority, get_priority_lanes
+from run_deadline import RunDeadline, ESTIMATED_SECONDS, set_run_deadline, resolve_deadline_seconds
 import openai
 from dotenv import load_dotenv
 from decimal import Decimal
@@ -52,8 +61,46 @@ class ChewyPlaybackPipeline:
     Unified pipeline that orchestrates all agents and pulls data directly from Snowflake.
     """
     
-    def __init__(self, openai_api_key: str = None):
-        """Initialize the pipeline with all agents and Snowflake connector."""
+    # Query templates each stage reads. Templates are fetched the first time a stage asks
+    # for them, so customers who drop out at the playback gate never run the later ones.
+    STAGE_QUERIES = {
+        'intelligence': ['get_cust_orders', 'get_cust_reviews', 'get_pet_profiles'],
+        'narrative': ['get_cust_zipcode'],
+        'consolidated_queries': ['get_amt_donated', 'get_cudd_month', 'get_total_months',
+                                 'get_autoship_savings', 'get_most_ordered', 'get_yearly_food_count'],
+        'food_analyzer': ['get_yearly_food_count', 'get_cust_zipcode'],
+    }
+    
+    # Query results each stage's input fingerprint covers (alongside the enriched profile for
+    # breed and narrative). Image generation is fingerprinted on the ZIP aesthetics and pet
+    # details it draws; the analyzers make no LLM calls and always rerun.
+    FINGERPRINT_QUERIES = {
+        'intelligence': ['get_cust_orders', 'get_cust_reviews', 'get_pet_profiles'],
+        'breed': ['get_cust_orders'],
+        'narrative': ['get_cust_orders', 'get_cust_reviews', 'get_cust_zipcode'],
+    }
+    
+    def __init__(self, openai_api_key: str = None, data_connector: SnowflakeDataConnector = None,
+                 workers: int = None, max_in_flight: int = None, resume: bool = False,
+                 incremental: bool = True, deadline_seconds: float = None):
+        """
+        Initialize the pipeline with all agents and Snowflake connector.
+        
+        Args:
+            openai_api_key (str, optional): OpenAI API key. Defaults to OPENAI_API_KEY
+            data_connector (SnowflakeDataConnector, optional): Data source to use instead of
+                Snowflake, e.g. a LocalDataConnector over fixture files
+            workers (int, optional): Customers processed at once. Defaults to PIPELINE_WORKERS or 1
+            max_in_flight (int, optional): OpenAI requests in flight at once in async mode.
+                Defaults to OPENAI_MAX_IN_FLIGHT or 64
+            resume (bool): Reuse the stage results checkpointed by earlier runs instead of
+                recomputing them
+            incremental (bool): Reuse a checkpointed stage result when the stage's inputs
+                fingerprint the same as when it was computed
+            deadline_seconds (float, optional): Latency budget per run; work that doesn't fit
+                is postponed until the run's results are saved. Defaults to PIPELINE_DEADLINE_SECONDS,
+                or 30 seconds for interactive runs; 0 for none
+        """
         # Load environment variables
         load_dotenv()
         
@@ -69,7 +116,7 @@ class ChewyPlaybackPipeline:
         self.openai_client = openai.OpenAI(api_key=self.openai_api_key)
         
         # Initialize Snowflake connector
-        self.snowflake_connector = SnowflakeDataConnector()
+        self.snowflake_connector = data_connector or SnowflakeDataConnector()
         
         # Initialize agents
         self.review_agent = ReviewOrderIntelligenceAgent(self.openai_api_key)
@@ -82,36 +129,106 @@ class ChewyPlaybackPipeline:
         
         # Data caching to avoid running the same Snowflake queries multiple times
         self._customer_data_cache = {}
+        # Formatted frames per customer, built once from the cached query results
+        self._customer_views = {}
+        
+        # Customers run side by side on a thread pool; the work is I/O-bound (Snowflake and OpenAI)
+        self.workers = workers or int(os.getenv('PIPELINE_WORKERS', '1'))
+        # Customer ID -> "stage: error" for customers whose processing failed this run
+        self.failed_customers = {}
+        # Async mode (run_pipeline_async) bounds OpenAI requests instead of customers
+        self.max_in_flight = max_in_flight
+        self.llm_stats = {}
+        # Stage results are always checkpointed under Output/<customer_id>/.pipeline_state;
+        # resuming reuses them as they are, incremental runs only when their inputs are unchanged
+        self.resume = resume
+        self.incremental = incremental
+        # Each run's latency budget starts in _start_run; stages it cuts short are recorded
+        # per customer in postponed and completed after the run's results are saved
+        self.deadline_seconds = deadline_seconds
+        self.deadline = None
+        self.postponed = {}
+        self.deadline_stats = {}
         
         print("✅ Pipeline initialized with all agents and Snowflake connector")
     
     def _get_all_customer_data(self, customer_id: str) -> Dict[str, Any]:
         """
-        Get ALL customer data from Snowflake once and cache it.
-        This prevents redundant queries by fetching everything in one go.
+        Get ALL customer data, fetching whichever templates haven't been fetched yet.
+        Prefer _get_cached_customer_data with the query keys a stage actually needs.
         """
-        cache_key = (customer_id, None)  # Single cache entry per customer
+        return self._get_cached_customer_data(customer_id)
+
+    def prefetch_customer_data(self, customer_ids: List[str], query_keys: list = None):
+        """
+        Fetch data for many customers with one bulk query per template and cache it.
+        Customers that already have every requested result cached are skipped. If the
+        bulk fetch fails, the per-customer path in _get_cached_customer_data is used as before.
+        """
+        query_keys = self._known_query_keys(query_keys)
+        missing_ids = [cid for cid in customer_ids if self._missing_query_keys(cid, query_keys)]
+        if len(missing_ids) < 2:
+            return
         
+        print(f"\n📦 Prefetching {len(query_keys)} queries for {len(missing_ids)} customers with bulk queries...")
+        try:
+            bulk_data = self.snowflake_connector.get_customer_data_bulk(missing_ids, query_keys=query_keys)
+        except Exception as e:
+            print(f"⚠️ Bulk prefetch failed, falling back to per-customer queries: {e}")
+            return
+        
+        for customer_id, customer_data in bulk_data.items():
+            self._merge_customer_data(customer_id, customer_data)
+        print(f"✅ Cached {len(query_keys)} query results for {len(bulk_data)} customers from bulk queries")
+
+    def _known_query_keys(self, query_keys: list = None) -> List[str]:
+        """Requested query keys that have a template (all templates if None)."""
+        if query_keys is None:
+            return list(self.snowflake_connector.customer_queries.keys())
+        return [key for key in query_keys if key in self.snowflake_connector.customer_queries]
+
+    def _missing_query_keys(self, customer_id: str, query_keys: List[str]) -> List[str]:
+        """Query keys not yet fetched for a customer."""
+        customer_data = self._customer_data_cache.get((customer_id, None))
+        if customer_data is None:
+            return list(query_keys)
+        return [key for key in query_keys if key not in customer_data]
+
+    def _merge_customer_data(self, customer_id: str, customer_data: Dict[str, Any]):
+        """Add newly fetched query results to a customer's cache entry."""
+        cache_key = (customer_id, None)  # Single cache entry per customer
         if cache_key not in self._customer_data_cache:
-            print(f"    🔍 Fetching ALL data from Snowflake for customer {customer_id}...")
-            # Fetch all queries at once
-            customer_data = self.snowflake_connector.get_customer_data(customer_id)
             self._customer_data_cache[cache_key] = customer_data
-            print(f"    ✅ Cached ALL data for customer {customer_id} ({len(customer_data)} query results)")
         else:
-            print(f"    📋 Using cached ALL data for customer {customer_id}")
-        
-        return self._customer_data_cache[cache_key]
+            self._customer_data_cache[cache_key].update(customer_data)
+            if customer_id in self._customer_views:
+                self._customer_views[customer_id].invalidate(customer_data.keys())
+
+    def _get_customer_view(self, customer_id: str, query_keys: List[str]) -> CustomerDataView:
+        """Get the customer's formatted view, making sure the given query results are fetched."""
+        self._get_cached_customer_data(customer_id, query_keys=query_keys)
+        customer_data = self._customer_data_cache[(customer_id, None)]
+        view = self._customer_views.get(customer_id)
+        if view is None or view.customer_data is not customer_data:
+            view = CustomerDataView(self.snowflake_connector, customer_id, customer_data)
+            self._customer_views[customer_id] = view
+        return view
 
     def _get_cached_customer_data(self, customer_id: str, query_keys: list = None) -> Dict[str, Any]:
         """
-        Get customer data from cache or fetch from Snowflake if not cached.
+        Get customer data from cache, fetching only the requested templates not cached yet.
         This prevents running the same queries multiple times for the same customer.
         """
-        # Use the optimized method that fetches all data once
-        all_customer_data = self._get_all_customer_data(customer_id)
+        missing_keys = self._missing_query_keys(customer_id, self._known_query_keys(query_keys))
+        if missing_keys:
+            print(f"    🔍 Fetching {len(missing_keys)} queries from Snowflake for customer {customer_id}: {', '.join(missing_keys)}")
+            self._merge_customer_data(customer_id, self.snowflake_connector.get_customer_data(customer_id, query_keys=missing_keys))
+        all_customer_data = self._customer_data_cache[(customer_id, None)]
         
         # If specific query keys requested, filter the data
+        if query_keys and isinstance(all_customer_data, CustomerQueryResults):
+            # Keep Arrow-backed frames without converting them to rows
+            return all_customer_data.subset(query_keys)
         if query_keys:
             filtered_data = {}
             for key in query_keys:
@@ -123,61 +240,60 @@ class ChewyPlaybackPipeline:
     
     def _get_cached_customer_orders_dataframe(self, customer_id: str, query_keys: list = None) -> pd.DataFrame:
         """Get customer orders dataframe from cached data."""
-        customer_data = self._get_cached_customer_data(customer_id, query_keys=query_keys or ['get_cust_orders'])
-        formatted_data = self.snowflake_connector.format_data_for_pipeline(customer_id, customer_data)
-        if formatted_data['order_data'] and len(formatted_data['order_data']) > 0:
-            return pd.DataFrame(formatted_data['order_data'])
-        else:
-            return pd.DataFrame()
+        return self._get_customer_view(customer_id, query_keys or ['get_cust_orders']).frame('order_data')
     
     def _get_cached_customer_reviews_dataframe(self, customer_id: str, query_keys: list = None) -> pd.DataFrame:
         """Get customer reviews dataframe from cached data."""
-        customer_data = self._get_cached_customer_data(customer_id, query_keys=query_keys or ['get_cust_reviews'])
-        formatted_data = self.snowflake_connector.format_data_for_pipeline(customer_id, customer_data)
-        if formatted_data['review_data'] and len(formatted_data['review_data']) > 0:
-            return pd.DataFrame(formatted_data['review_data'])
-        else:
-            return pd.DataFrame()
+        return self._get_customer_view(customer_id, query_keys or ['get_cust_reviews']).frame('review_data')
     
     def _get_cached_customer_pets_dataframe(self, customer_id: str, query_keys: list = None) -> pd.DataFrame:
         """Get customer pets dataframe from cached data."""
-        customer_data = self._get_cached_customer_data(customer_id, query_keys=query_keys or ['get_pet_profiles'])
-        formatted_data = self.snowflake_connector.format_data_for_pipeline(customer_id, customer_data)
-        if formatted_data['pet_data'] and len(formatted_data['pet_data']) > 0:
-            return pd.DataFrame(formatted_data['pet_data'])
-        else:
-            return pd.DataFrame()
+        return self._get_customer_view(customer_id, query_keys or ['get_pet_profiles']).frame('pet_data')
     
     def _get_cached_customer_address(self, customer_id: str, query_keys: list = None) -> Dict[str, str]:
         """Get customer address from cached data."""
-        customer_data = self._get_cached_customer_data(customer_id, query_keys=query_keys or ['get_cust_zipcode'])
-        address_data = customer_data.get('get_cust_zipcode', [])
-        if address_data:
-            return {
-                'zip_code': str(address_data[0].get('CUSTOMER_ADDRESS_ZIP', '')),
-                'city': str(address_data[0].get('CUSTOMER_ADDRESS_CITY', ''))
-            }
-        return {'zip_code': '', 'city': ''}
+        return self._get_customer_view(customer_id, query_keys or ['get_cust_zipcode']).address()
+    
+    @staticmethod
+    def _count_order_lines(orders_df: pd.DataFrame) -> int:
+        """Count order lines, whether orders come one row per line or pre-summed per product."""
+        if orders_df.empty:
+            return 0
+        if 'LineCount' in orders_df.columns:
+            return int(orders_df['LineCount'].sum())
+        return len(orders_df)
+    
+    @staticmethod
+    def _top_ordered(orders_df: pd.DataFrame, column: str, limit: int = 10) -> Dict[str, int]:
+        """Rank a column's values by quantity ordered, whether orders come one row per line or pre-summed per product."""
+        if 'Quantity' in orders_df.columns:
+            totals = pd.to_numeric(orders_df['Quantity'], errors='coerce').fillna(1).groupby(orders_df[column]).sum()
+            return {value: int(quantity) for value, quantity in totals.nlargest(limit).items()}
+        return {value: int(count) for value, count in orders_df[column].value_counts().head(limit).items()}
     
     def clear_cache(self):
         """Clear the customer data cache."""
         self._customer_data_cache.clear()
+        self._customer_views.clear()
         print("✅ Customer data cache cleared")
     
-    def get_cache_stats(self) -> Dict[str, int]:
-        """Get cache statistics."""
-        total_queries_saved = 0
-        for cache_key, cache_data in self._customer_data_cache.items():
-            customer_id, query_keys = cache_key
-            if query_keys is None:  # Single entry per customer
-                total_queries_saved += 10  # All 10 queries saved
-            else:  # Legacy multiple entries
-                total_queries_saved += len(query_keys)
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Get cache statistics, including query executions and cache hits recorded by the connector."""
+        templates_per_customer = len(self.snowflake_connector.customer_queries)
+        total_queries_fetched = sum(len(cache_data) for cache_data in self._customer_data_cache.values())
+        total_queries_skipped = len(self._customer_data_cache) * templates_per_customer - total_queries_fetched
+        query_totals = self.snowflake_connector.telemetry.totals()
         
         return {
+            'query_executions': query_totals['executions'],
+            'query_cache_hits': query_totals['cache_hits'],
+            'query_cache_hit_ratio': query_totals['cache_hit_ratio'],
+            'query_seconds': query_totals['query_seconds'],
             'cached_customers': len(self._customer_data_cache),
-            'total_queries_saved': total_queries_saved,
-            'cache_efficiency': f"{(total_queries_saved / (len(self._customer_data_cache) * 10)) * 100:.1f}%" if self._customer_data_cache else "0%"
+            'total_queries_fetched': total_queries_fetched,
+            # Templates no stage asked for, e.g. generic stats for customers without playback
+            'total_queries_skipped': total_queries_skipped,
+            'fetch_ratio': f"{(total_queries_fetched / (len(self._customer_data_cache) * templates_per_customer)) * 100:.1f}%" if self._customer_data_cache else "0%"
         }
     
     def preprocess_data(self):
@@ -201,39 +317,65 @@ class ChewyPlaybackPipeline:
             print(f"Processing {len(customer_ids)} specified customers...")
             results = {}
             
-            for customer_id in customer_ids:
-                try:
-                    has_reviews = self._check_customer_has_reviews(customer_id)
-                    
-                    if has_reviews:
-                        print(f"  🐾 Customer {customer_id} has reviews - using Review and Order Intelligence Agent")
-                        # Use the review-based agent
-                        customer_result = self._run_review_agent_for_customer(customer_id)
-                        # Add agent type indicator
-                        if isinstance(customer_result, dict):
-                            customer_result['_agent_type'] = 'review_based'
-                        # Always add the result, even if empty (no pets)
-                        results[customer_id] = customer_result
-                    else:
-                        print(f"  🐾 Customer {customer_id} has no reviews - using Order Intelligence Agent")
-                        # Use the order-only agent
-                        customer_result = self._run_order_agent_for_customer(customer_id)
-                        # Add agent type indicator
-                        if isinstance(customer_result, dict):
-                            customer_result['_agent_type'] = 'order_based'
-                        # Always add the result, even if empty (no pets)
-                        results[customer_id] = customer_result
-                    
-                except Exception as e:
-                    print(f"  ❌ Error processing customer {customer_id}: {e}")
-                    continue
+            reused_profiles, input_fingerprints = self._reused_profiles(customer_ids)
+            pending_ids = [customer_id for customer_id in customer_ids if customer_id not in reused_profiles]
+            # Customers that fail are left out of the results (and recorded in failed_customers)
+            results = self._map_customers('intelligence', self._run_intelligence_for_customer, pending_ids)
         else:
             # Process all customers - this would be more complex, so for now we'll skip
             print("Processing all customers is not supported in this version. Please specify individual customer IDs.")
-            results = {}
+            reused_profiles, input_fingerprints, results = {}, {}, {}
         
         print(f"✅ Generated profiles for {len(results)} customers")
+        return self._checkpoint_profiles(customer_ids or [], reused_profiles,
+                                         self._add_confidence_scores(results), input_fingerprints)
+    
+    def _reused_profiles(self, customer_ids: List[str]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Get the checkpointed enriched profiles that can be reused (resuming, or unchanged inputs).
+        
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, str]]: (customer ID -> reused profile, customer ID ->
+                input fingerprint for the customers whose intelligence stage has to run)
+        """
+        reused_profiles, input_fingerprints = {}, {}
+        for customer_id in customer_ids:
+            found, profile, input_fingerprint = self._reused_stage(
+                customer_id, 'intelligence', lambda: [self._fingerprint_rows(customer_id, 'intelligence')], quiet=True)
+            if found:
+                reused_profiles[customer_id] = profile
+            else:
+                input_fingerprints[customer_id] = input_fingerprint
+        if reused_profiles:
+            print(f"  ♻️ Reusing intelligence results for {len(reused_profiles)} customers")
+        return reused_profiles, input_fingerprints
+    
+    def _checkpoint_profiles(self, customer_ids: List[str], reused_profiles: Dict[str, Any],
+                             profiles: Dict[str, Any], input_fingerprints: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Checkpoint newly scored profiles and merge them with the reused ones.
         
+        Returns:
+            Dict[str, Any]: Customer ID -> enriched profile, in the order given
+        """
+        for customer_id, profile in profiles.items():
+            if not self._profile_complete(profile):
+                # Its inputs won't change, so a checkpoint would keep the gap until --force
+                print(f"  ⚠️ Not checkpointing customer {customer_id}'s profile: analysis failed for "
+                      f"{', '.join(profile['pets']['_failed_pets'])}")
+                continue
+            self._checkpoint(customer_id).save('intelligence', profile, input_fingerprints.get(customer_id))
+        return {customer_id: reused_profiles.get(customer_id, profiles.get(customer_id))
+                for customer_id in customer_ids if customer_id in reused_profiles or customer_id in profiles}
+    
+    @staticmethod
+    def _profile_complete(profile: Dict[str, Any]) -> bool:
+        """Whether every pet's analysis succeeded (the review agent leaves failed pets out and lists them)."""
+        pets_data = profile.get('pets') if isinstance(profile, dict) else None
+        return not (isinstance(pets_data, dict) and pets_data.get('_failed_pets'))
+    
+    def _add_confidence_scores(self, results: Dict[str, Any]) -> Dict[str, Any]:
+        """Score each customer's pets and set the gets_playback and gets_personalized flags."""
         # Add confidence scores to all results
         print("\n🎯 Adding confidence scores to profiles...")
         calculator = ConfidenceScoreCalculator()
@@ -284,7 +426,7 @@ class ChewyPlaybackPipeline:
                 # Check if customer has enough orders for personalized playback
                 try:
                     orders_df = self._get_cached_customer_orders_dataframe(customer_id, query_keys=['get_cust_orders'])
-                    order_count = len(orders_df)
+                    order_count = self._count_order_lines(orders_df)
                     if order_count >= 5:
                         gets_personalized = True
                         print(f"    ✅ Customer {customer_id} has {order_count} orders - eligible for personalized playback")
@@ -312,6 +454,27 @@ class ChewyPlaybackPipeline:
         print("✅ Confidence scores added to all profiles")
         return results
     
+    def _run_intelligence_for_customer(self, customer_id: str) -> Dict[str, Any]:
+        """Run the review-based or order-only intelligence agent for one customer."""
+        has_reviews = self._check_customer_has_reviews(customer_id)
+        
+        if has_reviews:
+            print(f"  🐾 Customer {customer_id} has reviews - using Review and Order Intelligence Agent")
+            # Use the review-based agent
+            customer_result = self._run_review_agent_for_customer(customer_id)
+            # Add agent type indicator
+            if isinstance(customer_result, dict):
+                customer_result['_agent_type'] = 'review_based'
+        else:
+            print(f"  🐾 Customer {customer_id} has no reviews - using Order Intelligence Agent")
+            # Use the order-only agent
+            customer_result = self._run_order_agent_for_customer(customer_id)
+            # Add agent type indicator
+            if isinstance(customer_result, dict):
+                customer_result['_agent_type'] = 'order_based'
+        # Always return the result, even if empty (no pets)
+        return customer_result
+    
     def _run_review_agent_for_customer(self, customer_id: str) -> Dict[str, Any]:
         """Run the Review and Order Intelligence Agent for a specific customer using cached data, always using structured Snowflake pet profile fields as primary source."""
         print(f"    📋 Using cached data for customer {customer_id}...")
@@ -339,32 +502,11 @@ class ChewyPlaybackPipeline:
     
     def _analyze_orders_with_llm(self, orders_df: pd.DataFrame, customer_id: str) -> Dict[str, Any]:
         """Analyze customer orders using LLM to generate pet insights."""
-        if orders_df.empty:
-            raise ValueError(f"No order data available for customer {customer_id}. LLM analysis requires order data.")
-        
-        # Prepare context from order data
-        context = self._prepare_order_context(orders_df)
-        
-        # Create analysis prompt
-        prompt = self._create_analysis_prompt(context, customer_id)
+        request = self._order_analysis_request(orders_df, customer_id)
         
         try:
             # Call OpenAI API
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an AI expert at analyzing pet product orders to understand pets and their preferences. Provide insights based only on order history data."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0.3
-            )
+            response = rate_limited(self.openai_client.chat.completions.create, request)
             
             result = response.choices[0].message.content
             return self._parse_llm_response(result, customer_id)
@@ -373,28 +515,65 @@ class ChewyPlaybackPipeline:
             print(f"❌ CRITICAL: LLM analysis failed for customer {customer_id}: {e}")
             raise RuntimeError(f"LLM analysis failed for customer {customer_id}. This pipeline requires LLM analysis to function properly.")
     
+    async def _analyze_orders_with_llm_async(self, orders_df: pd.DataFrame, customer_id: str, llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Async version of _analyze_orders_with_llm."""
+        request = self._order_analysis_request(orders_df, customer_id)
+        try:
+            result = await llm.chat(**request)
+            return self._parse_llm_response(result, customer_id)
+        except Exception as e:
+            print(f"❌ CRITICAL: LLM analysis failed for customer {customer_id}: {e}")
+            raise RuntimeError(f"LLM analysis failed for customer {customer_id}. This pipeline requires LLM analysis to function properly.")
+    
+    def _order_analysis_request(self, orders_df: pd.DataFrame, customer_id: str) -> Dict[str, Any]:
+        """Build the chat completion request for order-based pet insights."""
+        if orders_df.empty:
+            raise ValueError(f"No order data available for customer {customer_id}. LLM analysis requires order data.")
+        
+        # Prepare context from order data
+        context = self._prepare_order_context(orders_df)
+        
+        # Create analysis prompt
+        prompt = self._create_analysis_prompt(context, customer_id)
+        return {
+            'model': "gpt-4o",
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "You are an AI expert at analyzing pet product orders to understand pets and their preferences. Provide insights based only on order history data."
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            'max_tokens': 1000,
+            'temperature': 0.3
+        }
+    
     def _prepare_order_context(self, orders_df: pd.DataFrame) -> str:
         """Prepare context data from order history for LLM analysis."""
         context_parts = []
         
         # Add order summary
         context_parts.append("Customer Order History:")
-        context_parts.append(f"Total Orders: {len(orders_df)}")
+        context_parts.append(f"Total Orders: {self._count_order_lines(orders_df)}")
         
-        # Most ordered products (using Snowflake format)
+        # Most ordered products (using Snowflake format); ranked by quantity, since the
+        # aggregated orders shape has one row per product
         if 'ProductName' in orders_df.columns:
-            products = orders_df['ProductName'].value_counts().head(10)
-            context_parts.append(f"Most Ordered Products: {dict(products)}")
+            products = self._top_ordered(orders_df, 'ProductName')
+            context_parts.append(f"Most Ordered Products: {products}")
         
         # Product categories (if available)
         if 'ProductCategory' in orders_df.columns:
-            categories = orders_df['ProductCategory'].value_counts().head(10)
-            context_parts.append(f"Top Product Categories: {dict(categories)}")
+            categories = self._top_ordered(orders_df, 'ProductCategory')
+            context_parts.append(f"Top Product Categories: {categories}")
         
         # Brands (if available)
         if 'Brand' in orders_df.columns:
-            brands = orders_df['Brand'].value_counts().head(10)
-            context_parts.append(f"Top Brands: {dict(brands)}")
+            brands = self._top_ordered(orders_df, 'Brand')
+            context_parts.append(f"Top Brands: {brands}")
         
         # Order dates (if available)
         if 'OrderDate' in orders_df.columns:
@@ -483,7 +662,11 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
         
         # Use consolidated LLM analysis method for order-based insights
         insights = self._analyze_orders_with_llm(orders_df, customer_id)
-        
+        return self._order_agent_results(customer_id, orders_df, pets_df, insights)
+    
+    def _order_agent_results(self, customer_id: str, orders_df: pd.DataFrame, pets_df: pd.DataFrame,
+                             insights: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the order agent's pet profiles from the Snowflake pet profiles and the LLM insights."""
         # Order Agent focuses on product-based insights, not behavioral analysis
         # Set personality traits to minimal since we don't have review data
         if 'PersonalityTraits' in insights:
@@ -532,7 +715,7 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
         else:
             # No pet profiles available - check if customer qualifies for generic playback
             print(f"    ⚠️ No pet profiles found for customer {customer_id}")
-            order_count = len(orders_df)
+            order_count = self._count_order_lines(orders_df)
             
             if order_count >= 5:
                 print(f"    ✅ Customer has {order_count} orders - eligible for generic playback")
@@ -567,71 +750,76 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
                 print(f"  ⏭️ Skipping narrative generation for generic customer {customer_id}")
                 continue
             
-            # Handle new structure where pets data might be nested
-            if isinstance(customer_data, dict) and 'pets' in customer_data:
-                pets_data = customer_data['pets']
-                customer_confidence_score = customer_data.get('cust_confidence_score', 0.0)
-            else:
-                # Handle old structure for backward compatibility
-                pets_data = customer_data
-                customer_confidence_score = 0.0
-            
+            pets_data, customer_confidence_score = self._narrative_pets(customer_data)
             try:
-                # Prepare data for the new narrative agent
-                pet_data = {customer_id: pets_data}
-                
-                # Always get order data for ZIP code extraction
-                orders = self._get_customer_orders_for_narrative(customer_id)
-                
-                # Check if customer has reviews
-                has_reviews = self._check_customer_has_reviews(customer_id)
-                
-                if has_reviews:
-                    # Get review data for this customer
-                    reviews = self._get_customer_reviews(customer_id)
-                    secondary_data = {"reviews": reviews, "order_history": orders}
-                else:
-                    # Use order data for narrative generation
-                    secondary_data = {"order_history": orders}
-                
                 # Generate narrative using the new agent
-                narrative_output = self.narrative_agent.generate_output(pet_data, secondary_data)
-                
-                # Extract ZIP aesthetics from the narrative agent
-                zip_aesthetics = narrative_output.get('zip_aesthetics', {})
-                
-                customer_narratives = {
-                    'customer_id': customer_id,
-                    'pets': pets_data,
-                    'collective_letter': narrative_output.get('letter', ''),
-                    'collective_visual_prompt': narrative_output.get('visual_prompt', ''),
-                    'personality_badge': narrative_output.get('personality_badge', {}),
-                    'zip_aesthetics': zip_aesthetics,
-                    'cust_confidence_score': customer_confidence_score
-                }
-                
-                print(f"    ✅ Generated collective letter from all pets")
-                print(f"    ✅ Generated collective visual prompt for all pets")
-                print(f"    🏆 Assigned personality badge: {narrative_output.get('personality_badge', {}).get('badge', 'Unknown')}")
-                
+                pet_data, secondary_data = self._narrative_inputs(customer_id, pets_data)
+                narrative_output = self.narrative_agent.generate_output(pet_data, secondary_data, deadline=self.deadline)
             except Exception as e:
                 print(f"    ❌ Error generating narratives: {e}")
-                # Don't create fake narratives - return empty results
-                customer_narratives = {
-                    'customer_id': customer_id,
-                    'pets': pets_data,
-                    'collective_letter': None,
-                    'collective_visual_prompt': None,
-                    'personality_badge': None,
-                    'zip_aesthetics': None,
-                    'cust_confidence_score': customer_confidence_score
-                }
-            
-            narrative_results[customer_id] = customer_narratives
+                narrative_output = None
+            narrative_results[customer_id] = self._customer_narratives(
+                customer_id, pets_data, customer_confidence_score, narrative_output)
         
         print(f"✅ Generated narratives for {len(narrative_results)} customers")
         return narrative_results
     
+    def _narrative_pets(self, customer_data: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        """Get a customer's pets and confidence score from the enriched profile."""
+        # Handle new structure where pets data might be nested
+        if isinstance(customer_data, dict) and 'pets' in customer_data:
+            return customer_data['pets'], customer_data.get('cust_confidence_score', 0.0)
+        # Handle old structure for backward compatibility
+        return customer_data, 0.0
+    
+    def _narrative_inputs(self, customer_id: str, pets_data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Prepare the pet data and the review/order data for the narrative agent."""
+        # Prepare data for the new narrative agent
+        pet_data = {customer_id: pets_data}
+        
+        # Always get order data for ZIP code extraction
+        orders = self._get_customer_orders_for_narrative(customer_id)
+        
+        # Check if customer has reviews
+        if self._check_customer_has_reviews(customer_id):
+            # Get review data for this customer
+            reviews = self._get_customer_reviews(customer_id)
+            return pet_data, {"reviews": reviews, "order_history": orders}
+        # Use order data for narrative generation
+        return pet_data, {"order_history": orders}
+    
+    def _customer_narratives(self, customer_id: str, pets_data: Dict[str, Any], customer_confidence_score: float,
+                             narrative_output: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build a customer's narrative result; empty fields when narrative generation failed."""
+        if narrative_output is None:
+            # Don't create fake narratives - return empty results
+            return {
+                'customer_id': customer_id,
+                'pets': pets_data,
+                'collective_letter': None,
+                'collective_visual_prompt': None,
+                'personality_badge': None,
+                'zip_aesthetics': None,
+                'cust_confidence_score': customer_confidence_score,
+                'degraded': []
+            }
+        
+        print(f"    ✅ Generated collective letter from all pets")
+        print(f"    ✅ Generated collective visual prompt for all pets")
+        print(f"    🏆 Assigned personality badge: {narrative_output.get('personality_badge', {}).get('badge', 'Unknown')}")
+        return {
+            'customer_id': customer_id,
+            'pets': pets_data,
+            'collective_letter': narrative_output.get('letter', ''),
+            'collective_visual_prompt': narrative_output.get('visual_prompt', ''),
+            'personality_badge': narrative_output.get('personality_badge', {}),
+            # Extract ZIP aesthetics from the narrative agent
+            'zip_aesthetics': narrative_output.get('zip_aesthetics', {}),
+            'cust_confidence_score': customer_confidence_score,
+            # Parts left out for the run's deadline (see PetLetterLLMSystem.generate_output)
+            'degraded': narrative_output.get('degraded', [])
+        }
+    
     def run_breed_predictor_agent(self, enriched_profiles: Dict[str, Any]) -> Dict[str, Any]:
         """Run the Breed Predictor Agent for dogs with unknown/mixed breeds using pipeline data."""
         print("\n🐕 Running Breed Predictor Agent...")
@@ -642,129 +830,28 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
         
         for customer_id, customer_data in enriched_profiles.items():
             print(f"  🔍 Checking pets for customer {customer_id}...")
-            
-            # Handle different data structures
-            if isinstance(customer_data, dict) and 'pets' in customer_data:
-                pets_data = customer_data['pets']
-            else:
-                pets_data = customer_data
+            customer_orders, eligible_pets, pets_checked = self._breed_prediction_candidates(customer_id, customer_data)
+            total_pets_checked += pets_checked
+            eligible_pets_found += len(eligible_pets)
             
             customer_predictions = []
-            
-            # Get order history from cached data (already loaded by pipeline)
-            orders_df = self._get_cached_customer_orders_dataframe(customer_id)
-            customer_orders = []
-            
-            if not orders_df.empty:
-                # Convert to format expected by breed predictor
-                for _, row in orders_df.iterrows():
-                    order = {
-                        'item_name': row.get('ProductName', 'Unknown'),
-                        'category': 'Unknown',
-                        'order_date': '',
-                        'quantity': row.get('Quantity', 1),
-                        'brand': 'Chewy'
-                    }
-                    customer_orders.append(order)
-            
-            # Check each pet in the enriched profile
-            for pet_name, pet_data in pets_data.items():
-                # Skip metadata fields that start with underscore (including generic playback)
-                if pet_name.startswith('_'):
-                    if pet_name == '_generic_playback_eligible':
-                        print(f"    ⏭️ {pet_name}: Skipped (generic playback customer - no breed prediction needed)")
-                    else:
-                        print(f"    ⏭️ {pet_name}: Skipped (metadata field)")
-                    continue
-                
-                # Ensure pet_data is a dictionary
-                if not isinstance(pet_data, dict):
-                    print(f"    ⏭️ {pet_name}: Skipped (not a dictionary)")
+            for pet_name, pet_profile in eligible_pets:
+                try:
+                    # Run breed prediction for this specific pet
+                    prediction_result = self.breed_predictor_agent.predict_breed_for_pet_with_orders(
+                        customer_id=customer_id,
+                        pet_name=pet_name,
+                        pet_data=pet_profile,
+                        customer_orders=customer_orders
+                    )
+                    self._add_breed_prediction(customer_predictions, customer_id, pet_name, prediction_result)
+                except Exception as e:
+                    print(f"      ❌ Error predicting breed for {pet_name}: {e}")
                     continue
-                
-                total_pets_checked += 1
-                
-                # Check if this pet qualifies for breed prediction
-                pet_type = pet_data.get('PetType', '').lower()
-                pet_breed = pet_data.get('Breed', '').lower()
-                
-                # Only predict for dogs with unknown/mixed breeds
-                is_dog = pet_type == 'dog'
-                unknown_indicators = ['mixed', 'unknown', 'mix', 'unk', 'null']
-                has_unknown_breed = (
-                    any(indicator in pet_breed.lower() for indicator in unknown_indicators) or 
-                    pet_breed.strip() == '' or
-                    pet_breed.lower() == 'unk'
-                )
-                
-                if is_dog and has_unknown_breed:
-                    eligible_pets_found += 1
-                    print(f"    🐕 {pet_name}: Eligible for breed prediction (Type: {pet_type}, Breed: {pet_breed})")
-                    
-                    try:
-                        # Prepare pet data for breed predictor
-                        pet_profile = {
-                            'PetName': pet_name,
-                            'PetType': pet_data.get('PetType', 'UNK'),
-                            'Breed': pet_data.get('Breed', 'UNK'),
-                            'Gender': pet_data.get('Gender', 'UNK'),
-                            'LifeStage': pet_data.get('LifeStage', 'UNK'),
-                            'SizeCategory': pet_data.get('SizeCategory', 'UNK'),
-                            'Weight': pet_data.get('Weight', 'UNK'),
-                            'confidence_score': pet_data.get('confidence_score', 0.0)
-                        }
-                        
-                        # Run breed prediction for this specific pet
-                        prediction_result = self.breed_predictor_agent.predict_breed_for_pet_with_orders(
-                            customer_id=customer_id,
-                            pet_name=pet_name,
-                            pet_data=pet_profile,
-                            customer_orders=customer_orders
-                        )
-                        
-                        if prediction_result:
-                            customer_predictions.append({
-                                'pet_name': pet_name,
-                                'customer_id': customer_id,
-                                'prediction': prediction_result,
-                                'timestamp': prediction_result.get('timestamp', ''),
-                                'predicted_breed': prediction_result.get('predicted_breed', 'Unknown'),
-                                'breed_percentages': prediction_result.get('breed_percentages', {}),
-                                'confidence_score': prediction_result.get('confidence', {}).get('score', 0),
-                                'confidence_level': prediction_result.get('confidence', {}).get('level', 'Unknown'),
-                                'reasoning': prediction_result.get('reasoning', 'No reasoning provided'),
-                                'data_used': prediction_result.get('data_used', {})
-                            })
-                            print(f"      ✅ Prediction completed for {pet_name}")
-                        else:
-                            print(f"      ⚠️ No prediction result for {pet_name}")
-                            
-                    except Exception as e:
-                        print(f"      ❌ Error predicting breed for {pet_name}: {e}")
-                        continue
-                        
-                else:
-                    # Log why pet was skipped
-                    if not is_dog:
-                        print(f"    ⏭️ {pet_name}: Skipped (not a dog, type: {pet_type})")
-                    elif not has_unknown_breed:
-                        print(f"    ⏭️ {pet_name}: Skipped (known breed: {pet_breed})")
             
-            # Save customer predictions if any were made
-            if customer_predictions:
-                # Use the first prediction for backward compatibility, but save all
-                if len(customer_predictions) == 1:
-                    breed_predictions[customer_id] = customer_predictions[0]
-                else:
-                    # Multiple predictions - save as list
-                    breed_predictions[customer_id] = {
-                        'customer_id': customer_id,
-                        'multiple_predictions': customer_predictions,
-                        'total_predictions': len(customer_predictions)
-                    }
-                print(f"    ✅ Saved {len(customer_predictions)} breed prediction(s) for customer {customer_id}")
-            else:
-                print(f"    ℹ️ No eligible pets found for customer {customer_id}")
+            customer_prediction = self._customer_breed_prediction(customer_id, customer_predictions)
+            if customer_prediction:
+                breed_predictions[customer_id] = customer_prediction
         
         print(f"\n📊 Breed Prediction Summary:")
         print(f"   Total pets checked: {total_pets_checked}")
@@ -773,6 +860,130 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
         print(f"✅ Breed predictions completed")
         return breed_predictions
     
+    def _breed_prediction_candidates(self, customer_id: str, customer_data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Tuple[str, Dict[str, Any]]], int]:
+        """
+        Find a customer's dogs with unknown/mixed breeds.
+        
+        Returns:
+            Tuple: (customer orders in the breed predictor's format, [(pet name, pet profile)] of
+                eligible pets, number of pets checked)
+        """
+        # Handle different data structures
+        if isinstance(customer_data, dict) and 'pets' in customer_data:
+            pets_data = customer_data['pets']
+        else:
+            pets_data = customer_data
+        
+        # Get order history from cached data (already loaded by pipeline)
+        orders_df = self._get_cached_customer_orders_dataframe(customer_id)
+        customer_orders = []
+        
+        if not orders_df.empty:
+            # Convert to format expected by breed predictor
+            for _, row in orders_df.iterrows():
+                order = {
+                    'item_name': row.get('ProductName', 'Unknown'),
+                    'category': 'Unknown',
+                    'order_date': '',
+                    'quantity': row.get('Quantity', 1),
+                    'brand': 'Chewy',
+                    'line_count': row.get('LineCount', 1)
+                }
+                customer_orders.append(order)
+        
+        eligible_pets = []
+        pets_checked = 0
+        # Check each pet in the enriched profile
+        for pet_name, pet_data in pets_data.items():
+            # Skip metadata fields that start with underscore (including generic playback)
+            if pet_name.startswith('_'):
+                if pet_name == '_generic_playback_eligible':
+                    print(f"    ⏭️ {pet_name}: Skipped (generic playback customer - no breed prediction needed)")
+                else:
+                    print(f"    ⏭️ {pet_name}: Skipped (metadata field)")
+                continue
+            
+            # Ensure pet_data is a dictionary
+            if not isinstance(pet_data, dict):
+                print(f"    ⏭️ {pet_name}: Skipped (not a dictionary)")
+                continue
+            
+            pets_checked += 1
+            
+            # Check if this pet qualifies for breed prediction
+            pet_type = pet_data.get('PetType', '').lower()
+            pet_breed = pet_data.get('Breed', '').lower()
+            
+            # Only predict for dogs with unknown/mixed breeds
+            is_dog = pet_type == 'dog'
+            unknown_indicators = ['mixed', 'unknown', 'mix', 'unk', 'null']
+            has_unknown_breed = (
+                any(indicator in pet_breed.lower() for indicator in unknown_indicators) or 
+                pet_breed.strip() == '' or
+                pet_breed.lower() == 'unk'
+            )
+            
+            if is_dog and has_unknown_breed:
+                print(f"    🐕 {pet_name}: Eligible for breed prediction (Type: {pet_type}, Breed: {pet_breed})")
+                
+                # Prepare pet data for breed predictor
+                eligible_pets.append((pet_name, {
+                    'PetName': pet_name,
+                    'PetType': pet_data.get('PetType', 'UNK'),
+                    'Breed': pet_data.get('Breed', 'UNK'),
+                    'Gender': pet_data.get('Gender', 'UNK'),
+                    'LifeStage': pet_data.get('LifeStage', 'UNK'),
+                    'SizeCategory': pet_data.get('SizeCategory', 'UNK'),
+                    'Weight': pet_data.get('Weight', 'UNK'),
+                    'confidence_score': pet_data.get('confidence_score', 0.0)
+                }))
+            else:
+                # Log why pet was skipped
+                if not is_dog:
+                    print(f"    ⏭️ {pet_name}: Skipped (not a dog, type: {pet_type})")
+                elif not has_unknown_breed:
+                    print(f"    ⏭️ {pet_name}: Skipped (known breed: {pet_breed})")
+        
+        return customer_orders, eligible_pets, pets_checked
+    
+    def _add_breed_prediction(self, customer_predictions: List[Dict[str, Any]], customer_id: str, pet_name: str,
+                              prediction_result: Optional[Dict[str, Any]]):
+        """Append a pet's breed prediction to the customer's predictions, when there is one."""
+        if not prediction_result:
+            print(f"      ⚠️ No prediction result for {pet_name}")
+            return
+        customer_predictions.append({
+            'pet_name': pet_name,
+            'customer_id': customer_id,
+            'prediction': prediction_result,
+            'timestamp': prediction_result.get('timestamp', ''),
+            'predicted_breed': prediction_result.get('predicted_breed', 'Unknown'),
+            'breed_percentages': prediction_result.get('breed_percentages', {}),
+            'confidence_score': prediction_result.get('confidence', {}).get('score', 0),
+            'confidence_level': prediction_result.get('confidence', {}).get('level', 'Unknown'),
+            'reasoning': prediction_result.get('reasoning', 'No reasoning provided'),
+            'data_used': prediction_result.get('data_used', {})
+        })
+        print(f"      ✅ Prediction completed for {pet_name}")
+    
+    def _customer_breed_prediction(self, customer_id: str, customer_predictions: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Combine a customer's pet predictions: the single prediction, or all of them when there are several."""
+        # Save customer predictions if any were made
+        if not customer_predictions:
+            print(f"    ℹ️ No eligible pets found for customer {customer_id}")
+            return None
+        
+        print(f"    ✅ Saved {len(customer_predictions)} breed prediction(s) for customer {customer_id}")
+        # Use the first prediction for backward compatibility, but save all
+        if len(customer_predictions) == 1:
+            return customer_predictions[0]
+        # Multiple predictions - save as list
+        return {
+            'customer_id': customer_id,
+            'multiple_predictions': customer_predictions,
+            'total_predictions': len(customer_predictions)
+        }
+    
     def _get_customer_reviews(self, customer_id: str) -> List[Dict[str, Any]]:
         """Get review data for a specific customer from cached data."""
         try:
@@ -831,21 +1042,7 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
             if collective_visual_prompt:
                 try:
                     # Extract specific pet data for hyper-specific instructions
-                    pets_data = customer_data.get('pets', {})
-                    pet_details = []
-                    for pet_name, pet_info in pets_data.items():
-                        if not pet_name.startswith('_'):  # Skip metadata fields
-                            pet_type = pet_info.get('PetType', 'unknown')
-                            breed = pet_info.get('Breed', 'unknown')
-                            weight = pet_info.get('Weight', 'unknown')
-                            age = pet_info.get('LifeStage', 'unknown')
-                            pet_details.append({
-                                'name': pet_name,
-                                'type': pet_type,
-                                'breed': breed,
-                                'weight': weight,
-                                'age': age
-                            })
+                    pet_details = self._image_pet_details(customer_data)
                     
                     # Use the superior image_generation_agent.py approach without visual prompt
                     image_url = generate_image_from_prompt(
@@ -872,169 +1069,186 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
         print(f"✅ Generated collective images for {len(image_results)} customers")
         return image_results
     
+    def _image_pet_details(self, customer_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Get the pet details the image prompt spells out (name, type, breed, weight, age)."""
+        pet_details = []
+        for pet_name, pet_info in customer_data.get('pets', {}).items():
+            if not pet_name.startswith('_'):  # Skip metadata fields
+                pet_details.append({
+                    'name': pet_name,
+                    'type': pet_info.get('PetType', 'unknown'),
+                    'breed': pet_info.get('Breed', 'unknown'),
+                    'weight': pet_info.get('Weight', 'unknown'),
+                    'age': pet_info.get('LifeStage', 'unknown')
+                })
+        return pet_details
+    
     def save_outputs(self, enriched_profiles: Dict[str, Any], 
                     narrative_results: Dict[str, Any], 
                     image_results: Dict[str, Any],
                     breed_predictions: Dict[str, Any] = None):
         """Save all outputs to the Output directory structure."""
         print("\n💾 Saving outputs...")
+        self._map_customers('save_outputs', lambda customer_id: self._save_customer_outputs(
+            customer_id, enriched_profiles, narrative_results, image_results, breed_predictions), list(enriched_profiles))
+    
+    def _save_customer_outputs(self, customer_id: str, enriched_profiles: Dict[str, Any],
+                               narrative_results: Dict[str, Any], image_results: Dict[str, Any],
+                               breed_predictions: Dict[str, Any] = None):
+        """Save one customer's profile, letters, badge, breed predictions and image to Output/<customer_id>."""
+        # Create customer directory
+        customer_dir = self.output_dir / customer_id
+        customer_dir.mkdir(exist_ok=True)
         
-        for customer_id in enriched_profiles.keys():
-            # Create customer directory
-            customer_dir = self.output_dir / customer_id
-            customer_dir.mkdir(exist_ok=True)
-            
-            # Handle new structure where pets data might be nested
-            customer_data = enriched_profiles[customer_id]
-            if isinstance(customer_data, dict) and 'pets' in customer_data:
-                pets_data = customer_data['pets']
-                customer_confidence_score = customer_data.get('cust_confidence_score', 0.0)
-            else:
-                # Handle old structure for backward compatibility
-                pets_data = customer_data
-                customer_confidence_score = 0.0
-            
-            # Save enriched pet profile JSON (include customer confidence score and flags)
-            profile_data = {
-                **pets_data,
-                'cust_confidence_score': customer_confidence_score,
-                'gets_playback': customer_data.get('gets_playback', False),
-                'gets_personalized': customer_data.get('gets_personalized', False)
+        # Handle new structure where pets data might be nested
+        customer_data = enriched_profiles[customer_id]
+        if isinstance(customer_data, dict) and 'pets' in customer_data:
+            pets_data = customer_data['pets']
+            customer_confidence_score = customer_data.get('cust_confidence_score', 0.0)
+        else:
+            # Handle old structure for backward compatibility
+            pets_data = customer_data
+            customer_confidence_score = 0.0
+        
+        # Save enriched pet profile JSON (include customer confidence score and flags)
+        profile_data = {
+            **pets_data,
+            'cust_confidence_score': customer_confidence_score,
+            'gets_playback': customer_data.get('gets_playback', False),
+            'gets_personalized': customer_data.get('gets_personalized', False)
+        }
+        
+        # Handle pet count analysis metadata from enhanced detection (read, not popped: a
+        # customer with postponed work is saved again from the same profile)
+        if '_pet_count_analysis' in pets_data:
+            pet_count_analysis = pets_data['_pet_count_analysis']
+            profile_data['pet_count_analysis'] = {
+                'original_counts': pet_count_analysis.get('original_counts', {}),
+                'detected_counts': pet_count_analysis.get('detected_counts', {}),
+                'updated_counts': pet_count_analysis.get('updated_counts', {}),
+                'additional_pets_detected': len(pet_count_analysis.get('additional_pets', []))
             }
-            
-            # Handle pet count analysis metadata from enhanced detection
-            if '_pet_count_analysis' in pets_data:
-                pet_count_analysis = pets_data.pop('_pet_count_analysis')
-                profile_data['pet_count_analysis'] = {
-                    'original_counts': pet_count_analysis.get('original_counts', {}),
-                    'detected_counts': pet_count_analysis.get('detected_counts', {}),
-                    'updated_counts': pet_count_analysis.get('updated_counts', {}),
-                    'additional_pets_detected': len(pet_count_analysis.get('additional_pets', []))
-                }
-            profile_path = customer_dir / "enriched_pet_profile.json"
-            with open(profile_path, 'w') as f:
-                json.dump(profile_data, f, indent=2)
-            
-            # Save letters (only for personalized playback)
-            if narrative_results[customer_id] and 'collective_letter' in narrative_results[customer_id]:
-                letters_path = customer_dir / "pet_letters.txt"
-                with open(letters_path, 'w') as f:
-                    f.write(narrative_results[customer_id]['collective_letter'])
-                    f.write("\n\n")
-            
-            # Save visual prompt (only for personalized playback)
-            if narrative_results[customer_id] and 'collective_visual_prompt' in narrative_results[customer_id]:
-                visual_prompt_path = customer_dir / "visual_prompt.txt"
-                with open(visual_prompt_path, 'w') as f:
-                    f.write(f"Visual Prompt for Customer {customer_id}\n")
-                    f.write("=" * 60 + "\n\n")
-                    f.write(narrative_results[customer_id]['collective_visual_prompt'])
-                    f.write("\n\n")
-            
-            # Save personality badge information (only for personalized playback)
-            if narrative_results[customer_id] and 'personality_badge' in narrative_results[customer_id]:
-                badge_info = narrative_results[customer_id]['personality_badge']
-                if badge_info:
-                    badge_path = customer_dir / "personality_badge.json"
-                    with open(badge_path, 'w') as f:
-                        json.dump(badge_info, f, indent=2)
-                    
-                    # Copy the badge image if it exists
-                    badge_icon = badge_info.get('icon_png', '')
-                    if badge_icon:
-                        source_badge_path = Path("Agents/Narrative_Generation_Agent") / badge_icon
-                        if source_badge_path.exists():
-                            dest_badge_path = customer_dir / badge_icon
-                            shutil.copy2(source_badge_path, dest_badge_path)
-                            print(f"    🏆 Saved personality badge: {badge_info.get('badge', 'Unknown')}")
-            
-            # Save ZIP aesthetics information (only for personalized playback)
-            if narrative_results[customer_id] and 'zip_aesthetics' in narrative_results[customer_id]:
-                zip_aesthetics = narrative_results[customer_id]['zip_aesthetics']
-                if zip_aesthetics:
-                    zip_aesthetics_path = customer_dir / "zip_aesthetics.json"
-                    with open(zip_aesthetics_path, 'w') as f:
-                        json.dump(zip_aesthetics, f, indent=2)
-                    print(f"    🗺️ Saved ZIP aesthetics: {zip_aesthetics.get('visual_style', 'Unknown')}, {zip_aesthetics.get('color_texture', 'Unknown')}, {zip_aesthetics.get('art_style', 'Unknown')}")
-            
-            # Save consolidated queries for ALL customers (both generic and personalized)
-            if customer_data.get('gets_playback', False):
-                try:
-                    # Get all 6 query data from cache
-                    query_data = self._get_cached_customer_data(customer_id, query_keys=[
-                        'get_amt_donated',
-                        'get_cudd_month', 
-                        'get_total_months',
-                        'get_autoship_savings',
-                        'get_most_ordered',
-                        'get_yearly_food_count'
-                    ])
+        
+        # Save letters (only for personalized playback; empty when generation failed or was postponed)
+        if narrative_results[customer_id] and narrative_results[customer_id].get('collective_letter'):
+            letters_path = customer_dir / "pet_letters.txt"
+            with open(letters_path, 'w') as f:
+                f.write(narrative_results[customer_id]['collective_letter'])
+                f.write("\n\n")
+        
+        # Save visual prompt (only for personalized playback; empty when generation failed or was postponed)
+        if narrative_results[customer_id] and narrative_results[customer_id].get('collective_visual_prompt'):
+            visual_prompt_path = customer_dir / "visual_prompt.txt"
+            with open(visual_prompt_path, 'w') as f:
+                f.write(f"Visual Prompt for Customer {customer_id}\n")
+                f.write("=" * 60 + "\n\n")
+                f.write(narrative_results[customer_id]['collective_visual_prompt'])
+                f.write("\n\n")
+        
+        # Save personality badge information (only for personalized playback)
+        if narrative_results[customer_id] and 'personality_badge' in narrative_results[customer_id]:
+            badge_info = narrative_results[customer_id]['personality_badge']
+            if badge_info:
+                badge_path = customer_dir / "personality_badge.json"
+                with open(badge_path, 'w') as f:
+                    json.dump(badge_info, f, indent=2)
+                
+                # Copy the badge image if it exists
+                badge_icon = badge_info.get('icon_png', '')
+                if badge_icon:
+                    source_badge_path = Path("Agents/Narrative_Generation_Agent") / badge_icon
+                    if source_badge_path.exists():
+                        dest_badge_path = customer_dir / badge_icon
+                        shutil.copy2(source_badge_path, dest_badge_path)
+                        print(f"    🏆 Saved personality badge: {badge_info.get('badge', 'Unknown')}")
+        
+        # Save ZIP aesthetics information (only for personalized playback)
+        if narrative_results[customer_id] and 'zip_aesthetics' in narrative_results[customer_id]:
+            zip_aesthetics = narrative_results[customer_id]['zip_aesthetics']
+            if zip_aesthetics:
+                zip_aesthetics_path = customer_dir / "zip_aesthetics.json"
+                with open(zip_aesthetics_path, 'w') as f:
+                    json.dump(zip_aesthetics, f, indent=2)
+                print(f"    🗺️ Saved ZIP aesthetics: {zip_aesthetics.get('visual_style', 'Unknown')}, {zip_aesthetics.get('color_texture', 'Unknown')}, {zip_aesthetics.get('art_style', 'Unknown')}")
+        
+        # Save consolidated queries for ALL customers (both generic and personalized)
+        if customer_data.get('gets_playback', False):
+            try:
+                # Get all 6 query data from cache
+                query_data = self._get_cached_customer_data(customer_id, query_keys=self.STAGE_QUERIES['consolidated_queries'])
+                
+                # Save consolidated queries to single JSON file
+                self._save_consolidated_queries(customer_id, query_data, customer_dir)
                     
-                    # Save consolidated queries to single JSON file
-                    self._save_consolidated_queries(customer_id, query_data, customer_dir)
-                        
-                except Exception as e:
-                    print(f"    ⚠️ Error saving consolidated queries for customer {customer_id}: {e}")
+            except Exception as e:
+                print(f"    ⚠️ Error saving consolidated queries for customer {customer_id}: {e}")
+        
+        # Save breed predictions if available
+        if breed_predictions and customer_id in breed_predictions:
+            breed_path = customer_dir / "predicted_breed.json"
+            with open(breed_path, 'w') as f:
+                json.dump(breed_predictions[customer_id], f, indent=2)
             
-            # Save breed predictions if available
-            if breed_predictions and customer_id in breed_predictions:
-                breed_path = customer_dir / "predicted_breed.json"
-                with open(breed_path, 'w') as f:
-                    json.dump(breed_predictions[customer_id], f, indent=2)
-                
-                # Handle new simplified format
-                if isinstance(breed_predictions[customer_id], dict) and 'pet_name' in breed_predictions[customer_id]:
-                    # New simplified format - single prediction
-                    pet_name = breed_predictions[customer_id]['pet_name']
-                    predicted_breed = breed_predictions[customer_id]['predicted_breed']
-                    # Handle nested confidence structure
-                    if 'prediction' in breed_predictions[customer_id] and 'confidence' in breed_predictions[customer_id]['prediction']:
-                        confidence = breed_predictions[customer_id]['prediction']['confidence'].get('score', 0)
-                    else:
-                        confidence = breed_predictions[customer_id].get('confidence_score', 0)
-                    print(f"    🐕 Saved breed prediction for {pet_name}: {predicted_breed} (confidence: {confidence})")
+            # Handle new simplified format
+            if isinstance(breed_predictions[customer_id], dict) and 'pet_name' in breed_predictions[customer_id]:
+                # New simplified format - single prediction
+                pet_name = breed_predictions[customer_id]['pet_name']
+                predicted_breed = breed_predictions[customer_id]['predicted_breed']
+                # Handle nested confidence structure
+                if 'prediction' in breed_predictions[customer_id] and 'confidence' in breed_predictions[customer_id]['prediction']:
+                    confidence = breed_predictions[customer_id]['prediction']['confidence'].get('score', 0)
                 else:
-                    # Old format - multiple predictions
-                    print(f"    🐕 Saved breed predictions for {len(breed_predictions[customer_id])} pets")
+                    confidence = breed_predictions[customer_id].get('confidence_score', 0)
+                print(f"    🐕 Saved breed prediction for {pet_name}: {predicted_breed} (confidence: {confidence})")
+            else:
+                # Old format - multiple predictions
+                print(f"    🐕 Saved breed predictions for {len(breed_predictions[customer_id])} pets")
+        
+        # Save collective image (handle both URL and base64 data)
+        if customer_id in image_results and image_results[customer_id]:
+            images_dir = customer_dir / "images"
+            images_dir.mkdir(exist_ok=True)
             
-            # Save collective image (handle both URL and base64 data)
-            if customer_id in image_results and image_results[customer_id]:
-                images_dir = customer_dir / "images"
-                images_dir.mkdir(exist_ok=True)
+            try:
+                image_path = images_dir / "collective_pet_portrait.png"
                 
-                try:
-                    image_path = images_dir / "collective_pet_portrait.png"
-                    
-                    if isinstance(image_results[customer_id], str):
-                        # Could be URL or base64 string
-                        if image_results[customer_id].startswith('http'):
-                            # URL response - download the image
-                            response = requests.get(image_results[customer_id])
-                            if response.status_code == 200:
-                                with open(image_path, 'wb') as f:
-                                    f.write(response.content)
-                                print(f"    💾 Saved collective image for all pets")
-                            else:
-                                print(f"    ❌ Failed to download image for customer {customer_id} (Status: {response.status_code})")
-                        else:
-                            # Base64 string - decode and save
-                            import base64
-                            image_bytes = base64.b64decode(image_results[customer_id])
+                if isinstance(image_results[customer_id], str):
+                    # Could be URL or base64 string
+                    if image_results[customer_id].startswith('http'):
+                        # URL response - download the image
+                        # Bounded, so a stalled download can't hold up the customer's save
+                        response = requests.get(image_results[customer_id], timeout=60)
+                        if response.status_code == 200:
                             with open(image_path, 'wb') as f:
-                                f.write(image_bytes)
+                                f.write(response.content)
                             print(f"    💾 Saved collective image for all pets")
-                    elif isinstance(image_results[customer_id], bytes):
-                        # Base64 bytes - save directly
+                        else:
+                            print(f"    ❌ Failed to download image for customer {customer_id} (Status: {response.status_code})")
+                    else:
+                        # Base64 string - decode and save
+                        import base64
+                        image_bytes = base64.b64decode(image_results[customer_id])
                         with open(image_path, 'wb') as f:
-                            f.write(image_results[customer_id])
+                            f.write(image_bytes)
                         print(f"    💾 Saved collective image for all pets")
-                    else:
-                        print(f"    ❌ Unknown image data type for customer {customer_id}: {type(image_results[customer_id])}")
-                except Exception as e:
-                    print(f"    ❌ Error saving collective image: {e}")
-            
-
-            print(f"  ✅ Saved outputs for customer {customer_id}")
+                elif isinstance(image_results[customer_id], bytes):
+                    # Base64 bytes - save directly
+                    with open(image_path, 'wb') as f:
+                        f.write(image_results[customer_id])
+                    print(f"    💾 Saved collective image for all pets")
+                else:
+                    print(f"    ❌ Unknown image data type for customer {customer_id}: {type(image_results[customer_id])}")
+            except Exception as e:
+                print(f"    ❌ Error saving collective image: {e}")
+        
+        # Save the enriched profile last: readers (the web app) take it to mean the customer is done.
+        # Serialize it before opening the file so a failure can't leave a truncated profile behind.
+        profile_json = json.dumps(profile_data, indent=2)
+        profile_path = customer_dir / "enriched_pet_profile.json"
+        with open(profile_path, 'w') as f:
+            f.write(profile_json)
+        self._checkpoint(customer_id).save('saved', True)
+        print(f"  ✅ Saved outputs for customer {customer_id}")
     
     def _save_consolidated_queries(self, customer_id: str, customer_data: Dict[str, Any], customer_dir: Path):
         """Save all 6 query outputs into a single JSON file named with the customer ID."""
@@ -1140,39 +1354,16 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
             
             # If no specific customers provided, analyze all processed customers
             if not customer_ids:
-                # Get all customer directories that have enriched profiles
-                customer_ids = []
-                for customer_dir in self.output_dir.iterdir():
-                    if customer_dir.is_dir() and customer_dir.name.isdigit():
-                        profile_path = customer_dir / "enriched_pet_profile.json"
-                        if profile_path.exists():
-                            customer_ids.append(customer_dir.name)
+                customer_ids = self._saved_customer_ids()
             
             total_unknowns = 0
             customers_with_unknowns = 0
             
             for customer_id in customer_ids:
-                analysis_results = analyzer.analyze_single_customer(customer_id, self.output_dir)
-                if analysis_results and analysis_results['total_unknowns'] > 0:
-                    # Save unknowns.json in the customer's directory
-                    customer_dir = self.output_dir / customer_id
-                    unknowns_path = customer_dir / "unknowns.json"
-                    success = analyzer.save_unknowns_json(analysis_results, unknowns_path)
-                    
-                    if success:
-                        total_unknowns += analysis_results['total_unknowns']
-                        customers_with_unknowns += 1
-                        print(f"  ✅ Customer {customer_id}: {analysis_results['total_unknowns']} unknowns")
-                        
-                        # Print details for each pet with unknowns
-                        for pet_name, pet_unknowns in analysis_results['unknown_attributes'].items():
-                            print(f"    🐾 {pet_name}:")
-                            if pet_unknowns['unknown_fields']:
-                                print(f"      Unknown fields: {', '.join(pet_unknowns['unknown_fields'])}")
-                    else:
-                        print(f"  ❌ Failed to save unknowns analysis for customer {customer_id}")
-                else:
-                    print(f"  ✅ Customer {customer_id}: No unknown attributes found")
+                unknowns = self._run_unknowns_for_customer(analyzer, customer_id)
+                if unknowns > 0:
+                    total_unknowns += unknowns
+                    customers_with_unknowns += 1
             
             if customers_with_unknowns > 0:
                 print(f"\n📊 Unknowns Analysis Summary:")
@@ -1183,60 +1374,48 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
                 
         except Exception as e:
             print(f"❌ Error running unknowns analyzer: {e}")
+    
+    def _run_unknowns_for_customer(self, analyzer: UnknownsAnalyzer, customer_id: str) -> int:
+        """
+        Analyze one customer's pet profiles for unknown attributes and save unknowns.json.
+        
+        Returns:
+            int: Number of unknown attributes saved (0 when none were found or saving failed)
+        """
+        analysis_results = analyzer.analyze_single_customer(customer_id, self.output_dir)
+        if not analysis_results or analysis_results['total_unknowns'] == 0:
+            print(f"  ✅ Customer {customer_id}: No unknown attributes found")
+            return 0
+        
+        # Save unknowns.json in the customer's directory
+        unknowns_path = self.output_dir / customer_id / "unknowns.json"
+        if not analyzer.save_unknowns_json(analysis_results, unknowns_path):
+            print(f"  ❌ Failed to save unknowns analysis for customer {customer_id}")
+            return 0
+        
+        print(f"  ✅ Customer {customer_id}: {analysis_results['total_unknowns']} unknowns")
+        # Print details for each pet with unknowns
+        for pet_name, pet_unknowns in analysis_results['unknown_attributes'].items():
+            print(f"    🐾 {pet_name}:")
+            if pet_unknowns['unknown_fields']:
+                print(f"      Unknown fields: {', '.join(pet_unknowns['unknown_fields'])}")
+        return analysis_results['total_unknowns']
 
     def run_food_consumption_analyzer(self, customer_ids: List[str] = None):
         """Run the Food Consumption Analyzer to generate fun facts about food consumption."""
         print("\n🍽️ Running Food Consumption Analyzer...")
         
         try:
-            # Import the food consumption analyzer
-            from Agents.Review_and_Order_Intelligence_Agent.food_consumption_analyzer import generate_food_fun_fact_json
-            
             # If no specific customers provided, analyze all processed customers
             if not customer_ids:
-                # Get all customer directories that have enriched profiles
-                customer_ids = []
-                for customer_dir in self.output_dir.iterdir():
-                    if customer_dir.is_dir() and customer_dir.name.isdigit():
-                        profile_path = customer_dir / "enriched_pet_profile.json"
-                        if profile_path.exists():
-                            customer_ids.append(customer_dir.name)
+                customer_ids = self._saved_customer_ids()
             
             customers_analyzed = 0
             
             for customer_id in customer_ids:
                 try:
-                    print(f"  🍖 Analyzing food consumption for customer {customer_id}...")
-                    
-                    # Get food consumption data from cached data
-                    customer_data = self._get_all_customer_data(customer_id)
-                    food_data = customer_data.get('get_yearly_food_count', [])
-                    
-                    # Get customer zip code for location-based fun facts from cached data
-                    address_data = self._get_cached_customer_address(customer_id)
-                    zip_code = address_data.get('zip_code', '') if address_data else None
-                    
-                    if food_data and len(food_data) > 0:
-                        # Generate food fun facts with location data
-                        food_fun_fact_json = generate_food_fun_fact_json(food_data, zip_code)
-                        
-                        # Save to customer directory
-                        customer_dir = self.output_dir / customer_id
-                        food_fun_fact_path = customer_dir / "food_fun_fact.json"
-                        
-                        with open(food_fun_fact_path, 'w') as f:
-                            f.write(food_fun_fact_json)
-                        
-                        # Parse the JSON to get the message for display
-                        import json
-                        analysis_data = json.loads(food_fun_fact_json)
-                        total_lbs = analysis_data.get('total_food_lbs', 0)
-                        
-                        print(f"    ✅ Generated food fun facts: {total_lbs} lbs consumed")
+                    if self._run_food_analyzer_for_customer(customer_id):
                         customers_analyzed += 1
-                    else:
-                        print(f"    ⚠️ No food consumption data found for customer {customer_id}")
-                        
                 except Exception as e:
                     print(f"    ❌ Error analyzing food consumption for customer {customer_id}: {e}")
             
@@ -1249,123 +1428,793 @@ Provide realistic scores (0.0-1.0) based on confidence in the inference."""
                 
         except Exception as e:
             print(f"❌ Error running food consumption analyzer: {e}")
+    
+    def _run_food_analyzer_for_customer(self, customer_id: str) -> bool:
+        """
+        Generate one customer's food fun facts and save food_fun_fact.json.
+        
+        Returns:
+            bool: True if fun facts were saved, False when the customer has no food consumption data
+        """
+        # Import the food consumption analyzer
+        from Agents.Review_and_Order_Intelligence_Agent.food_consumption_analyzer import generate_food_fun_fact_json
+        
+        print(f"  🍖 Analyzing food consumption for customer {customer_id}...")
+        
+        # Get food consumption data from cached data
+        customer_data = self._get_cached_customer_data(customer_id, query_keys=['get_yearly_food_count'])
+        food_data = customer_data.get('get_yearly_food_count', [])
+        
+        # Get customer zip code for location-based fun facts from cached data
+        address_data = self._get_cached_customer_address(customer_id)
+        zip_code = address_data.get('zip_code', '') if address_data else None
+        
+        if not food_data:
+            print(f"    ⚠️ No food consumption data found for customer {customer_id}")
+            return False
+        
+        # Generate food fun facts with location data
+        food_fun_fact_json = generate_food_fun_fact_json(food_data, zip_code)
+        
+        # Save to customer directory
+        customer_dir = self.output_dir / customer_id
+        customer_dir.mkdir(parents=True, exist_ok=True)
+        with open(customer_dir / "food_fun_fact.json", 'w') as f:
+            f.write(food_fun_fact_json)
+        
+        # Parse the JSON to get the message for display
+        total_lbs = json.loads(food_fun_fact_json).get('total_food_lbs', 0)
+        print(f"    ✅ Generated food fun facts: {total_lbs} lbs consumed")
+        return True
+    
+    def _saved_customer_ids(self) -> List[str]:
+        """Get the customers in the Output directory that have an enriched profile."""
+        customer_ids = []
+        for customer_dir in self.output_dir.iterdir():
+            if customer_dir.is_dir() and customer_dir.name.isdigit():
+                profile_path = customer_dir / "enriched_pet_profile.json"
+                if profile_path.exists():
+                    customer_ids.append(customer_dir.name)
+        return customer_ids
 
+    def _map_customers(self, stage: str, task: Callable[[str], Any], customer_ids: List[str]) -> Dict[str, Any]:
+        """
+        Run task(customer_id) for each customer, across self.workers threads when more than one.
+        
+        Customers share nothing but the read-mostly data caches, so they can run side by side.
+        A customer whose task raises is recorded in self.failed_customers and left out of the
+        results, without stopping the other customers.
+        
+        Returns:
+            Dict[str, Any]: Customer ID -> task result, in the order given
+        """
+        def run_task(customer_id: str):
+            try:
+                return task(customer_id)
+            except Exception as e:
+                print(f"  ❌ Error processing customer {customer_id} ({stage}): {e}")
+                self.failed_customers[customer_id] = f"{stage}: {e}"
+                raise
+        
+        results = {}
+        if self.workers <= 1 or len(customer_ids) <= 1:
+            for customer_id in customer_ids:
+                try:
+                    results[customer_id] = run_task(customer_id)
+                except Exception:
+                    continue
+            return results
+        
+        print(f"  👥 Running {stage} for {len(customer_ids)} customers on {min(self.workers, len(customer_ids))} workers")
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(customer_ids))) as executor:
+            futures = {customer_id: executor.submit(run_task, customer_id) for customer_id in customer_ids}
+            for customer_id, future in futures.items():
+                try:
+                    results[customer_id] = future.result()
+                except Exception:
+                    continue
+        return results
+    
+    def _playback_query_keys(self, customer_id: str, gets_personalized: bool) -> List[str]:
+        """Get the query templates a playback customer's stages read."""
+        # Determine which queries to run
+        if gets_personalized:
+            # Personalized playback: only run queries needed for full pipeline
+            query_keys = [
+                'get_cust_orders',
+                'get_pet_profiles',
+                'get_cust_reviews',
+                'get_cust_zipcode',
+                'get_yearly_food_count'
+            ]
+            print(f"  🎨 Running personalized playback queries for customer {customer_id}")
+        else:
+            # Generic playback: only run queries needed for generic outputs
+            query_keys = [
+                'get_amt_donated',
+                'get_cudd_month',
+                'get_total_months',
+                'get_autoship_savings',
+                'get_most_ordered',
+                'get_yearly_food_count'
+            ]
+            print(f"  📊 Running generic playback queries for customer {customer_id}")
+        return query_keys
+    
+    def _checkpoint(self, customer_id: str) -> CustomerCheckpoint:
+        """Get a customer's stage checkpoint."""
+        return CustomerCheckpoint(self.output_dir, customer_id)
+    
+    def _fingerprint_rows(self, customer_id: str, stage: str) -> Dict[str, Any]:
+        """Get the query rows a stage's input fingerprint covers."""
+        customer_data = self._get_cached_customer_data(customer_id, query_keys=self.FINGERPRINT_QUERIES[stage])
+        return {key: customer_data[key] for key in self.FINGERPRINT_QUERIES[stage] if key in customer_data}
+    
+    def _reused_stage(self, customer_id: str, stage: str, inputs: Callable[[], List[Any]] = None,
+                      quiet: bool = False) -> Tuple[bool, Any, Optional[str]]:
+        """
+        Get a stage's checkpointed result when it can be reused: always when resuming, and
+        when its inputs fingerprint the same as the checkpoint's in incremental runs.
+        
+        Args:
+            customer_id (str): Customer ID
+            stage (str): Stage name
+            inputs (Callable, optional): Returns the stage's inputs; stages without inputs
+                are only reused when resuming
+            quiet (bool): Don't print a line when reusing
+        
+        Returns:
+            Tuple[bool, Any, Optional[str]]: (whether a result was found, the result, the inputs'
+                fingerprint to store with a recomputed result)
+        """
+        record = self._checkpoint(customer_id).record(stage) if self.resume or self.incremental else None
+        if record and self.resume:
+            reason = 'resuming'
+        else:
+            input_fingerprint = fingerprint(*inputs()) if inputs and self.incremental else None
+            if not (record and input_fingerprint and record.get('fingerprint') == input_fingerprint):
+                return False, None, input_fingerprint
+            reason = 'inputs unchanged'
+        if not quiet:
+            print(f"  ♻️ Reusing {stage} result for customer {customer_id} ({reason})")
+        return True, record['result'], record.get('fingerprint')
+    
+    def _checkpointed(self, customer_id: str, stage: str, run: Callable[[], Any],
+                      is_complete: Callable[[Any], bool] = None, inputs: Callable[[], List[Any]] = None) -> Any:
+        """
+        Run a customer's stage and checkpoint its result, or reuse the checkpoint (see _reused_stage).
+        
+        Args:
+            customer_id (str): Customer ID
+            stage (str): Stage name
+            run (Callable): Runs the stage
+            is_complete (Callable, optional): Whether a result is worth keeping; stages that
+                report failure through their result (e.g. no image) are rerun next time
+            inputs (Callable, optional): Returns the values the stage's result depends on
+        
+        Returns:
+            Any: The stage result
+        """
+        found, result, input_fingerprint = self._reused_stage(customer_id, stage, inputs)
+        if found:
+            return result
+        result = run()
+        if is_complete is None or is_complete(result):
+            self._checkpoint(customer_id).save(stage, result, input_fingerprint)
+        return result
+    
+    async def _checkpointed_async(self, customer_id: str, stage: str, run: Callable[[], Any],
+                                  is_complete: Callable[[Any], bool] = None,
+                                  inputs: Callable[[], List[Any]] = None) -> Any:
+        """Async version of _checkpointed, for stages whose run() returns an awaitable."""
+        found, result, input_fingerprint = self._reused_stage(customer_id, stage, inputs)
+        if found:
+            return result
+        result = await run()
+        if is_complete is None or is_complete(result):
+            self._checkpoint(customer_id).save(stage, result, input_fingerprint)
+        return result
+    
+    def _image_inputs(self, narrative: Dict[str, Any]) -> List[Any]:
+        """The values image generation draws from: the ZIP aesthetics and the pet details."""
+        return [narrative.get('zip_aesthetics') or {}, self._image_pet_details(narrative)]
+    
+    @staticmethod
+    def _narrative_complete(narrative: Dict[str, Any]) -> bool:
+        """
+        Whether narrative generation produced a letter (it returns empty fields when it fails)
+        and left nothing out for a deadline.
+        """
+        return bool(narrative and narrative.get('collective_letter') and not narrative.get('degraded'))
+    
+    def _stage_inputs(self, customer_id: str, stage: str, profile: Dict[str, Any]) -> List[Any]:
+        """The values the breed and narrative stages draw from: the profile and their query rows."""
+        return [profile, self._fingerprint_rows(customer_id, stage)]
+    
+    def _deadline_passed(self) -> bool:
+        """Whether this run has a deadline and it has passed."""
+        return bool(self.deadline and self.deadline.expired())
+    
+    def _postpone(self, customer_id: str, stage: str, reason: str):
+        """Record a stage the run's deadline cut short, for _complete_postponed."""
+        stages = self.postponed.setdefault(customer_id, {'stages': []})['stages']
+        if stage not in stages:
+            print(f"  ⏱️ Postponing {stage} for customer {customer_id}: {reason}")
+            stages.append(stage)
+    
+    def _note_postponed(self, customer_id: str, stage: str, result: Any) -> Any:
+        """Postpone a stage whose result the run's deadline cut short; returns the result unchanged."""
+        if self.deadline is None:
+            return result
+        if stage == 'narrative' and result and result.get('degraded'):
+            self._postpone(customer_id, stage, f"left out {', '.join(result['degraded'])}")
+        elif self._deadline_passed() and (stage == 'breed' or not result or
+                                          (stage == 'narrative' and not result.get('collective_letter'))):
+            self._postpone(customer_id, stage, f"the run's {self.deadline.seconds:g}s deadline passed")
+        return result
+    
+    def _image_fits(self, customer_id: str, narrative: Dict[str, Any]) -> bool:
+        """Whether the image can still be generated within the run's deadline; postpones it when not."""
+        if self.deadline is None:
+            return True
+        if not narrative.get('collective_visual_prompt'):
+            self._postpone(customer_id, 'image', "the visual prompt was left out")
+            return False
+        if not self.deadline.allows(ESTIMATED_SECONDS['image']):
+            self._postpone(customer_id, 'image', f"{self.deadline.remaining():.1f}s left of the run's deadline")
+            return False
+        return True
+    
+    def _run_breed_stage(self, customer_id: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Predict a customer's breeds, or reuse the checkpoint."""
+        # Predictions that ran into the deadline may be fallbacks, so they aren't kept
+        return self._note_postponed(customer_id, 'breed', self._checkpointed(
+            customer_id, 'breed', lambda: self.run_breed_predictor_agent({customer_id: profile}).get(customer_id, {}),
+            is_complete=lambda _: not self._deadline_passed(),
+            inputs=lambda: self._stage_inputs(customer_id, 'breed', profile)))
+    
+    def _run_narrative_stage(self, customer_id: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate a customer's letter, visual prompt and badge, or reuse the checkpoint."""
+        return self._note_postponed(customer_id, 'narrative', self._checkpointed(
+            customer_id, 'narrative', lambda: self.run_narrative_generation_agent({customer_id: profile}).get(customer_id, {}),
+            is_complete=self._narrative_complete,
+            inputs=lambda: self._stage_inputs(customer_id, 'narrative', profile)))
+    
+    def _run_image_stage(self, customer_id: str, narrative: Dict[str, Any]) -> Any:
+        """Generate a customer's collective image, or reuse the checkpoint."""
+        def generate():
+            if not self._image_fits(customer_id, narrative):
+                return None
+            return self.run_image_generation_agent({customer_id: narrative}).get(customer_id, None)
+        
+        return self._note_postponed(customer_id, 'image', self._checkpointed(
+            customer_id, 'image', generate, is_complete=bool, inputs=lambda: self._image_inputs(narrative)))
+    
+    def _process_playback_customer(self, customer_id: str, profile: Dict[str, Any]) -> Tuple[Dict[str, Any], Any, Dict[str, Any]]:
+        """
+        Run one playback customer's stages as a dependency graph.
+        
+        Breed prediction, narrative generation and the unknowns and food analyzers only read
+        the enriched profile and cached data, so they run concurrently; image generation waits
+        only on the narrative. The customer then takes about as long as its longest chain
+        (narrative -> image) instead of the sum of all stages.
+        
+        Returns:
+            Tuple[Dict[str, Any], Any, Dict[str, Any]]: (narrative, image, breed prediction)
+        """
+        gets_personalized = profile.get('gets_personalized', False)
+        query_keys = self._playback_query_keys(customer_id, gets_personalized)
+        # Load every template the stages read up front, so concurrent stages only hit the cache
+        self._get_cached_customer_data(customer_id, query_keys=query_keys)
+        
+        unknowns_analyzer = UnknownsAnalyzer(self.snowflake_connector)
+        unknowns_analyzer.pipeline = self  # Pass pipeline reference for cached data access
+        
+        graph = StageGraph(name=customer_id)
+        graph.add('breed', lambda _: self._run_breed_stage(customer_id, profile))
+        graph.add('unknowns', lambda _: self._checkpointed(
+            customer_id, 'unknowns', lambda: self._run_unknowns_for_customer(unknowns_analyzer, customer_id)))
+        graph.add('food', lambda _: self._checkpointed(
+            customer_id, 'food', lambda: self._run_food_analyzer_for_customer(customer_id), is_complete=bool))
+        if gets_personalized:
+            # Narrative and image generation only for personalized playback
+            graph.add('narrative', lambda _: self._run_narrative_stage(customer_id, profile))
+            graph.add('image', lambda done: self._run_image_stage(customer_id, done['narrative']), depends_on=['narrative'])
+        
+        print(f"  🔀 Running stages {', '.join(graph.stages)} for customer {customer_id}")
+        results = graph.run()
+        print(f"  ⏱️ Customer {customer_id} stages finished in {graph.critical_path_seconds():.2f}s: "
+              f"{'; '.join(graph.summary())}")
+        
+        # Analyzer failures only cost their own output file; agent failures fail the customer
+        for stage in ('breed', 'narrative', 'image'):
+            if stage in graph.errors:
+                raise graph.errors[stage]
+        return results.get('narrative', {}), results.get('image'), results['breed']
+    
     def run_pipeline(self, customer_ids: List[str] = None):
         """Run the complete pipeline for specified customers or all customers."""
         print("🚀 Starting Chewy Playback Pipeline (Unified)")
         print("=" * 50)
         try:
-            # Clear cache to ensure fresh data
-            self.clear_cache()
-            # Step 1: Preprocess data
-            self.preprocess_data()
+            self._start_run(customer_ids)
             # Step 2: Run Intelligence Agent (Review-based or Order-based)
             enriched_profiles = self.run_intelligence_agent(customer_ids)
-
-            # Prepare per-customer outputs
-            narrative_results = {}
-            image_results = {}
-            breed_predictions = {}
-            eligible_for_narrative = []
+            profiled_ids = list(enriched_profiles)
+            playback_profiles = self._prepare_playback(enriched_profiles)
+            del enriched_profiles
+            self._enforce_deadline()
+            # Each customer's outputs are saved as soon as it finishes, and its results released
+            self._map_customers(
+                'playback', lambda cid: self._process_and_save_customer(cid, playback_profiles.pop(cid)), list(playback_profiles))
+            self._finish_run(customer_ids, profiled_ids)
+        except Exception as e:
+            print(f"\n❌ Pipeline failed: {e}")
+            self._write_query_report(customer_ids)
+            raise
+    
+    def _start_run(self, customer_ids: List[str] = None):
+        """Reset the run state, preprocess, and bulk-fetch what the intelligence stage needs."""
+        # Clear cache to ensure fresh data
+        self.clear_cache()
+        self.snowflake_connector.telemetry.reset()
+        self.failed_customers = {}
+        self.llm_stats = {}
+        self.postponed = {}
+        self.deadline_stats = {}
+        deadline_seconds = resolve_deadline_seconds(self.deadline_seconds, current_priority())
+        # The clock starts now, but calls only get the deadline once the profiles are in (see _enforce_deadline)
+        self.deadline = RunDeadline(deadline_seconds) if deadline_seconds else None
+        set_run_deadline(None)
+        if self.deadline:
+            print(f"⏱️ Run deadline: {deadline_seconds:g}s; profiles always complete, later work that doesn't fit "
+                  f"is postponed until results are saved")
+        if customer_ids and not self.resume and not self.incremental:
+            # A forced run mustn't leave earlier runs' results behind for a later resume
+            for customer_id in customer_ids:
+                self._checkpoint(customer_id).clear()
+        # Step 1: Preprocess data
+        self.preprocess_data()
+        # Fetch data for multi-customer runs in bulk instead of per customer, starting
+        # with only what the intelligence stage needs (and not for customers being resumed)
+        if customer_ids:
+            pending_ids = [customer_id for customer_id in customer_ids
+                           if not (self.resume and self._checkpoint(customer_id).has('intelligence'))]
+            self.prefetch_customer_data(pending_ids, query_keys=self.STAGE_QUERIES['intelligence'])
+    
+    def _enforce_deadline(self):
+        """
+        Apply the run's deadline to every OpenAI and Snowflake call from here on.
+        
+        The intelligence stage runs before this: an empty profile is saved as the customer's
+        final "no playback" answer, so profiles can't be cut short, only the optional work after them.
+        """
+        set_run_deadline(self.deadline)
+    
+    def _prepare_playback(self, enriched_profiles: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Bulk-fetch the later stages' templates for customers who get playback, and save the
+        profiles of customers who don't (they have nothing else to wait for).
+        
+        Returns:
+            Dict[str, Any]: Customer ID -> enriched profile, for the customers who get playback
+        """
+        # The remaining templates are only needed for customers who get playback
+        playback_ids = [cid for cid, profile in enriched_profiles.items() if profile.get('gets_playback', False)]
+        later_stage_queries = list(dict.fromkeys(
+            key for stage in ('narrative', 'consolidated_queries', 'food_analyzer') for key in self.STAGE_QUERIES[stage]
+        ))
+        self.prefetch_customer_data(playback_ids, query_keys=later_stage_queries)
+        
+        playback_profiles = {}
+        for customer_id, profile in enriched_profiles.items():
+            gets_playback = profile.get('gets_playback', False)
+            gets_personalized = profile.get('gets_personalized', False)
             
-            for customer_id, profile in enriched_profiles.items():
-                gets_playback = profile.get('gets_playback', False)
-                gets_personalized = profile.get('gets_personalized', False)
-                
-                print(f"\n🎯 Processing customer {customer_id}: gets_playback={gets_playback}, gets_personalized={gets_personalized}")
-                
-                if not gets_playback:
-                    print(f"  ⏭️ Skipping further processing for customer {customer_id} (no playback)")
-                    # Initialize empty results for customers with no playback
-                    narrative_results[customer_id] = {}
-                    image_results[customer_id] = None
-                    breed_predictions[customer_id] = {}
-                    continue
-                
-                # Determine which queries to run
-                if gets_personalized:
-                    # Personalized playback: only run queries needed for full pipeline
-                    query_keys = [
-                        'get_cust_orders',
-                        'get_pet_profiles',
-                        'get_cust_reviews',
-                        'get_cust_zipcode',
-                        'get_yearly_food_count'
-                    ]
-                    print(f"  🎨 Running personalized playback queries for customer {customer_id}")
-                else:
-                    # Generic playback: only run queries needed for generic outputs
-                    query_keys = [
-                        'get_amt_donated',
-                        'get_cudd_month',
-                        'get_total_months',
-                        'get_autoship_savings',
-                        'get_most_ordered',
-                        'get_yearly_food_count'
-                    ]
-                    print(f"  📊 Running generic playback queries for customer {customer_id}")
-                
-                # Run breed predictor only for customers with playback
-                print(f"  🐕 Running breed predictor for customer {customer_id}")
-                breed_pred = self.run_breed_predictor_agent({customer_id: profile})
-                breed_predictions[customer_id] = breed_pred.get(customer_id, {})
-                
-                if gets_personalized:
-                    # Run narrative and image generation for personalized playback
-                    print(f"  ✍️ Running narrative generation for customer {customer_id}")
-                    narrative = self.run_narrative_generation_agent({customer_id: profile})
-                    narrative_results[customer_id] = narrative.get(customer_id, {})
-                    
-                    print(f"  🎨 Running image generation for customer {customer_id}")
-                    image = self.run_image_generation_agent({customer_id: narrative_results[customer_id]})
-                    image_results[customer_id] = image.get(customer_id, None)
-                    eligible_for_narrative.append(customer_id)
-                else:
-                    # Generic playback: no narrative/image/badge, just run required queries
-                    print(f"  📊 Running generic playback queries for customer {customer_id}")
-                    narrative_results[customer_id] = {}
-                    image_results[customer_id] = None
-                    # Run only the required queries for generic playback
-                    customer_data = self._get_cached_customer_data(customer_id, query_keys=query_keys)
-                    # ... (rest of the code for generic playback outputs remains unchanged)
-            # Step 6: Save all outputs
-            self.save_outputs(enriched_profiles, narrative_results, image_results, breed_predictions)
-            # Ensure output folder and default profile for customers with no data
-            if customer_ids:
-                for customer_id in customer_ids:
-                    if customer_id not in enriched_profiles:
-                        customer_dir = self.output_dir / str(customer_id)
-                        customer_dir.mkdir(exist_ok=True)
-                        default_profile = {
-                            "pets": {},
-                            "cust_confidence_score": 0.0,
-                            "gets_playback": False,
-                            "gets_personalized": False
-                        }
-                        profile_path = customer_dir / "enriched_pet_profile.json"
-                        with open(profile_path, 'w') as f:
-                            json.dump(default_profile, f, indent=2)
-            # Run unknowns analyzer and food consumption analyzer only for customers with playback
-            playback_customer_ids = [cid for cid, profile in enriched_profiles.items() if profile.get('gets_playback', False)]
+            print(f"\n🎯 Processing customer {customer_id}: gets_playback={gets_playback}, gets_personalized={gets_personalized}")
             
-            if playback_customer_ids:
-                print(f"\n🔍 Running analyzers for {len(playback_customer_ids)} customers with playback...")
-                # Run unknowns analyzer after saving outputs
-                self.run_unknowns_analyzer(playback_customer_ids)
-                # Run food consumption analyzer after unknowns analyzer
-                self.run_food_consumption_analyzer(playback_customer_ids)
+            if not gets_playback:
+                print(f"  ⏭️ Skipping further processing for customer {customer_id} (no playback)")
+                try:
+                    self._save_customer(customer_id, profile)
+                except Exception as e:
+                    print(f"  ❌ Error processing customer {customer_id} (save_outputs): {e}")
+                    self.failed_customers[customer_id] = f"save_outputs: {e}"
+                continue
+            playback_profiles[customer_id] = profile
+        return playback_profiles
+    
+    def _save_customer(self, customer_id: str, profile: Dict[str, Any], narrative: Dict[str, Any] = None,
+                       image: Any = None, breed_prediction: Dict[str, Any] = None):
+        """Save one finished customer's outputs to Output/<customer_id>."""
+        self._save_customer_outputs(customer_id, {customer_id: profile}, {customer_id: narrative or {}},
+                                    {customer_id: image}, {customer_id: breed_prediction or {}})
+    
+    def _process_and_save_customer(self, customer_id: str, profile: Dict[str, Any]):
+        """Run a playback customer's stages and save its outputs right away."""
+        narrative, image, breed_prediction = self._process_playback_customer(customer_id, profile)
+        try:
+            self._save_customer(customer_id, profile, narrative, image, breed_prediction)
+        except Exception as e:
+            raise RuntimeError(f"save_outputs: {e}") from e
+        self._hold_postponed(customer_id, profile, narrative, image, breed_prediction)
+    
+    def _hold_postponed(self, customer_id: str, profile: Dict[str, Any], narrative: Dict[str, Any],
+                        image: Any, breed_prediction: Dict[str, Any]):
+        """Keep a saved customer's results when some of its work was postponed, to complete it later."""
+        if customer_id in self.postponed:
+            self.postponed[customer_id]['results'] = (profile, narrative, image, breed_prediction)
+    
+    def _complete_postponed(self):
+        """
+        Complete the work the run's deadline postponed, now without a deadline and in the bulk
+        lane, and save those customers again with the full results.
+        """
+        pending_ids = [customer_id for customer_id, entry in self.postponed.items() if 'results' in entry]
+        if not pending_ids:
+            return
+        print(f"\n⏱️ Completing postponed work for {len(pending_ids)} customers (bulk priority, no deadline)")
+        previous_priority = current_priority()
+        self.deadline = None
+        set_run_deadline(None)
+        set_priority(BULK)
+        try:
+            self._map_customers('postponed', self._complete_postponed_customer, pending_ids)
+        finally:
+            set_priority(previous_priority)
+            self.postponed = {}
+    
+    def _complete_postponed_customer(self, customer_id: str):
+        """Run one customer's postponed stages and save its outputs again."""
+        entry = self.postponed[customer_id]
+        profile, narrative, image, breed_prediction = entry['results']
+        print(f"  ⏱️ Completing {', '.join(entry['stages'])} for customer {customer_id}")
+        if 'breed' in entry['stages']:
+            breed_prediction = self._run_breed_stage(customer_id, profile)
+        if 'narrative' in entry['stages']:
+            if narrative.get('collective_letter'):
+                narrative = self._complete_narrative(customer_id, profile, narrative)
             else:
-                print(f"\n⏭️ Skipping analyzers - no customers eligible for playback")
-            # Show cache statistics
-            cache_stats = self.get_cache_stats()
-            print(f"\n📊 Cache Statistics:")
-            print(f"   Customers cached: {cache_stats['cached_customers']}")
-            print(f"   Queries saved: {cache_stats['total_queries_saved']}")
-            print("\n🎉 Pipeline completed successfully!")
-            print(f"📁 Check the 'Output' directory for results")
+                narrative = self._run_narrative_stage(customer_id, profile)
+        if 'image' in entry['stages']:
+            image = self._run_image_stage(customer_id, narrative)
+        self._save_customer(customer_id, profile, narrative, image, breed_prediction)
+    
+    def _complete_narrative(self, customer_id: str, profile: Dict[str, Any], narrative: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate the narrative parts a deadline left out, keeping the letter, and checkpoint the result."""
+        pets_data, _ = self._narrative_pets(profile)
+        pet_data, secondary_data = self._narrative_inputs(customer_id, pets_data)
+        completed = self.narrative_agent.complete_output(
+            pet_data, secondary_data, {'zip_aesthetics': narrative.get('zip_aesthetics'), 'degraded': narrative['degraded']})
+        narrative = {**narrative, 'degraded': []}
+        if 'visual_prompt' in completed:
+            narrative['collective_visual_prompt'] = completed['visual_prompt']
+        if 'personality_badge' in completed:
+            narrative['personality_badge'] = completed['personality_badge']
+        input_fingerprint = fingerprint(*self._stage_inputs(customer_id, 'narrative', profile)) if self.incremental else None
+        self._checkpoint(customer_id).save('narrative', narrative, input_fingerprint)
+        return narrative
+    
+    def _finish_run(self, customer_ids: List[str], profiled_ids: List[str]):
+        """
+        Write default profiles for customers without one, complete any work the deadline
+        postponed, then print the run's cache statistics and write the query report.
+        """
+        # Ensure output folder and default profile for customers with no data
+        if customer_ids:
+            profiled_ids = set(profiled_ids)
+            for customer_id in customer_ids:
+                if customer_id not in profiled_ids:
+                    customer_dir = self.output_dir / str(customer_id)
+                    customer_dir.mkdir(exist_ok=True)
+                    default_profile = {
+                        "pets": {},
+                        "cust_confidence_score": 0.0,
+                        "gets_playback": False,
+                        "gets_personalized": False
+                    }
+                    profile_path = customer_dir / "enriched_pet_profile.json"
+                    with open(profile_path, 'w') as f:
+                        json.dump(default_profile, f, indent=2)
+        if self.deadline:
+            self.deadline_stats = {
+                'seconds': self.deadline.seconds, 'elapsed_seconds': round(self.deadline.elapsed(), 2),
+                'postponed': {customer_id: entry['stages'] for customer_id, entry in self.postponed.items()}
+            }
+            print(f"\n⏱️ Deadline-bound work took {self.deadline_stats['elapsed_seconds']}s of {self.deadline.seconds:g}s, "
+                  f"{len(self.postponed)} customers have postponed work")
+        self._complete_postponed()
+        # Show cache statistics
+        cache_stats = self.get_cache_stats()
+        print(f"\n📊 Cache Statistics:")
+        print(f"   Customers cached: {cache_stats['cached_customers']}")
+        print(f"   Queries fetched: {cache_stats['total_queries_fetched']} ({cache_stats['fetch_ratio']} of all templates)")
+        print(f"   Queries skipped: {cache_stats['total_queries_skipped']}")
+        print(f"   Query executions: {cache_stats['query_executions']} ({cache_stats['query_seconds']:.2f}s), "
+              f"query cache hits: {cache_stats['query_cache_hits']} ({cache_stats['query_cache_hit_ratio']})")
+        self.snowflake_connector.telemetry.print_summary()
+        rate_limit_stats = get_rate_limiter().stats()
+        if rate_limit_stats['waits'] or rate_limit_stats['rate_limit_errors']:
+            print(f"🚦 OpenAI rate limiter: waited {rate_limit_stats['waits']} times ({rate_limit_stats['wait_seconds']}s), "
+                  f"{rate_limit_stats['rate_limit_errors']} rate limit errors")
+        lane_stats = get_priority_lanes().stats()
+        if any(lane_stats['waits'].values()):
+            print(f"🛣️ Priority lanes ({lane_stats['priority']} run): waited {sum(lane_stats['waits'].values())} times "
+                  f"({sum(lane_stats['wait_seconds'].values()):.2f}s) for OpenAI, image or Snowflake slots")
+        self._write_query_report(customer_ids)
+        if self.failed_customers:
+            print(f"\n⚠️ {len(self.failed_customers)} customers failed:")
+            for customer_id, error in self.failed_customers.items():
+                print(f"   {customer_id}: {error}")
+        print("\n🎉 Pipeline completed successfully!")
+        print(f"📁 Check the 'Output' directory for results")
+    
+    def run_pipeline_async(self, customer_ids: List[str] = None):
+        """
+        Run the complete pipeline on an asyncio event loop.
+        
+        Every customer is in flight at once and the agents' OpenAI calls go through one
+        AsyncLLMClient, bounded by max_in_flight, instead of one blocking call per thread. The
+        data is bulk-fetched as in run_pipeline; per-customer cache misses, geocoding, the food
+        analyzer and saving outputs still block, so they run on the event loop's thread pool.
+        """
+        return asyncio.run(self._run_pipeline_async(customer_ids))
+    
+    async def _run_pipeline_async(self, customer_ids: List[str] = None):
+        """Async body of run_pipeline_async."""
+        print("🚀 Starting Chewy Playback Pipeline (Unified, async)")
+        print("=" * 50)
+        try:
+            self._start_run(customer_ids)
+            llm = AsyncLLMClient(self.openai_api_key, self.max_in_flight)
+            print(f"⚡ Async mode: up to {llm.max_in_flight} OpenAI requests in flight")
+            
+            print("\n🧠 Running Intelligence Agent (async)...")
+            reused_profiles, input_fingerprints = await asyncio.to_thread(self._reused_profiles, customer_ids or [])
+            pending_ids = [customer_id for customer_id in customer_ids or [] if customer_id not in reused_profiles]
+            results = await self._map_customers_async(
+                'intelligence', lambda cid: self._run_intelligence_for_customer_async(cid, llm), pending_ids)
+            print(f"✅ Generated profiles for {len(results)} customers")
+            enriched_profiles = self._checkpoint_profiles(
+                customer_ids or [], reused_profiles, await asyncio.to_thread(self._add_confidence_scores, results),
+                input_fingerprints)
+            
+            profiled_ids = list(enriched_profiles)
+            playback_profiles = await asyncio.to_thread(self._prepare_playback, enriched_profiles)
+            del enriched_profiles
+            self._enforce_deadline()
+            await self._map_customers_async(
+                'playback', lambda cid: self._process_and_save_customer_async(cid, playback_profiles.pop(cid), llm),
+                list(playback_profiles))
+            
+            self.llm_stats = llm.stats()
+            print(f"\n⚡ OpenAI requests: {self.llm_stats['calls']} "
+                  f"(peak {self.llm_stats['peak_in_flight']} in flight of {self.llm_stats['max_in_flight']})")
+            await asyncio.to_thread(self._finish_run, customer_ids, profiled_ids)
         except Exception as e:
             print(f"\n❌ Pipeline failed: {e}")
+            self._write_query_report(customer_ids)
             raise
+    
+    async def _map_customers_async(self, stage: str, task: Callable[[str], Any], customer_ids: List[str]) -> Dict[str, Any]:
+        """
+        Await task(customer_id) for every customer at once; the async counterpart of _map_customers.
+        
+        Returns:
+            Dict[str, Any]: Customer ID -> task result for the customers that succeeded, in the order given
+        """
+        async def run_task(customer_id: str):
+            try:
+                return await task(customer_id)
+            except Exception as e:
+                print(f"  ❌ Error processing customer {customer_id} ({stage}): {e}")
+                self.failed_customers[customer_id] = f"{stage}: {e}"
+                raise
+        
+        outcomes = await asyncio.gather(*(run_task(customer_id) for customer_id in customer_ids), return_exceptions=True)
+        return {customer_id: outcome for customer_id, outcome in zip(customer_ids, outcomes)
+                if not isinstance(outcome, Exception)}
+    
+    async def _load_customer_data_async(self, customer_id: str, query_keys: List[str]):
+        """Make sure a customer's templates are cached, running any fetch off the event loop."""
+        if self._missing_query_keys(customer_id, query_keys):
+            await asyncio.to_thread(self._get_cached_customer_data, customer_id, query_keys)
+    
+    async def _run_intelligence_for_customer_async(self, customer_id: str, llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Async version of _run_intelligence_for_customer."""
+        await self._load_customer_data_async(customer_id, self.STAGE_QUERIES['intelligence'])
+        if self._check_customer_has_reviews(customer_id):
+            print(f"  🐾 Customer {customer_id} has reviews - using Review and Order Intelligence Agent")
+            customer_result = await self._run_review_agent_for_customer_async(customer_id, llm)
+            agent_type = 'review_based'
+        else:
+            print(f"  🐾 Customer {customer_id} has no reviews - using Order Intelligence Agent")
+            customer_result = await self._run_order_agent_for_customer_async(customer_id, llm)
+            agent_type = 'order_based'
+        if isinstance(customer_result, dict):
+            customer_result['_agent_type'] = agent_type
+        return customer_result
+    
+    async def _run_review_agent_for_customer_async(self, customer_id: str, llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Async version of _run_review_agent_for_customer."""
+        pets_df = self._get_cached_customer_pets_dataframe(customer_id, query_keys=['get_pet_profiles'])
+        if pets_df.empty:
+            print(f"    ⚠️ No pets found for customer {customer_id}")
+            return {}
+        orders_df = self._get_cached_customer_orders_dataframe(customer_id, query_keys=['get_cust_orders'])
+        reviews_df = self._get_cached_customer_reviews_dataframe(customer_id, query_keys=['get_cust_reviews'])
+        return await self.review_agent.analyze_customer_with_cached_data_async(llm, customer_id, pets_df, orders_df, reviews_df)
+    
+    async def _run_order_agent_for_customer_async(self, customer_id: str, llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Async version of _run_order_agent_for_customer."""
+        orders_df = self._get_cached_customer_orders_dataframe(customer_id, query_keys=['get_cust_orders'])
+        if orders_df.empty:
+            print(f"    ⚠️ No orders found for customer {customer_id}")
+            return {}
+        pets_df = self._get_cached_customer_pets_dataframe(customer_id, query_keys=['get_pet_profiles'])
+        insights = await self._analyze_orders_with_llm_async(orders_df, customer_id, llm)
+        return self._order_agent_results(customer_id, orders_df, pets_df, insights)
+    
+    async def _process_and_save_customer_async(self, customer_id: str, profile: Dict[str, Any], llm: AsyncLLMClient):
+        """Async version of _process_and_save_customer."""
+        narrative, image, breed_prediction = await self._process_playback_customer_async(customer_id, profile, llm)
+        try:
+            await asyncio.to_thread(self._save_customer, customer_id, profile, narrative, image, breed_prediction)
+        except Exception as e:
+            raise RuntimeError(f"save_outputs: {e}") from e
+        self._hold_postponed(customer_id, profile, narrative, image, breed_prediction)
+    
+    async def _process_playback_customer_async(self, customer_id: str, profile: Dict[str, Any],
+                                               llm: AsyncLLMClient) -> Tuple[Dict[str, Any], Any, Dict[str, Any]]:
+        """
+        Async version of _process_playback_customer, with the same stage dependencies: breed,
+        the analyzers and narrative -> image run concurrently.
+        """
+        gets_personalized = profile.get('gets_personalized', False)
+        await self._load_customer_data_async(customer_id, self._playback_query_keys(customer_id, gets_personalized))
+        
+        unknowns_analyzer = UnknownsAnalyzer(self.snowflake_connector)
+        unknowns_analyzer.pipeline = self  # Pass pipeline reference for cached data access
+        
+        async def narrative_and_image():
+            narrative = self._note_postponed(customer_id, 'narrative', await self._checkpointed_async(
+                customer_id, 'narrative', lambda: self._run_narrative_for_customer_async(customer_id, profile, llm),
+                is_complete=self._narrative_complete,
+                inputs=lambda: self._stage_inputs(customer_id, 'narrative', profile)))
+            image = self._note_postponed(customer_id, 'image', await self._checkpointed_async(
+                customer_id, 'image', lambda: self._run_image_for_customer_async(customer_id, narrative, llm),
+                is_complete=bool, inputs=lambda: self._image_inputs(narrative)))
+            return narrative, image
+        
+        async def breed():
+            return self._note_postponed(customer_id, 'breed', await self._checkpointed_async(
+                customer_id, 'breed', lambda: self._run_breed_predictor_for_customer_async(customer_id, profile, llm),
+                is_complete=lambda _: not self._deadline_passed(),
+                inputs=lambda: self._stage_inputs(customer_id, 'breed', profile)))
+        
+        stages = {
+            'breed': breed(),
+            'unknowns': self._checkpointed_async(
+                customer_id, 'unknowns', lambda: asyncio.to_thread(self._run_unknowns_for_customer, unknowns_analyzer, customer_id)),
+            'food': self._checkpointed_async(
+                customer_id, 'food', lambda: asyncio.to_thread(self._run_food_analyzer_for_customer, customer_id),
+                is_complete=bool),
+        }
+        if gets_personalized:
+            stages['narrative'] = narrative_and_image()
+        results = dict(zip(stages, await asyncio.gather(*stages.values(), return_exceptions=True)))
+        
+        # Analyzer failures only cost their own output file; agent failures fail the customer
+        for stage, result in results.items():
+            if isinstance(result, Exception):
+                if stage in ('unknowns', 'food'):
+                    print(f"  ❌ [{customer_id}] Stage '{stage}' failed: {result}")
+                else:
+                    raise result
+        narrative, image = results.get('narrative', ({}, None))
+        return narrative, image, results['breed']
+    
+    async def _run_breed_predictor_for_customer_async(self, customer_id: str, profile: Dict[str, Any],
+                                                      llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Predict breeds for one customer's eligible dogs, all pets concurrently."""
+        print(f"  🐕 Running breed predictor for customer {customer_id}")
+        customer_orders, eligible_pets, _ = self._breed_prediction_candidates(customer_id, profile)
+        predictions = await asyncio.gather(*(
+            self.breed_predictor_agent.predict_breed_for_pet_with_orders_async(llm, customer_id, pet_name, pet_profile, customer_orders)
+            for pet_name, pet_profile in eligible_pets
+        ), return_exceptions=True)
+        
+        customer_predictions = []
+        for (pet_name, _), prediction_result in zip(eligible_pets, predictions):
+            if isinstance(prediction_result, Exception):
+                print(f"      ❌ Error predicting breed for {pet_name}: {prediction_result}")
+                continue
+            self._add_breed_prediction(customer_predictions, customer_id, pet_name, prediction_result)
+        return self._customer_breed_prediction(customer_id, customer_predictions) or {}
+    
+    async def _run_narrative_for_customer_async(self, customer_id: str, customer_data: Dict[str, Any],
+                                                llm: AsyncLLMClient) -> Dict[str, Any]:
+        """Generate one customer's letter, visual prompt and badge."""
+        print(f"  ✍️ Running narrative generation for customer {customer_id}")
+        pets_data, customer_confidence_score = self._narrative_pets(customer_data)
+        try:
+            pet_data, secondary_data = self._narrative_inputs(customer_id, pets_data)
+            narrative_output = await self.narrative_agent.generate_output_async(pet_data, secondary_data, llm,
+                                                                                deadline=self.deadline)
+        except Exception as e:
+            print(f"    ❌ Error generating narratives: {e}")
+            narrative_output = None
+        return self._customer_narratives(customer_id, pets_data, customer_confidence_score, narrative_output)
+    
+    async def _run_image_for_customer_async(self, customer_id: str, narrative: Dict[str, Any],
+                                            llm: AsyncLLMClient) -> Optional[str]:
+        """Generate one customer's collective image from their narrative."""
+        print(f"  🎨 Running image generation for customer {customer_id}")
+        if not self._image_fits(customer_id, narrative):
+            return None
+        if not narrative.get('collective_visual_prompt'):
+            print(f"    ❌ No collective visual prompt found for customer {customer_id}")
+            return None
+        image_url = await generate_image_from_prompt_async(
+            llm,
+            output_path=None,  # Don't save to file here, handle that in save_outputs
+            zip_aesthetics=narrative.get('zip_aesthetics', {}),
+            pet_details=self._image_pet_details(narrative)
+        )
+        if image_url:
+            print(f"    ✅ Generated collective image for all pets")
+        else:
+            print(f"    ❌ Failed to generate image for customer {customer_id}")
+        return image_url
+    
+    def _write_query_report(self, customer_ids: List[str] = None):
+        """Write the run's per-template query telemetry to Output/query_report.json."""
+        try:
+            report_path = self.snowflake_connector.telemetry.write_report(
+                self.output_dir / "query_report.json",
+                {'customer_ids': [str(cid) for cid in customer_ids or []], 'workers': self.workers,
+                 'failed_customers': self.failed_customers, 'cache_stats': self.get_cache_stats(),
+                 'llm': self.llm_stats, 'rate_limiter': get_rate_limiter().stats(),
+                 'priority_lanes': get_priority_lanes().stats(), 'deadline': self.deadline_stats})
+            print(f"📊 Query report saved to {report_path}")
+        except Exception as e:
+            print(f"⚠️ Failed to write query report: {e}")
+
+
+def run_customer_batches(pipeline: ChewyPlaybackPipeline, customer_ids: Iterable[str], batch_size: int = None,
+                         use_async: bool = False, refresh_query_cache: bool = False) -> Dict[str, str]:
+    """
+    Run the pipeline over a stream of customer IDs, one batch at a time.
+    
+    Each batch is a full pipeline run, so memory stays bounded by the batch (the data cache
+    is cleared per run) however long the stream is.
+    
+    Args:
+        pipeline (ChewyPlaybackPipeline): Pipeline to run
+        customer_ids (Iterable[str]): Customer IDs, e.g. from customer_input.iter_customer_ids
+        batch_size (int, optional): Customers per run. Defaults to PIPELINE_BATCH_SIZE or 1000
+        use_async (bool): Run each batch with run_pipeline_async
+        refresh_query_cache (bool): Drop each batch's persisted query results first
+    
+    Returns:
+        Dict[str, str]: Customer ID -> "stage: error" for every customer that failed
+    """
+    batch_size = batch_size or int(os.getenv('PIPELINE_BATCH_SIZE', '1000'))
+    failed_customers = {}
+    customers_processed = 0
+    for batch_number, batch in enumerate(batched(customer_ids, batch_size), start=1):
+        print(f"\n📦 Batch {batch_number}: {len(batch)} customers ({customers_processed} processed so far)")
+        if refresh_query_cache and pipeline.snowflake_connector.result_cache:
+            pipeline.snowflake_connector.result_cache.clear(batch)
+        if use_async:
+            pipeline.run_pipeline_async(customer_ids=batch)
+        else:
+            pipeline.run_pipeline(customer_ids=batch)
+        failed_customers.update(pipeline.failed_customers)
+        customers_processed += len(batch)
+    
+    print(f"\n📦 Processed {customers_processed} customers, {len(failed_customers)} failed")
+    return failed_customers
 
 
 def main():
@@ -1374,16 +2223,83 @@ def main():
     
     parser = argparse.ArgumentParser(description="Chewy Playback Pipeline (Unified)")
     parser.add_argument("--customers", nargs="+", help="Specific customer IDs to process")
+    parser.add_argument("--customers-file",
+                        help="File of customer IDs to process, one per line or a CSV with a customer_id column "
+                             "(\"-\" for stdin); read as a stream and processed in batches")
+    parser.add_argument("--shard", type=parse_shard, metavar="K/N",
+                        help="Only process the customers in shard K of N (0 <= K < N), by customer ID hash")
+    parser.add_argument("--batch-size", type=int,
+                        help="Customers per pipeline run when streaming customers (default: PIPELINE_BATCH_SIZE or 1000)")
     parser.add_argument("--api-key", help="OpenAI API key (optional, can use environment variable)")
+    parser.add_argument("--concurrent-queries", type=int,
+                        help="Run up to N Snowflake query templates at once per customer (default: SNOWFLAKE_MAX_CONCURRENT_QUERIES or 1)")
+    parser.add_argument("--workers", type=int,
+                        help="Process up to N customers at once (default: PIPELINE_WORKERS or 1)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse stage results checkpointed by an earlier, interrupted run of these customers")
+    parser.add_argument("--force", action="store_true",
+                        help="Recompute every stage, even those whose inputs haven't changed since the last run")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run all customers on one asyncio event loop with the async OpenAI client")
+    parser.add_argument("--max-in-flight", type=int,
+                        help="OpenAI requests in flight at once with --async (default: OPENAI_MAX_IN_FLIGHT or 64)")
+    parser.add_argument("--priority", choices=PRIORITIES,
+                        help="Priority class for OpenAI, image and Snowflake slots shared with other runs; the web app "
+                             "uses interactive (default: PIPELINE_PRIORITY or bulk)")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help="Latency budget for the run: work that doesn't fit (e.g. the portrait) is postponed until "
+                             "the results are saved (default: PIPELINE_DEADLINE_SECONDS, or 30 for interactive runs; 0 for none)")
+    parser.add_argument("--consolidated-query", action="store_true",
+                        help="Run each stage's query templates for a customer as one statement, in one round trip "
+                             "(default: SNOWFLAKE_CONSOLIDATED_QUERY)")
+    parser.add_argument("--refresh-query-cache", action="store_true",
+                        help="Drop the customers' persisted query results and re-query Snowflake")
+    parser.add_argument("--data-source", choices=["snowflake", "local", "parquet"], default="snowflake",
+                        help="Where customer data comes from: Snowflake, local DuckDB fixtures for offline runs, "
+                             "or a cohort export made with cohort_export.py")
+    parser.add_argument("--fixtures-dir",
+                        help="Fixture root for --data-source local (default: LOCAL_FIXTURES_DIR or Final_Pipeline/fixtures)")
+    parser.add_argument("--export-dir",
+                        help="Cohort export for --data-source parquet (default: COHORT_EXPORT_DIR or Final_Pipeline/.cohort_export)")
     
     args = parser.parse_args()
     
     try:
+        if args.priority:
+            set_priority(args.priority)
+        
         # Initialize pipeline
-        pipeline = ChewyPlaybackPipeline(openai_api_key=args.api_key)
+        data_connector = None
+        if args.data_source == "local":
+            from local_data_connector import LocalDataConnector
+            data_connector = LocalDataConnector(fixtures_dir=args.fixtures_dir)
+        elif args.data_source == "parquet":
+            from cohort_export import ParquetDataConnector
+            data_connector = ParquetDataConnector(export_dir=args.export_dir)
+        pipeline = ChewyPlaybackPipeline(openai_api_key=args.api_key, data_connector=data_connector,
+                                         workers=args.workers, max_in_flight=args.max_in_flight,
+                                         resume=args.resume, incremental=not args.force,
+                                         deadline_seconds=args.deadline)
+        if args.concurrent_queries:
+            pipeline.snowflake_connector.max_concurrent_queries = args.concurrent_queries
+        if args.consolidated_query:
+            pipeline.snowflake_connector.consolidated_query = True
+        
+        if args.customers_file or args.shard:
+            customer_ids = iter_customer_ids(args.customers_file) if args.customers_file else args.customers or []
+            run_customer_batches(pipeline, select_customers(customer_ids, args.shard),
+                                 batch_size=args.batch_size, use_async=args.use_async,
+                                 refresh_query_cache=args.refresh_query_cache)
+            return
+        
+        if args.refresh_query_cache and args.customers and pipeline.snowflake_connector.result_cache:
+            pipeline.snowflake_connector.result_cache.clear(args.customers)
         
         # Run pipeline
-        pipeline.run_pipeline(customer_ids=args.customers)
+        if args.use_async:
+            pipeline.run_pipeline_async(customer_ids=args.customers)
+        else:
+            pipeline.run_pipeline(customer_ids=args.customers)
         
     except Exception as e:
         print(f"Error: {e}")
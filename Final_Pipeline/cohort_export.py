@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Cohort Export for Chewy Playback Pipeline
+Runs each query template once for the whole cohort (no per-customer filter) and writes
+the results to Parquet files partitioned by a hash of the customer ID. Pipeline runs
+can then read customer data from the export instead of querying Snowflake, and any
+number of worker processes can share one export.
+
+Export layout:
+    <export_dir>/manifest.json
+    <export_dir>/<query_name>/bucket=<k>.parquet
+"""
+
+import os
+import json
+import time
+import zlib
+import shutil
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Any, Iterable
+from snowflake_data_connector import SnowflakeDataConnector, CustomerQueryResults, ARROW_AVAILABLE, _frame_to_rows
+from query_result_cache import QueryResultCache
+from query_telemetry import QueryTelemetry
+
+if ARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+DEFAULT_EXPORT_DIR = Path(__file__).parent / ".cohort_export"
+MANIFEST_FILE = "manifest.json"
+CUSTOMER_ID_COLUMN = "BULK_CUSTOMER_ID"
+
+
+def customer_bucket(customer_id: Any, num_buckets: int) -> int:
+    """Stable partition number of a customer ID (CRC32 of its normalized form)."""
+    normalized_id = SnowflakeDataConnector._normalize_customer_id(customer_id)
+    return zlib.crc32(normalized_id.encode('utf-8')) % num_buckets
+
+
+def _bucket_path(export_dir: Path, query_name: str, bucket: int) -> Path:
+    return export_dir / query_name / f"bucket={bucket:05d}.parquet"
+
+
+class CohortExporter:
+    """
+    Exports every query template's results for all customers to bucketed Parquet files.
+
+    Results are streamed batch by batch from the warehouse into one Parquet writer per
+    bucket, so the export never holds a whole result in memory.
+    """
+
+    def __init__(self, connector: SnowflakeDataConnector = None, export_dir: str = None, num_buckets: int = None):
+        """
+        Initialize the cohort exporter.
+
+        Args:
+            connector (SnowflakeDataConnector, optional): Data source to export from. Defaults to Snowflake
+            export_dir (str, optional): Export location. Defaults to COHORT_EXPORT_DIR or Final_Pipeline/.cohort_export
+            num_buckets (int, optional): Number of customer ID partitions. Defaults to COHORT_EXPORT_BUCKETS (64)
+        """
+        if not ARROW_AVAILABLE:
+            raise ImportError("pyarrow is not installed. Install with: pip install \"snowflake-connector-python[pandas]\"")
+        self.connector = connector or SnowflakeDataConnector()
+        self.export_dir = Path(export_dir or os.getenv('COHORT_EXPORT_DIR') or DEFAULT_EXPORT_DIR)
+        self.num_buckets = num_buckets or int(os.getenv('COHORT_EXPORT_BUCKETS', '64'))
+
+    def export(self, query_keys: List[str] = None) -> Dict[str, Any]:
+        """
+        Export the given query templates (all by default) and write the manifest.
+
+        Each query is written to a staging directory first and swapped in when complete,
+        so readers never see a half-written query.
+
+        Returns:
+            Dict[str, Any]: The export manifest
+        """
+        query_names = list(self.connector.customer_queries.keys()) if query_keys is None else list(query_keys)
+        manifest = self._load_manifest()
+        if manifest.get('num_buckets', self.num_buckets) != self.num_buckets:
+            # Partitioning changed, so every query has to be re-exported
+            manifest = {}
+        manifest.update({'num_buckets': self.num_buckets, 'bucket_function': 'crc32', 'customer_id_column': CUSTOMER_ID_COLUMN})
+        manifest.setdefault('queries', {})
+
+        staging_dir = self.export_dir / ".staging"
+        for query_name in query_names:
+            query = self.connector.cohort_statement(query_name)
+            start_time = time.time()
+            print(f"📤 Exporting '{query_name}' for the whole cohort...")
+            query_info = self._export_query(query_name, query, staging_dir)
+
+            final_dir = self.export_dir / query_name
+            if final_dir.exists():
+                shutil.rmtree(final_dir)
+            os.replace(staging_dir / query_name, final_dir)
+
+            query_info.update({
+                'template_hash': QueryResultCache.template_hash(self.connector.customer_queries[query_name]),
+                'exported_at': time.time(),
+                'seconds': round(time.time() - start_time, 2)
+            })
+            manifest['queries'][query_name] = query_info
+            self._write_manifest(manifest)
+            print(f"✅ Exported '{query_name}': {query_info['rows']} rows for {query_info['customers']} customers "
+                  f"in {query_info['seconds']}s")
+
+        if staging_dir.exists():
+            shutil.rmtree(staging_dir)
+        return manifest
+
+    def _export_query(self, query_name: str, query: str, staging_dir: Path) -> Dict[str, Any]:
+        """Stream one cohort query into per-bucket Parquet files under the staging directory."""
+        query_dir = staging_dir / query_name
+        if query_dir.exists():
+            shutil.rmtree(query_dir)
+        query_dir.mkdir(parents=True)
+
+        writers = {}
+        schema = None
+        rows = 0
+        customers = set()
+        try:
+            for frame in self.connector.iter_query_frames(query):
+                if frame.empty:
+                    continue
+                frame = frame[frame[CUSTOMER_ID_COLUMN].notna()].copy()
+                frame[CUSTOMER_ID_COLUMN] = pd.to_numeric(frame[CUSTOMER_ID_COLUMN]).astype('int64')
+                normalized_ids = frame[CUSTOMER_ID_COLUMN].astype(str)
+                buckets = normalized_ids.map(lambda cid: zlib.crc32(cid.encode('utf-8')) % self.num_buckets)
+                customers.update(normalized_ids.unique())
+                rows += len(frame)
+
+                for bucket, part in frame.groupby(buckets, sort=False):
+                    table = pa.Table.from_pandas(part, preserve_index=False)
+                    if schema is None:
+                        # A column that is all NULL in the first batch has no type yet; store it as text
+                        schema = pa.schema([
+                            field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                            for field in table.schema
+                        ])
+                    if bucket not in writers:
+                        writers[bucket] = pq.ParquetWriter(str(_bucket_path(staging_dir, query_name, bucket)), schema)
+                    writers[bucket].write_table(table.cast(schema))
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        return {
+            'rows': rows,
+            'customers': len(customers),
+            'buckets_written': len(writers),
+            'columns': [name for name in schema.names if name != CUSTOMER_ID_COLUMN] if schema is not None else []
+        }
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        manifest_path = self.export_dir / MANIFEST_FILE
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        """Write the manifest atomically so concurrent readers never see a partial file."""
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.export_dir / f".{MANIFEST_FILE}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self.export_dir / MANIFEST_FILE)
+
+
+class ParquetDataConnector(SnowflakeDataConnector):
+    """
+    Drop-in replacement for SnowflakeDataConnector that reads customer data from a cohort export.
+
+    Each lookup reads only the customer's bucket file, filtered to the requested customer
+    IDs, and returns the same shape as get_customer_data() against Snowflake.
+    """
+
+    def __init__(self, export_dir: str = None):
+        """
+        Initialize the Parquet data connector.
+
+        Args:
+            export_dir (str, optional): Export location. Defaults to COHORT_EXPORT_DIR or Final_Pipeline/.cohort_export
+        """
+        if not ARROW_AVAILABLE:
+            raise ImportError("pyarrow is not installed. Install with: pip install \"snowflake-connector-python[pandas]\"")
+
+        self.export_dir = Path(export_dir or os.getenv('COHORT_EXPORT_DIR') or DEFAULT_EXPORT_DIR)
+        manifest_path = self.export_dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"No cohort export found at {self.export_dir}. Run cohort_export.py first.")
+        with open(manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+
+        self.connection = None
+        self.broker = None
+        self.broker_socket = None
+        self.telemetry = QueryTelemetry()
+        self.product_dimensions = None
+        self.customer_queries = {
+            query_name: self._bind_template(query_template)
+            for query_name, query_template in self._load_customer_queries().items()
+        }
+        self.customer_bulk_queries = {}
+        self.bulk_batch_size = int(os.getenv('SNOWFLAKE_BULK_BATCH_SIZE', '1000'))
+        self.max_concurrent_queries = 1
+        self.use_arrow = os.getenv('SNOWFLAKE_USE_ARROW', 'true').lower() != 'false'
+        # Reads from the export are already local
+        self.result_cache = None
+        self.num_buckets = self.manifest['num_buckets']
+
+        exported = self.manifest.get('queries', {})
+        oldest = min((info['exported_at'] for info in exported.values()), default=time.time())
+        print(f"📂 Cohort export: {self.export_dir} ({len(exported)} queries, {self.num_buckets} buckets, "
+              f"oldest {(time.time() - oldest) / 3600:.1f}h old)")
+        for query_name, query_template in self.customer_queries.items():
+            if query_name in exported and exported[query_name]['template_hash'] != QueryResultCache.template_hash(query_template):
+                print(f"⚠️ '{query_name}' was exported with an older version of its query template")
+
+    def connect(self) -> bool:
+        """Nothing to connect to; the export is read file by file."""
+        return True
+
+    def disconnect(self):
+        """Nothing to disconnect from."""
+        pass
+
+    def get_customer_data(self, customer_id: str, query_keys: list = None) -> Dict[str, Any]:
+        """
+        Get all data for a specific customer from the cohort export.
+
+        Args:
+            customer_id (str): Customer ID to look up
+            query_keys (list, optional): List of query keys to read. If None, read all.
+
+        Returns:
+            Dict[str, Any]: Dictionary containing all customer data
+        """
+        return self.get_customer_data_bulk([customer_id], query_keys)[str(customer_id)]
+
+    def get_customer_data_bulk(self, customer_ids: List[str], query_keys: list = None,
+                               batch_size: int = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Get data for many customers, reading each bucket file once per query.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Customer ID -> {query_name: rows}
+        """
+        query_names = list(self.customer_queries.keys()) if query_keys is None else [k for k in query_keys if k in self.customer_queries]
+        id_lookup = {self._normalize_customer_id(cid): str(cid) for cid in customer_ids}
+        bulk_data = {cid: {} for cid in id_lookup.values()}
+
+        ids_by_bucket = {}
+        for normalized_id in id_lookup:
+            ids_by_bucket.setdefault(customer_bucket(normalized_id, self.num_buckets), []).append(normalized_id)
+
+        for query_name in query_names:
+            query_info = self.manifest['queries'].get(query_name)
+            if query_info is None:
+                raise KeyError(f"Query '{query_name}' is not in the cohort export at {self.export_dir}")
+            for bucket, bucket_ids in ids_by_bucket.items():
+                start_time = time.time()
+                frame = self._read_bucket(query_name, bucket, bucket_ids, query_info['columns'])
+                self.telemetry.record(query_name, time.time() - start_time, frame, customers=len(bucket_ids))
+                self._split_bulk_frame(query_name, frame, bucket_ids, id_lookup, bulk_data)
+
+        if self.use_arrow:
+            return {cid: CustomerQueryResults(customer_data) for cid, customer_data in bulk_data.items()}
+        return {cid: {name: _frame_to_rows(frame) for name, frame in customer_data.items()}
+                for cid, customer_data in bulk_data.items()}
+
+    def _read_bucket(self, query_name: str, bucket: int, customer_ids: Iterable[str], columns: List[str]) -> pd.DataFrame:
+        """Read one bucket file, keeping only the rows for the given customers."""
+        bucket_path = _bucket_path(self.export_dir, query_name, bucket)
+        if not bucket_path.exists():
+            # No customer in this bucket had rows for the query
+            return pd.DataFrame(columns=[CUSTOMER_ID_COLUMN] + columns)
+        table = pq.read_table(str(bucket_path), filters=[(CUSTOMER_ID_COLUMN, 'in', [int(cid) for cid in customer_ids])])
+        return table.to_pandas()
+
+
+def main():
+    """Export the cohort, or show what an existing export contains."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cohort Export to partitioned Parquet")
+    parser.add_argument("--export-dir", help="Export location (default: COHORT_EXPORT_DIR or Final_Pipeline/.cohort_export)")
+    parser.add_argument("--buckets", type=int, help="Number of customer ID partitions (default: COHORT_EXPORT_BUCKETS or 64)")
+    parser.add_argument("--queries", nargs="+", help="Only export these query templates")
+    parser.add_argument("--status", action="store_true", help="Show the export manifest and exit")
+
+    args = parser.parse_args()
+
+    if args.status:
+        export_dir = Path(args.export_dir or os.getenv('COHORT_EXPORT_DIR') or DEFAULT_EXPORT_DIR)
+        manifest_path = export_dir / MANIFEST_FILE
+        if not manifest_path.exists():
+            print(f"❌ No cohort export at {export_dir}")
+            return
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        print(f"📂 Cohort export at {export_dir} ({manifest['num_buckets']} buckets)")
+        for query_name, info in manifest.get('queries', {}).items():
+            age_hours = (time.time() - info['exported_at']) / 3600
+            print(f"   {query_name}: {info['rows']} rows, {info['customers']} customers, {age_hours:.1f}h old")
+        return
+
+    exporter = CohortExporter(export_dir=args.export_dir, num_buckets=args.buckets)
+    try:
+        exporter.export(args.queries)
+    finally:
+        exporter.connector.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Local Data Connector for Chewy Playback Pipeline
+Runs the customer_queries.json templates against an embedded DuckDB database loaded
+from fixture files, so the pipeline can be benchmarked, profiled and replayed offline
+without warehouse access or credits.
+
+Fixture layout mirrors the Snowflake table names:
+    <fixtures_dir>/<database>/<schema>/<table>.parquet (or .csv)
+e.g. fixtures/edldb/chewybi/pet_profile_aggregate.parquet
+"""
+
+import os
+import re
+import time
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Any, Iterator, Tuple
+from snowflake_data_connector import SnowflakeDataConnector, ARROW_AVAILABLE
+from query_telemetry import QueryTelemetry
+from product_dimension_cache import ProductDimensionCache
+
+# Try to import DuckDB
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+DEFAULT_FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+# Snowflake functions used by the query templates, recreated as DuckDB macros
+SNOWFLAKE_COMPAT_MACROS = [
+    "CREATE OR REPLACE MACRO try_to_number(value) AS TRY_CAST(value AS DOUBLE)",
+    # REGEXP_SUBSTR(subject, pattern, position, occurrence, 'e', group) as used in the templates;
+    # Snowflake string literals unescape '\\d' to '\d', DuckDB literals don't
+    "CREATE OR REPLACE MACRO regexp_substr(subject, pattern, start_pos, occurrence, regex_params, grp) AS "
+    "NULLIF(regexp_extract(subject, replace(pattern, '\\\\', '\\'), grp), '')",
+    "CREATE OR REPLACE MACRO to_char(value, fmt) AS strftime(value, replace(fmt, 'Mon', '%b'))",
+]
+
+# Snowflake syntax DuckDB can't parse, rewritten as (pattern, replacement)
+SNOWFLAKE_DIALECT_REWRITES = [
+    # DATEDIFF(MONTH, a, b) / DATEADD(DAY, n, d) take a bare date part in Snowflake, a string in DuckDB
+    (re.compile(r"\b(DATEDIFF|DATEADD)\s*\(\s*([A-Za-z]+)\s*,", re.IGNORECASE), r"\1('\2',"),
+]
+
+# DuckDB column types -> the column kinds consolidated results are cast to (see
+# SNOWFLAKE_TYPE_KINDS), following what fetch_df() returns: dates come back as timestamps,
+# and DECIMAL and HUGEINT as floats
+DUCKDB_TYPE_KINDS = {
+    'TINYINT': 'int', 'SMALLINT': 'int', 'INTEGER': 'int', 'BIGINT': 'int',
+    'UTINYINT': 'int', 'USMALLINT': 'int', 'UINTEGER': 'int', 'UBIGINT': 'int',
+    'HUGEINT': 'float', 'DECIMAL': 'float', 'FLOAT': 'float', 'DOUBLE': 'float',
+    'DATE': 'datetime', 'TIMESTAMP': 'datetime', 'TIMESTAMP WITH TIME ZONE': 'datetime_tz', 'BOOLEAN': 'bool',
+}
+
+FIXTURE_READERS = {
+    '.parquet': "read_parquet('{path}')",
+    '.csv': "read_csv_auto('{path}')",
+}
+
+
+class LocalDataConnector(SnowflakeDataConnector):
+    """
+    Drop-in replacement for SnowflakeDataConnector backed by an embedded DuckDB database.
+
+    Runs the same query templates (single-customer and bulk) with the same bind-variable
+    handling, and returns results in the same shape, so get_customer_data(),
+    format_data_for_pipeline() and the DataFrame getters behave as they do against Snowflake.
+    """
+
+    # DuckDB packs a subquery's rows as a list of structs, returned as JSON
+    CONSOLIDATED_ROWS_SQL = "to_json(list(q))"
+    # fetch_df() keeps integer columns with NULLs as nullable integers, at microsecond resolution
+    NULLABLE_INT_DTYPE = 'Int64'
+    TIMESTAMP_UNIT = 'us'
+
+    def __init__(self, fixtures_dir: str = None, default_database: str = None):
+        """
+        Initialize the local data connector.
+
+        Args:
+            fixtures_dir (str, optional): Fixture root. Defaults to LOCAL_FIXTURES_DIR or Final_Pipeline/fixtures
+            default_database (str, optional): Database that schema-qualified (two-part) table names
+                resolve to. Defaults to LOCAL_DEFAULT_DATABASE, SNOWFLAKE_DATABASE or edldb
+        """
+        if not DUCKDB_AVAILABLE:
+            raise ImportError("duckdb is not installed. Install with: pip install duckdb")
+
+        self.fixtures_dir = Path(fixtures_dir or os.getenv('LOCAL_FIXTURES_DIR') or DEFAULT_FIXTURES_DIR)
+        self.default_database = (default_database or os.getenv('LOCAL_DEFAULT_DATABASE')
+                                 or os.getenv('SNOWFLAKE_DATABASE') or 'edldb').lower()
+        self.connection = None
+        self.broker = None
+        self.broker_socket = None
+        self.telemetry = QueryTelemetry()
+        self.loaded_tables = []
+
+        self.customer_queries = {
+            query_name: self._bind_template(self._to_duckdb_dialect(query_template))
+            for query_name, query_template in self._load_customer_queries().items()
+        }
+        self.customer_bulk_queries = {
+            query_name: self._to_duckdb_dialect(query_template)
+            for query_name, query_template in self._load_customer_queries("customer_bulk_queries.json").items()
+        }
+
+        self.bulk_batch_size = int(os.getenv('SNOWFLAKE_BULK_BATCH_SIZE', '1000'))
+        self.max_concurrent_queries = int(os.getenv('SNOWFLAKE_MAX_CONCURRENT_QUERIES', '1'))
+        self.use_arrow = ARROW_AVAILABLE and os.getenv('SNOWFLAKE_USE_ARROW', 'true').lower() != 'false'
+        self.fetch_batch_rows = int(os.getenv('SNOWFLAKE_FETCH_BATCH_ROWS', str(self.FETCH_BATCH_ROWS)))
+        self.consolidated_query = os.getenv('SNOWFLAKE_CONSOLIDATED_QUERY', 'false').lower() == 'true'
+        self._consolidated_statements = {}
+        self._template_schemas = {}
+        # Catalog built from the fixtures once per process, kept apart from the Snowflake one
+        self.product_dimensions = ProductDimensionCache(
+            self, cache_path=self.fixtures_dir / ".product_dimension.arrow", max_age_seconds=0) if ARROW_AVAILABLE else None
+        # Local queries are as cheap as a cache lookup, and must not mix with cached Snowflake results
+        self.result_cache = None
+
+        print(f"🦆 Local data source: {self.fixtures_dir} (default database: {self.default_database})")
+
+    @staticmethod
+    def _to_duckdb_dialect(query_template: str) -> str:
+        """Rewrite the Snowflake-only syntax in a query template for DuckDB."""
+        for pattern, replacement in SNOWFLAKE_DIALECT_REWRITES:
+            query_template = pattern.sub(replacement, query_template)
+        return query_template
+
+    @staticmethod
+    def _bind_template(query_template: str) -> str:
+        """Convert a {customer_id} query template to a statement with a $1 bind variable."""
+        return query_template.replace('{customer_id}', '$1')
+
+    @staticmethod
+    def _bind_customer_id_filter(query_template: str, batch_size: int) -> str:
+        """Convert a {customer_id_filter} bulk template to an IN-list of batch_size bind variables."""
+        bind_list = ', '.join(f'${i}' for i in range(1, batch_size + 1))
+        return query_template.replace('{customer_id_filter}', f'IN ({bind_list})')
+
+    def connect(self) -> bool:
+        """Create the in-memory DuckDB database and load the fixture files into it."""
+        try:
+            if not self.fixtures_dir.is_dir():
+                raise FileNotFoundError(f"Fixtures directory not found: {self.fixtures_dir}")
+
+            start_time = time.time()
+            self.connection = duckdb.connect(':memory:')
+            database_dirs = sorted(p for p in self.fixtures_dir.iterdir() if p.is_dir())
+            databases = {p.name.lower() for p in database_dirs} | {self.default_database}
+            for database in sorted(databases):
+                self.connection.execute(f'ATTACH \':memory:\' AS "{database}"')
+
+            self.loaded_tables = []
+            for database_dir in database_dirs:
+                for schema_dir in sorted(p for p in database_dir.iterdir() if p.is_dir()):
+                    table_prefix = f'"{database_dir.name.lower()}"."{schema_dir.name.lower()}"'
+                    self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {table_prefix}")
+                    for fixture_path in sorted(schema_dir.iterdir()):
+                        reader = FIXTURE_READERS.get(fixture_path.suffix.lower())
+                        if reader is None:
+                            continue
+                        table_name = f'{table_prefix}."{fixture_path.stem.lower()}"'
+                        source = reader.format(path=str(fixture_path.resolve()).replace("'", "''"))
+                        self.connection.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM {source}")
+                        self.loaded_tables.append(f"{database_dir.name}.{schema_dir.name}.{fixture_path.stem}".lower())
+
+            self.connection.execute(f'USE "{self.default_database}"')
+            for macro in SNOWFLAKE_COMPAT_MACROS:
+                self.connection.execute(macro)
+
+            print(f"✅ Loaded {len(self.loaded_tables)} fixture tables into DuckDB in {time.time() - start_time:.2f}s")
+            return True
+
+        except Exception as e:
+            print(f"❌ Failed to load local fixtures: {str(e)}")
+            self.connection = None
+            return False
+
+    def disconnect(self):
+        """Close the DuckDB database."""
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+            print("✅ Closed local DuckDB database")
+
+    def _open_cursor(self):
+        """Open a DuckDB cursor with the default database selected."""
+        # Each cursor is its own DuckDB connection, so concurrent queries don't share state
+        cursor = self.connection.cursor()
+        cursor.execute(f'USE "{self.default_database}"')
+        return cursor
+
+    def _execute_cursor(self, cursor, query: str, params: list = None, timeout: float = None):
+        """Run a statement on a DuckDB cursor (local queries have no statement timeout)."""
+        cursor.execute(query, params)
+
+    def _result_columns(self, cursor) -> List[str]:
+        """Column names upper-cased to match what Snowflake returns for unquoted identifiers."""
+        return [desc[0].upper() for desc in cursor.description]
+
+    def _execute_query(self, query: str, params: list = None, query_info: Dict[str, Any] = None) -> Any:
+        """Execute a query with bind values on a new DuckDB cursor."""
+        cursor = self._open_cursor()
+        try:
+            cursor.execute(query, params)
+            columns = self._result_columns(cursor)
+            if self.use_arrow:
+                frame = cursor.fetch_df()
+                frame.columns = columns
+                return frame
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _describe_query(self, query: str, params: list = None) -> List[Tuple[str, str]]:
+        """Get a query's result columns as (column, kind) pairs by running it with LIMIT 0."""
+        cursor = self._open_cursor()
+        try:
+            cursor.execute(f"SELECT * FROM ({query.strip().rstrip(';')}\n) q LIMIT 0", params)
+            return [(column, DUCKDB_TYPE_KINDS.get(str(desc[1]).split('(')[0].upper(), 'string'))
+                    for column, desc in zip(self._result_columns(cursor), cursor.description)]
+        finally:
+            cursor.close()
+
+    def iter_query_frames(self, query: str, params: list = None) -> Iterator[pd.DataFrame]:
+        """Run a query and yield its result as a series of DataFrames, one per Arrow record batch."""
+        with self._streaming_cursor(query, params) as cursor:
+            columns = self._result_columns(cursor)
+            for record_batch in cursor.fetch_record_batch(self.fetch_batch_rows):
+                frame = record_batch.to_pandas()
+                frame.columns = columns
+                yield frame
+
+
+def main():
+    """Load the fixtures and run the query templates for some customers, with timings."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local Data Connector (DuckDB fixtures)")
+    parser.add_argument("--fixtures-dir", help="Fixture root (default: LOCAL_FIXTURES_DIR or Final_Pipeline/fixtures)")
+    parser.add_argument("--customers", nargs="+", help="Customer IDs to run the query templates for")
+    parser.add_argument("--bulk", action="store_true", help="Use the bulk (IN-list) templates")
+
+    args = parser.parse_args()
+
+    connector = LocalDataConnector(fixtures_dir=args.fixtures_dir)
+    if not connector.connect():
+        return
+    print(f"📋 Tables: {', '.join(connector.loaded_tables) or 'none'}")
+    if not args.customers:
+        return
+
+    start_time = time.time()
+    if args.bulk:
+        results = connector.get_customer_data_bulk(args.customers)
+    else:
+        results = {customer_id: connector.get_customer_data(customer_id) for customer_id in args.customers}
+    elapsed = time.time() - start_time
+    for customer_id, customer_data in results.items():
+        counts = ', '.join(f"{name}={len(rows)}" for name, rows in customer_data.items())
+        print(f"👤 {customer_id}: {counts}")
+    print(f"⏱️ {len(results)} customers in {elapsed:.2f}s ({elapsed / max(len(results), 1):.3f}s per customer)")
+    connector.telemetry.print_summary()
+    connector.disconnect()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+OpenAI Rate Limiter for Chewy Playback Pipeline
+Token buckets for the configured requests-per-minute and tokens-per-minute budgets per
+model, kept in a locked local state file so every agent, thread and worker process on the
+machine draws from the same budget. Calls wait for budget instead of tripping 429s, and a 429 that
+still gets through pauses the model for everyone before the call is retried. Bulk runs
+leave part of each budget to interactive runs (see priority_lanes). During a run with a
+deadline (see run_deadline), calls time out with the run and stop waiting once it's over.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional
+from priority_lanes import INTERACTIVE, current_priority, get_priority_lanes
+from run_deadline import DeadlineExceeded, current_deadline
+
+# Try to import fcntl (POSIX) for cross-process file locking
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Per-model budgets (OpenAI usage tier 1) used when the limiter is turned on with
+# OPENAI_RATE_LIMIT=1; setting the account's own with OPENAI_RATE_LIMITS, e.g.
+# '{"gpt-4": {"rpm": 10000, "tpm": 300000}}', turns it on too. For image models rpm is
+# images per minute.
+DEFAULT_LIMITS = {
+    'gpt-4': {'rpm': 500, 'tpm': 10000},
+    'gpt-4o': {'rpm': 500, 'tpm': 30000},
+    'gpt-image-1': {'rpm': 5, 'tpm': 0},
+}
+
+DEFAULT_STATE_PATH = Path(__file__).parent / ".rate_limits" / "openai_buckets.json"
+MAX_RETRIES = 5
+# Tokens counted for a request that sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+# Share of each model's budget that bulk runs leave for interactive ones (OPENAI_INTERACTIVE_RESERVE)
+DEFAULT_INTERACTIVE_RESERVE = 0.2
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """
+    Estimate the tokens a request counts against the TPM budget: the prompt (about four
+    characters per token) plus max_tokens, which OpenAI reserves up front.
+    """
+    if 'messages' not in request:
+        return 0
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in request['messages'])
+    return prompt_chars // 4 + int(request.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+
+
+class OpenAIRateLimiter:
+    """
+    Requests and tokens per minute per model, as token buckets shared through a state file.
+
+    Each bucket holds up to a minute's budget and refills continuously. acquire() takes a
+    request's share under an exclusive flock on the state file, so concurrent processes
+    never overspend, and waits for the buckets to refill when the budget is spent. Bulk
+    callers stop short of the last interactive_reserve of each bucket.
+
+    The budgets are only enforced when configured (OPENAI_RATE_LIMITS or OPENAI_RATE_LIMIT=1),
+    since they must match the account's tier. Otherwise only 429s are handled: the model is
+    paused in this process for the server's Retry-After, without touching the state file.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, int]] = None, state_path: str = None):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            limits (Dict, optional): Model -> {'rpm', 'tpm'}. Defaults to DEFAULT_LIMITS
+                updated with OPENAI_RATE_LIMITS; models not listed are not limited
+            state_path (str, optional): Shared state file. Defaults to OPENAI_RATE_LIMIT_STATE
+                or Final_Pipeline/.rate_limits/openai_buckets.json
+        """
+        if limits is None:
+            limits = {**DEFAULT_LIMITS, **json.loads(os.getenv('OPENAI_RATE_LIMITS', '{}'))}
+        self.limits = limits
+        setting = os.getenv('OPENAI_RATE_LIMIT')
+        if setting is None:
+            self.enabled = bool(os.getenv('OPENAI_RATE_LIMITS'))
+        else:
+            self.enabled = setting.lower() not in ('0', 'false', 'no')
+        self.state_path = Path(state_path or os.getenv('OPENAI_RATE_LIMIT_STATE') or DEFAULT_STATE_PATH)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.interactive_reserve = float(os.getenv('OPENAI_INTERACTIVE_RESERVE', str(DEFAULT_INTERACTIVE_RESERVE)))
+        # Serializes threads of this process; the flock serializes processes
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rate_limit_errors = 0
+        # Model -> time.time() until which 429s pause models without a shared budget
+        self._paused_until = {}
+
+    def _update_state(self, update: Callable[[Dict[str, Any], float], Any]) -> Any:
+        """Read, modify and write the shared state under the locks; returns update()'s result."""
+        with self._lock, open(self.state_path, 'a+') as f:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    state = {}
+                result = update(state, time.time())
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state: Dict[str, Any], model: str, now: float) -> Dict[str, Any]:
+        """Bring a model's buckets up to date (a new model starts with full buckets)."""
+        limits = self.limits[model]
+        bucket = state.setdefault(model, {'requests': limits['rpm'], 'tokens': limits.get('tpm', 0),
+                                          'updated': now, 'paused_until': 0})
+        elapsed = max(0.0, now - bucket['updated'])
+        bucket['requests'] = min(limits['rpm'], bucket['requests'] + elapsed * limits['rpm'] / 60)
+        if limits.get('tpm'):
+            bucket['tokens'] = min(limits['tpm'], bucket['tokens'] + elapsed * limits['tpm'] / 60)
+        bucket['updated'] = now
+        return bucket
+
+    def try_acquire(self, model: str, tokens: int = 0, priority: str = None) -> float:
+        """
+        Take one request and `tokens` tokens from a model's budget if they're available.
+
+        Args:
+            model (str): Model whose budget to draw from
+            tokens (int): Estimated tokens of the request
+            priority (str, optional): Priority class. Defaults to current_priority(); bulk
+                requests also leave the interactive reserve in the buckets
+
+        Returns:
+            float: 0 if the budget was taken, otherwise the seconds to wait before trying again
+        """
+        if not self._limited(model):
+            return max(0.0, self._paused_until.get(model, 0) - time.time())
+        limits = self.limits[model]
+        reserve = 0.0 if (priority or current_priority()) == INTERACTIVE else self.interactive_reserve
+        reserved_requests = min(reserve * limits['rpm'], limits['rpm'] - 1)
+        reserved_tokens = reserve * limits.get('tpm', 0)
+        # A request larger than a whole minute's budget waits for a full bucket, not forever
+        tokens = min(tokens, limits['tpm'] - reserved_tokens) if limits.get('tpm') else 0
+
+        def take(state: Dict[str, Any], now: float) -> float:
+            bucket = self._refill(state, model, now)
+            if bucket['paused_until'] > now:
+                return bucket['paused_until'] - now
+            waits = [(1 + reserved_requests - bucket['requests']) * 60 / limits['rpm']]
+            if tokens:
+                waits.append((tokens + reserved_tokens - bucket['tokens']) * 60 / limits['tpm'])
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            bucket['requests'] -= 1
+            bucket['tokens'] -= tokens
+            return 0.0
+
+        return self._update_state(take)
+
+    def acquire(self, model: str, tokens: int = 0):
+        """
+        Block until a request with `tokens` tokens fits in a model's budget, then take it.
+        Raises DeadlineExceeded instead of waiting past the current run's deadline.
+        """
+        while True:
+            wait = self.try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            self._record_wait(model, wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, model: str, tokens: int = 0):
+        """
+        Async version of acquire that waits on the event loop instead of a thread. The state
+        file is read and written on a worker thread, so a flock held by another process
+        never stalls the event loop.
+        """
+        while True:
+            if self._limited(model):
+                wait = await asyncio.to_thread(self.try_acquire, model, tokens)
+            else:
+                wait = self.try_acquire(model, tokens)
+            if wait <= 0:
+                return
+            self._record_wait(model, wait)
+            await asyncio.sleep(wait)
+
+    def _limited(self, model: str) -> bool:
+        return self.enabled and model in self.limits
+
+    def _record_wait(self, model: str, wait: float):
+        deadline = current_deadline()
+        if deadline and not deadline.allows(wait):
+            raise DeadlineExceeded(f"{model} rate limit budget frees up in {wait:.1f}s, after the run's deadline")
+        self.waits += 1
+        self.wait_seconds += wait
+
+    def settle(self, model: str, estimated_tokens: int, used_tokens: Optional[int]):
+        """Return the unused part of a request's token estimate once its actual usage is known."""
+        if not self._limited(model) or used_tokens is None or not self.limits[model].get('tpm'):
+            return
+
+        def adjust(state: Dict[str, Any], now: float):
+            bucket = self._refill(state, model, now)
+            bucket['tokens'] = min(self.limits[model]['tpm'], bucket['tokens'] + estimated_tokens - used_tokens)
+
+        self._update_state(adjust)
+
+    async def settle_async(self, model: str, estimated_tokens: int, used_tokens: Optional[int]):
+        """Async version of settle that updates the state file on a worker thread."""
+        if self._limited(model):
+            await asyncio.to_thread(self.settle, model, estimated_tokens, used_tokens)
+
+    def pause(self, model: str, seconds: float):
+        """Stop every process from calling a model for a while, e.g. after a 429 (only this one without a budget)."""
+        self.rate_limit_errors += 1
+        if not self._limited(model):
+            self._paused_until[model] = max(self._paused_until.get(model, 0), time.time() + seconds)
+            return
+
+        def hold(state: Dict[str, Any], now: float):
+            bucket = self._refill(state, model, now)
+            bucket['paused_until'] = max(bucket['paused_until'], now + seconds)
+
+        self._update_state(hold)
+
+    async def pause_async(self, model: str, seconds: float):
+        """Async version of pause that updates the state file on a worker thread."""
+        if self._limited(model):
+            await asyncio.to_thread(self.pause, model, seconds)
+        else:
+            self.pause(model, seconds)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Get each limited model's remaining requests and tokens and any pause."""
+        def read(state: Dict[str, Any], now: float) -> Dict[str, Dict[str, Any]]:
+            status = {}
+            for model, limits in self.limits.items():
+                bucket = self._refill(state, model, now)
+                status[model] = {'requests': int(bucket['requests']), 'rpm': limits['rpm'],
+                                 'tokens': int(bucket['tokens']), 'tpm': limits.get('tpm', 0),
+                                 'paused_seconds': round(max(0.0, bucket['paused_until'] - now), 1)}
+            return status
+
+        return self._update_state(read)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get this process's waits for budget and the 429s it saw."""
+        return {'waits': self.waits, 'wait_seconds': round(self.wait_seconds, 2),
+                'rate_limit_errors': self.rate_limit_errors}
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> OpenAIRateLimiter:
+    """Get the process-wide rate limiter every OpenAI call site shares."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = OpenAIRateLimiter()
+        return _rate_limiter
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Seconds to back off after a 429: the server's Retry-After, or exponential backoff."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(60.0, 2.0 ** attempt)
+
+
+def _used_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None)
+
+
+def _lane(request: Dict[str, Any]) -> str:
+    """Priority lane of a request: chat completions are 'llm', everything else is image generation."""
+    return 'llm' if 'messages' in request else 'image'
+
+
+def _with_deadline(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the current run's time left as the request's timeout, unless it sets a shorter one."""
+    deadline = current_deadline()
+    if deadline is None:
+        return request
+    return {**request, 'timeout': deadline.timeout(request.get('timeout'))}
+
+
+def rate_limited(create: Callable[..., Any], request: Dict[str, Any], limiter: OpenAIRateLimiter = None) -> Any:
+    """
+    Call an OpenAI create function (chat.completions.create, images.generate) within the
+    shared budget and a priority lane slot, retrying 429s after pausing the model for
+    every process. During a run with a deadline the call times out with the run.
+
+    Args:
+        create (Callable): The client method to call
+        request (Dict[str, Any]): Its keyword arguments; 'model' picks the budget
+        limiter (OpenAIRateLimiter, optional): Defaults to get_rate_limiter()
+
+    Returns:
+        Any: create()'s response
+    """
+    limiter = limiter or get_rate_limiter()
+    model, tokens = request.get('model'), estimate_tokens(request)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire(model, tokens)
+        try:
+            with get_priority_lanes().slot(_lane(request)):
+                response = create(**_with_deadline(request))
+        except Exception as e:
+            if not _is_rate_limit_error(e) or attempt == MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"⏳ OpenAI rate limit hit for {model}, retrying in {delay:.1f}s")
+            limiter.pause(model, delay)
+            continue
+        limiter.settle(model, tokens, _used_tokens(response))
+        return response
+
+
+async def rate_limited_async(create: Callable[..., Any], request: Dict[str, Any],
+                             limiter: OpenAIRateLimiter = None) -> Any:
+    """Async version of rate_limited, for the AsyncOpenAI client's methods."""
+    limiter = limiter or get_rate_limiter()
+    model, tokens = request.get('model'), estimate_tokens(request)
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire_async(model, tokens)
+        try:
+            async with get_priority_lanes().slot_async(_lane(request)):
+                response = await create(**_with_deadline(request))
+        except Exception as e:
+            if not _is_rate_limit_error(e) or attempt == MAX_RETRIES:
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"⏳ OpenAI rate limit hit for {model}, retrying in {delay:.1f}s")
+            await limiter.pause_async(model, delay)
+            continue
+        await limiter.settle_async(model, tokens, _used_tokens(response))
+        return response
+
+
+def main():
+    """Show the shared OpenAI budgets or reset them."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI Rate Limiter")
+    parser.add_argument("--reset", action="store_true", help="Refill every bucket and clear pauses")
+
+    args = parser.parse_args()
+
+    limiter = OpenAIRateLimiter()
+    if args.reset and limiter.state_path.exists():
+        limiter.state_path.unlink()
+        print(f"🧹 Reset OpenAI budgets at {limiter.state_path}")
+    for model, status in limiter.status().items():
+        paused = f", paused {status['paused_seconds']}s" if status['paused_seconds'] else ''
+        print(f"🚦 {model}: {status['requests']}/{status['rpm']} requests, "
+              f"{status['tokens']}/{status['tpm']} tokens{paused}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Pipeline Checkpoints for Chewy Playback Pipeline
+Stores each customer's stage results under Output/<customer_id>/.pipeline_state/ as
+the stages finish, so an interrupted or failed run can be resumed with --resume without
+paying again for the LLM and Snowflake calls that already succeeded. Each result also
+keeps a fingerprint of the stage's inputs, so later runs skip stages whose inputs
+haven't changed.
+"""
+
+import os
+import json
+import base64
+import hashlib
+from pathlib import Path
+from decimal import Decimal
+from datetime import date, datetime
+from typing import Dict, List, Any, Optional
+
+# Stages in the order a customer goes through them
+STAGES = ['intelligence', 'breed', 'narrative', 'image', 'unknowns', 'food', 'saved']
+
+# Part of every fingerprint; bump it when prompts or models change so stored results
+# are recomputed even though the data hasn't moved
+FINGERPRINT_VERSION = 1
+
+
+def _json_default(obj):
+    """Serialize the non-JSON values stage results carry (Decimals, dates, numpy scalars, image bytes)."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        # save_outputs decodes non-URL image strings as base64
+        return base64.b64encode(obj).decode('ascii')
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _fingerprint_default(obj):
+    """Like _json_default, but falls back to str() for anything else."""
+    try:
+        return _json_default(obj)
+    except TypeError:
+        return str(obj)
+
+
+def fingerprint(*inputs: Any) -> str:
+    """
+    Hash a stage's inputs.
+
+    Args:
+        *inputs: JSON-like values (query rows, profiles, prompts); dict key order doesn't matter
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256(f"v{FINGERPRINT_VERSION}".encode())
+    for value in inputs:
+        digest.update(json.dumps(value, sort_keys=True, default=_fingerprint_default).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CustomerCheckpoint:
+    """
+    One customer's stage results, one JSON file per stage.
+
+    Each stage writes its own file (atomically, through a temp file and rename), so stages
+    running concurrently for the same customer never write the same file, and a crash
+    mid-write leaves the previous result or none at all.
+    """
+
+    STATE_DIR = ".pipeline_state"
+
+    def __init__(self, output_dir: Path, customer_id: str):
+        """
+        Initialize the checkpoint for a customer.
+
+        Args:
+            output_dir (Path): Pipeline output directory
+            customer_id (str): Customer ID
+        """
+        self.customer_id = str(customer_id)
+        self.state_dir = Path(output_dir) / self.customer_id / self.STATE_DIR
+
+    def _stage_path(self, stage: str) -> Path:
+        return self.state_dir / f"{stage}.json"
+
+    def has(self, stage: str) -> bool:
+        """Check whether a stage has a stored result."""
+        return self._stage_path(stage).exists()
+
+    def load(self, stage: str) -> Any:
+        """
+        Load a stage's stored result.
+
+        Returns:
+            Any: The result the stage returned, as JSON
+        """
+        with open(self._stage_path(stage)) as f:
+            return json.load(f)['result']
+
+    def record(self, stage: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a stage's stored record.
+
+        Returns:
+            Optional[Dict[str, Any]]: {'stage', 'completed_at', 'fingerprint', 'result'}, or None
+                when the stage has no readable record
+        """
+        path = self._stage_path(stage)
+        if not path.exists():
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"    ⚠️ Ignoring unreadable {stage} checkpoint for customer {self.customer_id}: {e}")
+            return None
+
+    def save(self, stage: str, result: Any, input_fingerprint: str = None) -> bool:
+        """
+        Store a stage's result. A result that can't be stored is reported and skipped; the
+        stage then simply runs again on resume.
+
+        Args:
+            stage (str): Stage name
+            result (Any): Stage result
+            input_fingerprint (str, optional): fingerprint() of the inputs the result was computed from
+
+        Returns:
+            bool: Whether the result was stored
+        """
+        path = self._stage_path(stage)
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp_path, 'w') as f:
+                json.dump({'stage': stage, 'completed_at': datetime.now().isoformat(),
+                           'fingerprint': input_fingerprint, 'result': result}, f, default=_json_default)
+            os.replace(temp_path, path)
+            return True
+        except Exception as e:
+            print(f"    ⚠️ Could not checkpoint {stage} for customer {self.customer_id}: {e}")
+            return False
+
+    def clear(self):
+        """Remove every stored stage result for the customer."""
+        if not self.state_dir.exists():
+            return
+        for path in self.state_dir.glob("*.json"):
+            path.unlink()
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Get the customer's completed stages.
+
+        Returns:
+            Dict[str, Any]: Stage -> completion time (ISO format), in pipeline order
+        """
+        status = {}
+        for stage in STAGES:
+            path = self._stage_path(stage)
+            if path.exists():
+                status[stage] = datetime.fromtimestamp(path.stat().st_mtime).isoformat(timespec='seconds')
+        return status
+
+
+def checkpoint_status(output_dir: Path, customer_ids: List[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Get the completed stages of several customers.
+
+    Args:
+        output_dir (Path): Pipeline output directory
+        customer_ids (List[str], optional): Customers to report. Defaults to every customer with checkpoints
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Customer ID -> stage -> completion time
+    """
+    output_dir = Path(output_dir)
+    if not customer_ids:
+        customer_ids = sorted(path.parent.name for path in output_dir.glob(f"*/{CustomerCheckpoint.STATE_DIR}"))
+    return {customer_id: CustomerCheckpoint(output_dir, customer_id).status() for customer_id in customer_ids}
+
+
+def main():
+    """Show or clear customers' stage checkpoints."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pipeline Checkpoints")
+    parser.add_argument("--customers", nargs="+", help="Customer IDs (default: every customer with checkpoints)")
+    parser.add_argument("--output-dir", default=str(Path(__file__).parent / "Output"), help="Pipeline output directory")
+    parser.add_argument("--clear", action="store_true", help="Remove the customers' checkpoints")
+
+    args = parser.parse_args()
+
+    for customer_id, status in checkpoint_status(Path(args.output_dir), args.customers).items():
+        if args.clear:
+            CustomerCheckpoint(Path(args.output_dir), customer_id).clear()
+            print(f"🧹 Cleared checkpoints for customer {customer_id}")
+            continue
+        pending = [stage for stage in STAGES if stage not in status]
+        print(f"📍 {customer_id}: done {', '.join(status) or 'nothing'}"
+              f"{'; pending ' + ', '.join(pending) if pending else ''}")
+
+
+if __name__ == "__main__":
+    main()
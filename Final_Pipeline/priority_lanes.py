@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Priority Lanes for Chewy Playback Pipeline
+Concurrency slots for the resources every pipeline run on the machine shares (OpenAI
+chat calls, image generation, Snowflake queries), split into two priority classes.
+Interactive runs, started from the web app for a customer who is waiting on the page,
+can always use slots held back from bulk runs, and bulk runs step aside while an
+interactive call is waiting, so a nightly batch never sits in front of a live request.
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from pathlib import Path
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, Callable, Optional
+from run_deadline import current_deadline
+
+# Try to import fcntl (POSIX) for cross-process file locking
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Slots per resource across all processes, and how many of them only interactive runs may
+# use, when the lanes are turned on with PIPELINE_LANES_ENABLED=1; setting them with
+# PIPELINE_LANES, e.g. '{"image": {"slots": 8, "reserved": 2}}', turns them on too
+DEFAULT_LANES = {
+    'llm': {'slots': 64, 'reserved': 8},
+    'image': {'slots': 4, 'reserved': 1},
+    'snowflake': {'slots': 8, 'reserved': 2},
+}
+
+DEFAULT_STATE_PATH = Path(__file__).parent / ".rate_limits" / "priority_lanes.json"
+# Seconds between checks for a free slot
+POLL_SECONDS = 0.05
+
+_priority = None
+
+
+def current_priority() -> str:
+    """Get this process's priority class: set_priority()'s, else PIPELINE_PRIORITY, else bulk."""
+    if _priority:
+        return _priority
+    priority = os.getenv('PIPELINE_PRIORITY', BULK).lower()
+    return priority if priority in PRIORITIES else BULK
+
+
+def set_priority(priority: str):
+    """
+    Set this process's priority class, for its own calls and the processes it starts.
+
+    Args:
+        priority (str): 'interactive' or 'bulk'
+    """
+    global _priority
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}': expected one of {', '.join(PRIORITIES)}")
+    _priority = priority
+    os.environ['PIPELINE_PRIORITY'] = priority
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PriorityLanes:
+    """
+    Per-resource concurrency slots shared through a locked state file.
+
+    Every call holds a lease on a resource's slots while it runs. Bulk calls may hold at
+    most slots - reserved of them and wait while any interactive call is waiting;
+    interactive calls may take any free slot. Leases of processes that died are dropped,
+    so a killed run never holds slots. Waiting stops with DeadlineExceeded once the
+    current run's deadline has passed.
+
+    The lanes are only enforced when turned on (PIPELINE_LANES_ENABLED=1 or PIPELINE_LANES),
+    for machines where bulk and interactive runs share the resources. Every slot costs two
+    locked state file updates, which a lone run shouldn't pay for.
+    """
+
+    def __init__(self, lanes: Dict[str, Dict[str, int]] = None, state_path: str = None):
+        """
+        Initialize the priority lanes.
+
+        Args:
+            lanes (Dict, optional): Resource -> {'slots', 'reserved'}. Defaults to DEFAULT_LANES
+                updated with PIPELINE_LANES; resources not listed are not limited
+            state_path (str, optional): Shared state file. Defaults to PIPELINE_LANES_STATE
+                or Final_Pipeline/.rate_limits/priority_lanes.json
+        """
+        if lanes is None:
+            lanes = {**DEFAULT_LANES, **json.loads(os.getenv('PIPELINE_LANES', '{}'))}
+        self.lanes = lanes
+        setting = os.getenv('PIPELINE_LANES_ENABLED')
+        if setting is None:
+            self.enabled = bool(os.getenv('PIPELINE_LANES'))
+        else:
+            self.enabled = setting.lower() not in ('0', 'false', 'no')
+        self.state_path = Path(state_path or os.getenv('PIPELINE_LANES_STATE') or DEFAULT_STATE_PATH)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        # Serializes threads of this process; the flock serializes processes
+        self._lock = threading.Lock()
+        self.waits = {priority: 0 for priority in PRIORITIES}
+        self.wait_seconds = {priority: 0.0 for priority in PRIORITIES}
+
+    def _update_state(self, update: Callable[[Dict[str, Any]], Any]) -> Any:
+        """Read, modify and write the shared state under the locks; returns update()'s result."""
+        with self._lock, open(self.state_path, 'a+') as f:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    state = {}
+                result = update(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _lane(state: Dict[str, Any], resource: str) -> Dict[str, Any]:
+        """Get a resource's leases and waiters, dropping those of processes that have exited."""
+        lane = state.setdefault(resource, {'leases': {}, 'waiting': {}})
+        for key in ('leases', 'waiting'):
+            lane[key] = {lease_id: entry for lease_id, entry in lane[key].items() if _pid_alive(entry['pid'])}
+        return lane
+
+    def try_acquire(self, resource: str, lease_id: str, priority: str) -> bool:
+        """
+        Take a slot of a resource if the priority class may have one now. A caller that
+        can't is recorded as waiting until it gets one or gives up with release().
+
+        Returns:
+            bool: Whether the slot was taken
+        """
+        lane_limits = self.lanes[resource]
+
+        def take(state: Dict[str, Any]) -> bool:
+            lane = self._lane(state, resource)
+            held = len(lane['leases'])
+            if priority == INTERACTIVE:
+                allowed = held < lane_limits['slots']
+            else:
+                interactive_waiting = any(entry['priority'] == INTERACTIVE for entry in lane['waiting'].values())
+                allowed = held < lane_limits['slots'] - lane_limits.get('reserved', 0) and not interactive_waiting
+            if allowed:
+                lane['waiting'].pop(lease_id, None)
+                lane['leases'][lease_id] = {'pid': os.getpid(), 'priority': priority, 'since': time.time()}
+            else:
+                lane['waiting'][lease_id] = {'pid': os.getpid(), 'priority': priority}
+            return allowed
+
+        return self._update_state(take)
+
+    def release(self, resource: str, lease_id: str):
+        """Give back a slot, or stop waiting for one."""
+        def drop(state: Dict[str, Any]):
+            lane = self._lane(state, resource)
+            lane['leases'].pop(lease_id, None)
+            lane['waiting'].pop(lease_id, None)
+
+        self._update_state(drop)
+
+    def _limited(self, resource: str) -> bool:
+        return self.enabled and resource in self.lanes
+
+    def capacity(self, resource: str, priority: str = None) -> Optional[int]:
+        """
+        Get how many slots of a resource a priority class may hold at once.
+
+        Args:
+            resource (str): 'llm', 'image' or 'snowflake'
+            priority (str, optional): Priority class. Defaults to current_priority()
+
+        Returns:
+            Optional[int]: slots - reserved for bulk, slots for interactive; None when not limited
+        """
+        if not self._limited(resource):
+            return None
+        lane_limits = self.lanes[resource]
+        if (priority or current_priority()) == INTERACTIVE:
+            return lane_limits['slots']
+        return lane_limits['slots'] - lane_limits.get('reserved', 0)
+
+    @staticmethod
+    def _check_deadline(resource: str):
+        deadline = current_deadline()
+        if deadline:
+            deadline.check(f"waiting for a {resource} slot")
+
+    def _record_wait(self, priority: str, seconds: float):
+        self.waits[priority] += 1
+        self.wait_seconds[priority] += seconds
+
+    @contextmanager
+    def slot(self, resource: str, priority: str = None):
+        """
+        Hold a slot of a resource for the duration of a with block, waiting for one first.
+
+        Args:
+            resource (str): 'llm', 'image' or 'snowflake'
+            priority (str, optional): Priority class. Defaults to current_priority()
+        """
+        if not self._limited(resource):
+            yield
+            return
+        priority = priority or current_priority()
+        lease_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+        start_time = time.time()
+        try:
+            waited = False
+            while not self.try_acquire(resource, lease_id, priority):
+                waited = True
+                self._check_deadline(resource)
+                time.sleep(POLL_SECONDS)
+            if waited:
+                self._record_wait(priority, time.time() - start_time)
+            yield
+        finally:
+            self.release(resource, lease_id)
+
+    @asynccontextmanager
+    async def slot_async(self, resource: str, priority: str = None):
+        """
+        Async version of slot that waits on the event loop instead of a thread. The state
+        file is read and written on a worker thread, so a flock held by another process
+        never stalls the event loop.
+        """
+        if not self._limited(resource):
+            yield
+            return
+        priority = priority or current_priority()
+        lease_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+        start_time = time.time()
+        try:
+            waited = False
+            while not await asyncio.to_thread(self.try_acquire, resource, lease_id, priority):
+                waited = True
+                self._check_deadline(resource)
+                await asyncio.sleep(POLL_SECONDS)
+            if waited:
+                self._record_wait(priority, time.time() - start_time)
+            yield
+        finally:
+            await asyncio.to_thread(self.release, resource, lease_id)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Get each resource's slots in use and callers waiting, by priority class."""
+        def read(state: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+            status = {}
+            for resource, lane_limits in self.lanes.items():
+                lane = self._lane(state, resource)
+                status[resource] = {
+                    'slots': lane_limits['slots'], 'reserved': lane_limits.get('reserved', 0),
+                    'held': {p: sum(e['priority'] == p for e in lane['leases'].values()) for p in PRIORITIES},
+                    'waiting': {p: sum(e['priority'] == p for e in lane['waiting'].values()) for p in PRIORITIES},
+                }
+            return status
+
+        return self._update_state(read)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get how often and how long this process waited for slots, by priority class."""
+        return {'priority': current_priority(), 'waits': dict(self.waits),
+                'wait_seconds': {p: round(seconds, 2) for p, seconds in self.wait_seconds.items()}}
+
+
+_lanes = None
+_lanes_lock = threading.Lock()
+
+
+def get_priority_lanes() -> PriorityLanes:
+    """Get the process-wide priority lanes every OpenAI and Snowflake call site shares."""
+    global _lanes
+    with _lanes_lock:
+        if _lanes is None:
+            _lanes = PriorityLanes()
+        return _lanes
+
+
+def main():
+    """Show the slots in use per resource and priority class, or reset them."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Priority Lanes")
+    parser.add_argument("--reset", action="store_true", help="Drop every lease and waiter")
+
+    args = parser.parse_args()
+
+    lanes = PriorityLanes()
+    if args.reset and lanes.state_path.exists():
+        lanes.state_path.unlink()
+        print(f"🧹 Reset priority lanes at {lanes.state_path}")
+    for resource, status in lanes.status().items():
+        held, waiting = status['held'], status['waiting']
+        print(f"🛣️ {resource}: {held[INTERACTIVE]} interactive + {held[BULK]} bulk of {status['slots']} slots "
+              f"({status['reserved']} reserved for interactive), waiting {waiting[INTERACTIVE]} interactive, "
+              f"{waiting[BULK]} bulk")
+
+
+if __name__ == "__main__":
+    main()
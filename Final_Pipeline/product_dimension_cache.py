@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Product Dimension Cache for Chewy Playback Pipeline
+Keeps a local copy of the product catalog (product_id -> name, category) as a
+memory-mapped Arrow file, so per-customer order queries can return only product IDs
+and quantities and the product details are joined in locally.
+"""
+
+import os
+import time
+import tempfile
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+# Try to import pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# The product_details CTE the slim orders template no longer joins
+PRODUCT_DIMENSION_QUERY = """
+select
+    product_id,
+    name,
+    category_level3
+from edldb.pdm.product
+where product_id is not null
+"""
+
+PRODUCT_COLUMNS = ['NAME', 'CATEGORY_LEVEL3']
+
+
+class ProductDimensionCache:
+    """
+    Product catalog stored as an Arrow IPC file and read through a memory map.
+
+    The file is refreshed from the warehouse when it is older than max_age_seconds, and
+    lookups take only the matching rows from the mapped table, so every pipeline process
+    shares the same pages instead of loading the catalog into its own memory. Each lookup
+    checks the file again, so a long-lived process (the web app, a broker-backed worker)
+    picks up a catalog another process refreshed, and refreshes it once it goes stale.
+    """
+
+    DEFAULT_PATH = Path(__file__).parent / ".product_cache" / "product_dimension.arrow"
+    # Seconds to keep using the cached catalog after a failed refresh before trying again
+    REFRESH_RETRY_SECONDS = 300
+
+    def __init__(self, connector, cache_path: str = None, max_age_seconds: float = None):
+        """
+        Initialize the product dimension cache.
+
+        Args:
+            connector: Data connector used to refresh the catalog (SnowflakeDataConnector or a subclass)
+            cache_path (str, optional): Arrow file path. Defaults to PRODUCT_CACHE_PATH or
+                Final_Pipeline/.product_cache/product_dimension.arrow
+            max_age_seconds (float, optional): Age after which the catalog is refreshed.
+                Defaults to PRODUCT_CACHE_MAX_AGE_HOURS (24h); 0 refreshes it once per process,
+                on first use
+        """
+        if not ARROW_AVAILABLE:
+            raise ImportError("pyarrow is not installed. Install with: pip install \"snowflake-connector-python[pandas]\"")
+
+        self.connector = connector
+        self.cache_path = Path(cache_path or os.getenv('PRODUCT_CACHE_PATH') or self.DEFAULT_PATH)
+        self.max_age_seconds = (max_age_seconds if max_age_seconds is not None
+                                else float(os.getenv('PRODUCT_CACHE_MAX_AGE_HOURS', '24')) * 3600)
+        self._table = None
+        # (inode, mtime, size) of the file _table was read from
+        self._table_file = None
+        self._refresh_failed_at = 0.0
+        # Threads of one process share the table and refresh it once
+        self._lock = threading.Lock()
+
+    def age_seconds(self) -> Optional[float]:
+        """Seconds since the catalog file was written, or None when there is none."""
+        if not self.cache_path.exists():
+            return None
+        return time.time() - self.cache_path.stat().st_mtime
+
+    def is_stale(self) -> bool:
+        """Check whether the catalog file is missing or older than max_age_seconds."""
+        age = self.age_seconds()
+        return age is None or age > self.max_age_seconds
+
+    def _file_identity(self) -> Optional[Tuple[int, int, int]]:
+        """(inode, mtime, size) of the catalog file, which changes whenever a refresh replaces it."""
+        try:
+            stat = self.cache_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh_due(self) -> bool:
+        """Whether to refresh before a lookup: stale, and no refresh failed in the last REFRESH_RETRY_SECONDS."""
+        if self._table is not None and not self.max_age_seconds:
+            return False
+        return self.is_stale() and time.time() - self._refresh_failed_at > self.REFRESH_RETRY_SECONDS
+
+    def refresh(self) -> int:
+        """
+        Download the product catalog and atomically replace the Arrow file. Each refresh
+        writes its own temporary file, so concurrent refreshes in several processes never
+        write into the same file; the last os.replace wins.
+
+        Returns:
+            int: Number of products written
+        """
+        start_time = time.time()
+        print(f"📥 Refreshing product dimension cache...")
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.cache_path.parent, prefix=self.cache_path.name + '.',
+                                         suffix='.tmp', delete=False) as temp_file:
+            temp_path = temp_file.name
+        schema = pa.schema([('PRODUCT_ID', pa.int64()), ('NAME', pa.string()), ('CATEGORY_LEVEL3', pa.string())])
+
+        rows = 0
+        try:
+            with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                for frame in self.connector.iter_query_frames(PRODUCT_DIMENSION_QUERY):
+                    frame.columns = [column.upper() for column in frame.columns]
+                    batch = pa.RecordBatch.from_pandas(pd.DataFrame({
+                        'PRODUCT_ID': pd.to_numeric(frame['PRODUCT_ID']).astype('int64'),
+                        'NAME': frame['NAME'].astype('string'),
+                        'CATEGORY_LEVEL3': frame['CATEGORY_LEVEL3'].astype('string'),
+                    }), schema=schema, preserve_index=False)
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            os.replace(temp_path, self.cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        self._table = None
+
+        print(f"✅ Cached {rows} products in {time.time() - start_time:.2f}s ({self.cache_path})")
+        return rows
+
+    def table(self) -> 'pa.Table':
+        """
+        Get the memory-mapped catalog, refreshing it first when it is stale, and mapping the
+        file again when another process has replaced it since it was read.
+        """
+        table = self._table
+        if table is not None and self._table_file == self._file_identity() and not self._refresh_due():
+            return table
+        with self._lock:
+            if self._refresh_due():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    if not self.cache_path.exists():
+                        raise
+                    self._refresh_failed_at = time.time()
+                    print(f"⚠️ Product dimension refresh failed, using the cached catalog: {e}")
+            identity = self._file_identity()
+            if self._table is None or identity != self._table_file:
+                # The old map is released once no lookup still holds the old table
+                source = pa.memory_map(str(self.cache_path), 'r')
+                self._table, self._table_file = pa.ipc.open_file(source).read_all(), identity
+            return self._table
+
+    def enrich(self, orders: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add NAME and CATEGORY_LEVEL3 to order rows that only carry a PRODUCT_ID.
+
+        Products added to the catalog since the last refresh get empty details until the
+        next refresh.
+
+        Args:
+            orders (pd.DataFrame): Order rows with a PRODUCT_ID column
+
+        Returns:
+            pd.DataFrame: A copy of the orders with the product columns filled in
+        """
+        orders = orders.copy()
+        if orders.empty:
+            for column in PRODUCT_COLUMNS:
+                orders[column] = pd.Series(dtype='object')
+            return orders
+
+        table = self.table()
+        product_ids = pa.array(pd.to_numeric(orders['PRODUCT_ID'], errors='coerce').astype('Int64'), type=pa.int64())
+        matches = table.take(pc.index_in(product_ids, value_set=table['PRODUCT_ID']))
+        for column in PRODUCT_COLUMNS:
+            orders[column] = matches[column].to_pylist()
+        return orders
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the catalog size and age."""
+        age = self.age_seconds()
+        products = pa.ipc.open_file(pa.memory_map(str(self.cache_path), 'r')).read_all().num_rows if age is not None else 0
+        return {
+            'path': str(self.cache_path),
+            'products': products,
+            'age_hours': round(age / 3600, 2) if age is not None else None,
+            'stale': self.is_stale(),
+        }
+
+
+def main():
+    """Refresh the product dimension cache or show its status."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Product Dimension Cache")
+    parser.add_argument("--refresh", action="store_true", help="Download the product catalog now")
+    parser.add_argument("--status", action="store_true", help="Show catalog size and age")
+    parser.add_argument("--data-source", choices=["snowflake", "local"], default="snowflake",
+                        help="Where to read the catalog from")
+    parser.add_argument("--fixtures-dir", help="Fixture root for --data-source local")
+
+    args = parser.parse_args()
+
+    if args.data_source == "local":
+        from local_data_connector import LocalDataConnector
+        connector = LocalDataConnector(fixtures_dir=args.fixtures_dir)
+    else:
+        from snowflake_data_connector import SnowflakeDataConnector
+        connector = SnowflakeDataConnector()
+    cache = ProductDimensionCache(connector)
+
+    if args.refresh:
+        cache.refresh()
+        connector.disconnect()
+    if args.status or not args.refresh:
+        stats = cache.stats()
+        if stats['age_hours'] is None:
+            print(f"📦 No product dimension cache at {stats['path']}")
+        else:
+            print(f"📦 {stats['products']} products at {stats['path']}, {stats['age_hours']}h old"
+                  f"{' (stale)' if stats['stale'] else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Query Result Cache for Chewy Playback Pipeline
+Persists Snowflake query results on local disk so reruns, retries and debugging
+sessions for the same customer don't go back to the warehouse.
+"""
+
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+from decimal import Decimal
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+# Parquet storage for DataFrame results needs pyarrow
+try:
+    import pyarrow
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+
+class _ResultEncoder(json.JSONEncoder):
+    """JSON encoder for query result values (Decimal, dates and timestamps)."""
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj)
+        elif isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        return super(_ResultEncoder, self).default(obj)
+
+
+class QueryResultCache:
+    """
+    SQLite store of query results keyed by (query name, template hash, customer ID).
+
+    Entries expire after a TTL, and the least recently used entries are evicted once the
+    store grows past its size limit. Eviction runs every EVICT_EVERY_PUTS writes or
+    EVICT_INTERVAL_SECONDS, not on each one, so the store can briefly run over the limit.
+    The template hash means editing a query in customer_queries.json never serves results
+    from the old SQL.
+    """
+
+    DEFAULT_PATH = Path(__file__).parent / ".query_cache" / "query_results.sqlite"
+    EVICT_EVERY_PUTS = 100
+    EVICT_INTERVAL_SECONDS = 60
+
+    def __init__(self, cache_path: str = None, ttl_seconds: float = None, max_bytes: int = None):
+        """
+        Initialize the query result cache.
+
+        Args:
+            cache_path (str, optional): SQLite file path. Defaults to QUERY_CACHE_PATH or
+                Final_Pipeline/.query_cache/query_results.sqlite
+            ttl_seconds (float, optional): Entry lifetime. Defaults to QUERY_CACHE_TTL_HOURS (24h)
+            max_bytes (int, optional): Size limit before eviction. Defaults to QUERY_CACHE_MAX_MB (512MB)
+        """
+        self.cache_path = Path(cache_path or os.getenv('QUERY_CACHE_PATH') or self.DEFAULT_PATH)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv('QUERY_CACHE_TTL_HOURS', '24')) * 3600
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv('QUERY_CACHE_MAX_MB', '512')) * 1024 * 1024)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        self._puts_since_evict = 0
+        self._last_evict = 0.0
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use (threads never share one)."""
+        connection = getattr(self._local, 'connection', None)
+        # A forked worker process must not reuse its parent's connection
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(str(self.cache_path), timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _init_db(self):
+        """Create the results table if it doesn't exist."""
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS query_results (
+                    query_name TEXT NOT NULL,
+                    template_hash TEXT NOT NULL,
+                    customer_id TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    PRIMARY KEY (query_name, template_hash, customer_id)
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_last_accessed ON query_results (last_accessed)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON query_results (created_at)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS template_schemas (
+                    template_hash TEXT PRIMARY KEY,
+                    schema TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def template_hash(query_template: str) -> str:
+        """Hash a query template so cached results are tied to the exact SQL."""
+        return hashlib.sha256(query_template.encode('utf-8')).hexdigest()[:16]
+
+    def get(self, query_name: str, query_template: str, customer_id: str) -> Optional[Any]:
+        """
+        Get a cached result.
+
+        Returns:
+            Optional[Any]: A DataFrame or list of row dictionaries, or None on a miss or expired entry
+        """
+        key = (query_name, self.template_hash(query_template), str(customer_id))
+        now = time.time()
+        try:
+            with self._connect() as connection:
+                row = connection.execute(
+                    "SELECT format, payload, created_at FROM query_results "
+                    "WHERE query_name = ? AND template_hash = ? AND customer_id = ?", key
+                ).fetchone()
+                if row is None:
+                    return None
+                result_format, payload, created_at = row
+                if now - created_at > self.ttl_seconds:
+                    connection.execute(
+                        "DELETE FROM query_results WHERE query_name = ? AND template_hash = ? AND customer_id = ?", key
+                    )
+                    return None
+                connection.execute(
+                    "UPDATE query_results SET last_accessed = ? "
+                    "WHERE query_name = ? AND template_hash = ? AND customer_id = ?", (now, *key)
+                )
+            if result_format == 'parquet':
+                return pd.read_parquet(io.BytesIO(payload))
+            return json.loads(payload)
+        except Exception as e:
+            print(f"⚠️ Query cache read failed for '{query_name}' ({customer_id}): {e}")
+            return None
+
+    def put(self, query_name: str, query_template: str, customer_id: str, result: Any):
+        """Store a query result (DataFrame or list of row dictionaries), evicting now and then (see _evict_due)."""
+        try:
+            if isinstance(result, pd.DataFrame):
+                if PARQUET_AVAILABLE:
+                    buffer = io.BytesIO()
+                    result.to_parquet(buffer, index=False)
+                    result_format, payload = 'parquet', buffer.getvalue()
+                else:
+                    result_format = 'json'
+                    payload = json.dumps(result.astype(object).where(result.notna(), None).to_dict('records'), cls=_ResultEncoder).encode('utf-8')
+            else:
+                result_format, payload = 'json', json.dumps(result, cls=_ResultEncoder).encode('utf-8')
+
+            now = time.time()
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO query_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (query_name, self.template_hash(query_template), str(customer_id),
+                     result_format, sqlite3.Binary(payload), len(payload), now, now)
+                )
+            if self._evict_due():
+                self._evict_if_needed()
+        except Exception as e:
+            print(f"⚠️ Query cache write failed for '{query_name}' ({customer_id}): {e}")
+
+    def get_schema(self, query_template: str) -> Optional[List[List[str]]]:
+        """
+        Get a template's stored result schema, as stored by put_schema().
+
+        Returns:
+            Optional[List[List[str]]]: [column, kind] pairs, or None when missing or expired
+        """
+        try:
+            with self._connect() as connection:
+                row = connection.execute(
+                    "SELECT schema, created_at FROM template_schemas WHERE template_hash = ?",
+                    (self.template_hash(query_template),)
+                ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                return None
+            return json.loads(row[0])
+        except Exception as e:
+            print(f"⚠️ Query cache schema read failed: {e}")
+            return None
+
+    def put_schema(self, query_template: str, schema: List[Any]):
+        """Store a template's result schema ([column, kind] pairs), so later runs needn't describe it again."""
+        try:
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO template_schemas VALUES (?, ?, ?)",
+                    (self.template_hash(query_template), json.dumps(schema), time.time())
+                )
+        except Exception as e:
+            print(f"⚠️ Query cache schema write failed: {e}")
+
+    def _evict_due(self) -> bool:
+        """Count a write; True every EVICT_EVERY_PUTS writes or EVICT_INTERVAL_SECONDS."""
+        with self._evict_lock:
+            self._puts_since_evict += 1
+            now = time.time()
+            if self._puts_since_evict < self.EVICT_EVERY_PUTS and now - self._last_evict < self.EVICT_INTERVAL_SECONDS:
+                return False
+            self._puts_since_evict, self._last_evict = 0, now
+            return True
+
+    def _evict_if_needed(self):
+        """Drop expired entries, then least recently used entries down to 90% of max_bytes."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM query_results WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            total_bytes = connection.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM query_results").fetchone()[0]
+            if total_bytes <= self.max_bytes:
+                return
+
+            # Leave some headroom so a full store doesn't evict on every write
+            target_bytes = self.max_bytes * 0.9
+            evicted = 0
+            for query_name, template_hash, customer_id, size_bytes in connection.execute(
+                "SELECT query_name, template_hash, customer_id, size_bytes FROM query_results ORDER BY last_accessed"
+            ).fetchall():
+                if total_bytes <= target_bytes:
+                    break
+                connection.execute(
+                    "DELETE FROM query_results WHERE query_name = ? AND template_hash = ? AND customer_id = ?",
+                    (query_name, template_hash, customer_id)
+                )
+                total_bytes -= size_bytes
+                evicted += 1
+            print(f"🧹 Evicted {evicted} query cache entries to stay under {self.max_bytes / (1024 * 1024):.0f}MB")
+
+    def clear(self, customer_ids: List[str] = None):
+        """Remove all entries, or only the entries for the given customers."""
+        with self._connect() as connection:
+            if customer_ids:
+                connection.executemany("DELETE FROM query_results WHERE customer_id = ?", [(str(cid),) for cid in customer_ids])
+            else:
+                connection.execute("DELETE FROM query_results")
+                connection.execute("DELETE FROM template_schemas")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get entry count, size and customer count for the store."""
+        with self._connect() as connection:
+            entries, total_bytes, customers = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COUNT(DISTINCT customer_id) FROM query_results"
+            ).fetchone()
+        return {
+            'entries': entries,
+            'customers': customers,
+            'size_mb': round(total_bytes / (1024 * 1024), 2),
+            'path': str(self.cache_path)
+        }
+
+
+def main():
+    """Inspect or clear the query result cache."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query Result Cache")
+    parser.add_argument("--clear", action="store_true", help="Remove cached results")
+    parser.add_argument("--customers", nargs="+", help="Only clear results for these customer IDs")
+
+    args = parser.parse_args()
+
+    cache = QueryResultCache()
+    if args.clear:
+        cache.clear(args.customers)
+        print("✅ Query cache cleared")
+
+    stats = cache.stats()
+    print(f"📊 Query cache: {stats['entries']} entries for {stats['customers']} customers ({stats['size_mb']} MB) at {stats['path']}")
+
+
+if __name__ == "__main__":
+    main()
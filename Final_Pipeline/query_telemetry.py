@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Query Telemetry for Chewy Playback Pipeline
+Aggregates every query template execution (wall time, rows, approximate bytes, cache hit
+or miss) per template and summarizes a run as per-template latency percentiles, so slow
+templates can be told apart from slow customers. The slowest executions keep their
+Snowflake query IDs for a Query History lookup.
+"""
+
+import json
+import math
+import time
+import heapq
+import random
+import threading
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+from query_result_cache import _ResultEncoder
+
+
+class QueryTelemetry:
+    """
+    Thread-safe per-template aggregates of query executions for one pipeline run.
+
+    Memory doesn't grow with the run: each template keeps counts and sums, plus a
+    reservoir sample of at most RESERVOIR_SIZE execution latencies for the percentiles,
+    and the run keeps only its SLOWEST_EXECUTIONS slowest executions in full. Cache hits
+    are counted alongside warehouse executions so the report shows how much of a run was
+    served locally; latency figures only count executions (misses).
+    """
+
+    RESERVOIR_SIZE = 1000
+    SLOWEST_EXECUTIONS = 20
+
+    def __init__(self):
+        """Initialize empty telemetry."""
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        # Min-heap of (seconds, sequence, execution) holding the slowest executions
+        self._slowest: List[Any] = []
+        self._sequence = 0
+        self._random = random.Random()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, query_name: str, seconds: float, result: Any, query_id: Optional[str] = None,
+               cache_hit: bool = False, customers: int = 1):
+        """
+        Record one template execution or cache lookup.
+
+        Args:
+            query_name (str): Query template name
+            seconds (float): Wall time of the execution or lookup
+            result (Any): The result (DataFrame or list of row dictionaries) for row and byte counts
+            query_id (str, optional): Snowflake query ID (sfqid), when the query ran in Snowflake
+            cache_hit (bool): Whether the result came from the query cache
+            customers (int): Customers covered by the execution (bulk batches cover many)
+        """
+        rows = len(result) if result is not None else 0
+        size = self.estimate_bytes(result)
+        with self._lock:
+            stats = self.templates.setdefault(query_name, {
+                'executions': 0, 'cache_hits': 0, 'rows': 0, 'bytes': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0, 'latencies': [],
+            })
+            stats['rows'] += rows
+            stats['bytes'] += size
+            if cache_hit:
+                stats['cache_hits'] += 1
+                return
+            stats['executions'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            self._sample(stats['latencies'], stats['executions'], seconds)
+            execution = {'query_name': query_name, 'seconds': seconds, 'rows': rows, 'bytes': size,
+                         'query_id': query_id, 'customers': customers, 'timestamp': time.time()}
+            self._sequence += 1
+            heapq.heappush(self._slowest, (seconds, self._sequence, execution))
+            if len(self._slowest) > self.SLOWEST_EXECUTIONS:
+                heapq.heappop(self._slowest)
+
+    def _sample(self, latencies: List[float], count: int, seconds: float):
+        """Add the count-th latency to a reservoir sample of at most RESERVOIR_SIZE (algorithm R)."""
+        if len(latencies) < self.RESERVOIR_SIZE:
+            latencies.append(seconds)
+            return
+        index = self._random.randrange(count)
+        if index < self.RESERVOIR_SIZE:
+            latencies[index] = seconds
+
+    @staticmethod
+    def estimate_bytes(result: Any) -> int:
+        """Approximate in-memory size of a query result."""
+        if result is None:
+            return 0
+        if isinstance(result, pd.DataFrame):
+            return int(result.memory_usage(index=False, deep=True).sum())
+        return len(json.dumps(result, cls=_ResultEncoder))
+
+    @staticmethod
+    def percentile(values: List[float], pct: float) -> float:
+        """Linearly interpolated percentile (0-100) of a list of values."""
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        rank = (len(ordered) - 1) * pct / 100
+        lower, upper = math.floor(rank), math.ceil(rank)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Summarize the run per query template.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Template name -> executions, cache hits/misses, rows,
+                bytes and p50/p95/max latency of the executions
+        """
+        with self._lock:
+            templates = {name: {**stats, 'latencies': list(stats['latencies'])} for name, stats in self.templates.items()}
+
+        summary = {}
+        for query_name, stats in templates.items():
+            summary[query_name] = {
+                'executions': stats['executions'],
+                'cache_hits': stats['cache_hits'],
+                'cache_misses': stats['executions'],
+                'rows': stats['rows'],
+                'bytes': stats['bytes'],
+                'total_seconds': round(stats['total_seconds'], 4),
+                'p50_seconds': round(self.percentile(stats['latencies'], 50), 4),
+                'p95_seconds': round(self.percentile(stats['latencies'], 95), 4),
+                'max_seconds': round(stats['max_seconds'], 4),
+            }
+        # Slowest templates first
+        return dict(sorted(summary.items(), key=lambda item: item[1]['total_seconds'], reverse=True))
+
+    def totals(self) -> Dict[str, Any]:
+        """Get run-wide execution, cache and latency totals."""
+        with self._lock:
+            templates = list(self.templates.values())
+        executions = sum(stats['executions'] for stats in templates)
+        cache_hits = sum(stats['cache_hits'] for stats in templates)
+        lookups = executions + cache_hits
+        return {
+            'executions': executions,
+            'cache_hits': cache_hits,
+            'cache_hit_ratio': f"{cache_hits / lookups * 100:.1f}%" if lookups else "0%",
+            'rows': sum(stats['rows'] for stats in templates),
+            'bytes': sum(stats['bytes'] for stats in templates),
+            'query_seconds': round(sum(stats['total_seconds'] for stats in templates), 4),
+        }
+
+    def slowest_executions(self) -> List[Dict[str, Any]]:
+        """Get the run's slowest executions, slowest first, with their Snowflake query IDs."""
+        with self._lock:
+            slowest = list(self._slowest)
+        return [execution for _, _, execution in sorted(slowest, key=lambda entry: entry[0], reverse=True)]
+
+    def write_report(self, report_path: Path, extra: Dict[str, Any] = None) -> Path:
+        """
+        Write the run report (totals, per-template summary and the slowest executions) as JSON.
+
+        Args:
+            report_path (Path): Output file, e.g. Output/query_report.json
+            extra (Dict[str, Any], optional): Additional top-level fields, e.g. pipeline cache stats
+
+        Returns:
+            Path: The written report path
+        """
+        report_path = Path(report_path)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report = {
+            'started_at': self.started_at,
+            'finished_at': time.time(),
+            **(extra or {}),
+            'totals': self.totals(),
+            'templates': self.summary(),
+            'slowest_executions': self.slowest_executions(),
+        }
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2, cls=_ResultEncoder)
+        return report_path
+
+    def print_summary(self):
+        """Print the per-template latency table, slowest template first."""
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"\n⏱️ Query Telemetry (slowest template first):")
+        print(f"   {'template':<24} {'runs':>5} {'hits':>5} {'p50(s)':>8} {'p95(s)':>8} {'rows':>7}")
+        for query_name, stats in summary.items():
+            print(f"   {query_name:<24} {stats['executions']:>5} {stats['cache_hits']:>5} "
+                  f"{stats['p50_seconds']:>8.3f} {stats['p95_seconds']:>8.3f} {stats['rows']:>7}")
+
+    def reset(self):
+        """Clear the aggregates for a new run."""
+        with self._lock:
+            self.templates = {}
+            self._slowest = []
+            self.started_at = time.time()
+
+
+def main():
+    """Summarize a saved query report."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query Telemetry report viewer")
+    parser.add_argument("report", nargs="?", default=str(Path(__file__).parent / "Output" / "query_report.json"),
+                        help="Report written by a pipeline run (default: Output/query_report.json)")
+
+    args = parser.parse_args()
+
+    report_path = Path(args.report)
+    if not report_path.exists():
+        print(f"❌ No query report at {report_path}")
+        return
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+
+    totals = report.get('totals', {})
+    print(f"📊 {report_path}: {totals.get('executions', 0)} executions, {totals.get('cache_hits', 0)} cache hits "
+          f"({totals.get('cache_hit_ratio', '0%')}), {totals.get('query_seconds', 0):.2f}s in queries")
+    for query_name, stats in report.get('templates', {}).items():
+        print(f"   {query_name:<24} runs={stats['executions']:<5} hits={stats['cache_hits']:<5} "
+              f"p50={stats['p50_seconds']:.3f}s p95={stats['p95_seconds']:.3f}s rows={stats['rows']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Run Deadlines for Chewy Playback Pipeline
+A latency budget for a whole pipeline run. Once the customer profiles are in, every
+OpenAI and Snowflake call the run makes gets a timeout of at most the time left, waits for rate limit budget or a
+priority lane slot give up once the budget is spent, and stages check how much time is
+left before starting optional work, so a run finishes on time with what it has.
+"""
+
+import os
+import time
+import threading
+from typing import Optional
+
+# Default budget for interactive runs (the web app); bulk runs have none unless asked
+DEFAULT_INTERACTIVE_DEADLINE_SECONDS = 30
+
+# Typical seconds of optional work, used to decide whether it still fits in the budget
+ESTIMATED_SECONDS = {
+    'llm': 10,
+    'image': 30,
+}
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting or waiting for a call once the run's budget is spent."""
+
+
+class RunDeadline:
+    """A point in time a run must finish by, measured on the monotonic clock."""
+
+    def __init__(self, seconds: float):
+        """
+        Start the clock on a run's budget.
+
+        Args:
+            seconds (float): Seconds the run may take from now
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def elapsed(self) -> float:
+        """Get the seconds since the clock started."""
+        return time.monotonic() - (self.expires_at - self.seconds)
+
+    def remaining(self) -> float:
+        """Get the seconds left, 0 once the budget is spent."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Check whether the budget is spent."""
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """Check whether work expected to take `seconds` still fits in the budget."""
+        return self.remaining() >= seconds
+
+    def check(self, what: str):
+        """Raise DeadlineExceeded for `what` if the budget is spent."""
+        if self.expired():
+            raise DeadlineExceeded(f"{what}: the run's {self.seconds:g}s deadline has passed")
+
+    def timeout(self, cap: float = None) -> float:
+        """
+        Get a timeout for a call that must end with the run.
+
+        Args:
+            cap (float, optional): The call's own timeout, used when it is shorter
+
+        Returns:
+            float: Seconds, never more than the time left
+        """
+        self.check("Starting a call")
+        return min(self.remaining(), cap) if cap else self.remaining()
+
+
+_deadline = None
+_deadline_lock = threading.Lock()
+
+
+def set_run_deadline(deadline: Optional[RunDeadline]):
+    """Set the deadline of the run in progress, or clear it with None."""
+    global _deadline
+    with _deadline_lock:
+        _deadline = deadline
+
+
+def current_deadline() -> Optional[RunDeadline]:
+    """Get the deadline of the run in progress, or None when it has no budget."""
+    return _deadline
+
+
+def call_timeout(default: float = None) -> Optional[float]:
+    """
+    Get the timeout for a call made during the current run.
+
+    Args:
+        default (float, optional): The call's timeout when the run has no deadline
+
+    Returns:
+        Optional[float]: The time left (capped at default), default when there is no
+            deadline; raises DeadlineExceeded when the budget is spent
+    """
+    deadline = current_deadline()
+    return deadline.timeout(default) if deadline else default
+
+
+def resolve_deadline_seconds(seconds: float = None, priority: str = None) -> Optional[float]:
+    """
+    Work out a run's budget.
+
+    Args:
+        seconds (float, optional): Explicit budget; 0 means none
+        priority (str, optional): The run's priority class; interactive runs get
+            DEFAULT_INTERACTIVE_DEADLINE_SECONDS unless PIPELINE_DEADLINE_SECONDS says otherwise
+
+    Returns:
+        Optional[float]: Seconds, or None for no deadline
+    """
+    if seconds is None and os.getenv('PIPELINE_DEADLINE_SECONDS'):
+        seconds = float(os.getenv('PIPELINE_DEADLINE_SECONDS'))
+    if seconds is None and priority == 'interactive':
+        seconds = DEFAULT_INTERACTIVE_DEADLINE_SECONDS
+    return seconds or None
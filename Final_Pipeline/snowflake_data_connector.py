@@ -5,35 +5,214 @@ Pulls customer data directly from Snowflake and formats it for the pipeline agen
 """
 
 import os
+import re
 import sys
 import json
+import time
+import threading
 import pandas as pd
-from typing import Dict, List, Any, Optional
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Any, Optional, Tuple, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from dotenv import load_dotenv
+from query_result_cache import QueryResultCache
+from query_telemetry import QueryTelemetry
+from product_dimension_cache import ProductDimensionCache
+from priority_lanes import get_priority_lanes
+from run_deadline import call_timeout
 
 # Try to import Snowflake connector
 try:
     import snowflake.connector
-    from snowflake.connector.errors import ProgrammingError, DatabaseError
+    from snowflake.connector.errors import ProgrammingError, DatabaseError, NotSupportedError
     SNOWFLAKE_AVAILABLE = True
 except ImportError:
     SNOWFLAKE_AVAILABLE = False
     print("⚠️  snowflake-connector-python not installed. Install with: pip install snowflake-connector-python")
 
+# Arrow result fetching needs pyarrow (pip install "snowflake-connector-python[pandas]")
+try:
+    import pyarrow
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+
+# Trailing top-level ORDER BY of a query template (not one inside an OVER (...) clause)
+_TRAILING_ORDER_BY = re.compile(r"\border\s+by\s+(?P<keys>[^()]+?)(?:\s+limit\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+
+# Snowflake result type codes (snowflake.connector.constants.FIELD_TYPES) -> the column kinds
+# consolidated results are cast to; NUMBER (0) is 'int' or 'float' depending on its scale,
+# and anything else is left as it comes
+SNOWFLAKE_TYPE_KINDS = {1: 'float', 3: 'date', 4: 'datetime', 5: 'json', 6: 'datetime_tz', 7: 'datetime_tz',
+                        8: 'datetime', 9: 'json', 10: 'json', 13: 'bool'}
+
+
+def _frame_to_rows(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Convert a query result DataFrame to row dictionaries, with NULLs as None."""
+    if frame.empty:
+        return []
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+class CustomerQueryResults(Mapping):
+    """
+    Query results for one customer, keyed by query name.
+    
+    Behaves like the usual {query_name: rows} dictionary, but each result can be held as
+    an Arrow-backed DataFrame. Row dictionaries are only built when a caller indexes a
+    query, while frame() hands out the DataFrame directly.
+    """
+    
+    def __init__(self, results: Dict[str, Any] = None):
+        self._results = dict(results or {})
+        self._rows = {}
+        self._frames = {}
+    
+    def __getitem__(self, query_name: str) -> List[Dict[str, Any]]:
+        if query_name not in self._rows:
+            result = self._results[query_name]
+            self._rows[query_name] = _frame_to_rows(result) if isinstance(result, pd.DataFrame) else result
+        return self._rows[query_name]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._results)
+    
+    def __contains__(self, query_name: object) -> bool:
+        # Mapping's default would call __getitem__ and build the row dictionaries
+        return query_name in self._results
+    
+    def __len__(self) -> int:
+        return len(self._results)
+    
+    def frame(self, query_name: str) -> pd.DataFrame:
+        """Get a query result as a DataFrame without building row dictionaries."""
+        if query_name not in self._frames:
+            result = self._results.get(query_name)
+            if isinstance(result, pd.DataFrame):
+                self._frames[query_name] = result
+            else:
+                self._frames[query_name] = pd.DataFrame(result or [])
+        return self._frames[query_name]
+    
+    def update(self, results: Mapping):
+        """Add or replace query results, e.g. templates fetched by a later pipeline stage."""
+        if isinstance(results, CustomerQueryResults):
+            # Take the underlying frames rather than converting them to rows
+            results = results._results
+        for query_name, result in results.items():
+            self._results[query_name] = result
+            self._rows.pop(query_name, None)
+            self._frames.pop(query_name, None)
+    
+    def subset(self, query_names: List[str]) -> 'CustomerQueryResults':
+        """Get the results for some queries, sharing the underlying frames."""
+        return CustomerQueryResults({k: self._results[k] for k in query_names if k in self._results})
+
+
+class CustomerDataView:
+    """
+    Formatted frames for one customer, built once from the raw query results.
+    
+    Every stage gets the same order, review and pet DataFrames (and address) instead of
+    reformatting the raw results on each call, so callers must not modify them.
+    invalidate() drops whatever was built from query results that have since changed.
+    """
+    
+    # Formatted frame -> query result it is built from
+    FRAME_QUERIES = {
+        'order_data': 'get_cust_orders',
+        'review_data': 'get_cust_reviews',
+        'pet_data': 'get_pet_profiles',
+        'address': 'get_cust_zipcode',
+    }
+    
+    def __init__(self, connector: 'SnowflakeDataConnector', customer_id: str, customer_data: Mapping[str, Any]):
+        self.connector = connector
+        self.customer_id = customer_id
+        self.customer_data = customer_data
+        self._built = {}
+    
+    def frame(self, name: str) -> pd.DataFrame:
+        """Get the 'order_data', 'review_data' or 'pet_data' frame, formatting it on first use."""
+        if name not in self._built:
+            query_name = self.FRAME_QUERIES[name]
+            if isinstance(self.customer_data, CustomerQueryResults):
+                source = self.customer_data.subset([query_name])
+            else:
+                source = {query_name: self.customer_data[query_name]} if query_name in self.customer_data else {}
+            self._built[name] = self.connector.format_frames_for_pipeline(self.customer_id, source)[name]
+        return self._built[name]
+    
+    def address(self) -> Dict[str, str]:
+        """Get the customer's most used zip code and city."""
+        if 'address' not in self._built:
+            address_data = self.customer_data.get('get_cust_zipcode') or []
+            if address_data:
+                self._built['address'] = {
+                    'zip_code': str(address_data[0].get('CUSTOMER_ADDRESS_ZIP', '')),
+                    'city': str(address_data[0].get('CUSTOMER_ADDRESS_CITY', ''))
+                }
+            else:
+                self._built['address'] = {'zip_code': '', 'city': ''}
+        return self._built['address']
+    
+    def invalidate(self, query_names=None):
+        """Drop what was built from the given query results (everything if None)."""
+        if query_names is None:
+            self._built.clear()
+            return
+        query_names = set(query_names)
+        for name, query_name in self.FRAME_QUERIES.items():
+            if query_name in query_names:
+                self._built.pop(name, None)
+
 
 class SnowflakeDataConnector:
     """
     Connects to Snowflake and pulls customer data for the Chewy Playback Pipeline.
     """
     
+    # Default rows per fetchmany() call when streaming results (SNOWFLAKE_FETCH_BATCH_ROWS)
+    FETCH_BATCH_ROWS = 10000
+    # Packs the rows of a template (aliased q) into one semi-structured value in consolidated queries
+    CONSOLIDATED_ROWS_SQL = "ARRAY_AGG(OBJECT_CONSTRUCT_KEEP_NULL(*))"
+    # Telemetry name of consolidated query executions
+    CONSOLIDATED_QUERY_NAME = 'consolidated'
+    # dtype of fetched integer columns holding NULLs (Arrow converts them to floats)
+    NULLABLE_INT_DTYPE = 'float64'
+    # Resolution of fetched timestamp columns
+    TIMESTAMP_UNIT = 'ns'
+    # Serializes the first connect when customers are processed on several threads
+    _connect_lock = threading.Lock()
+    # Serializes creating the product dimension cache, for the same reason
+    _product_dimensions_lock = threading.Lock()
+    
     def __init__(self):
         """Initialize the Snowflake data connector."""
         if not SNOWFLAKE_AVAILABLE:
             raise ImportError("snowflake-connector-python is not installed. Please install it first.")
         
         self.connection = None
-        self.customer_queries = self._load_customer_queries()
+        # Client for a running snowflake_session_broker.py, used instead of a connection of our own
+        self.broker = None
+        # Wall time, rows, bytes, query ID and cache hit/miss of every template execution
+        self.telemetry = QueryTelemetry()
+        # Templates are converted to bind-variable statements once, so every customer runs
+        # the same SQL text and Snowflake can reuse compiled plans and cached results
+        self.customer_queries = {
+            query_name: self._bind_template(query_template)
+            for query_name, query_template in self._load_customer_queries().items()
+        }
+        self.customer_bulk_queries = self._load_customer_queries("customer_bulk_queries.json")
+        # Compiled consolidated statements, keyed by the tuple of query names they cover
+        self._consolidated_statements = {}
+        # (column, kind) result schemas of templates, used to type consolidated results
+        self._template_schemas = {}
+        # Local product catalog joined into product-ID-only order results, opened on first use
+        self.product_dimensions = None
         self._load_environment_variables()
     
     def _load_environment_variables(self):
@@ -52,6 +231,19 @@ class SnowflakeDataConnector:
         self.database = os.getenv('SNOWFLAKE_DATABASE')
         self.schema = os.getenv('SNOWFLAKE_SCHEMA')
         self.authenticator = os.getenv('SNOWFLAKE_AUTHENTICATOR', 'externalbrowser')
+        self.bulk_batch_size = int(os.getenv('SNOWFLAKE_BULK_BATCH_SIZE', '1000'))
+        # Number of query templates run at once on separate cursors (1 = sequential)
+        self.max_concurrent_queries = int(os.getenv('SNOWFLAKE_MAX_CONCURRENT_QUERIES', '1'))
+        # Fetch results as Arrow batches into DataFrames instead of Python row tuples
+        self.use_arrow = ARROW_AVAILABLE and os.getenv('SNOWFLAKE_USE_ARROW', 'true').lower() != 'false'
+        # Run a customer's uncached templates as one consolidated statement (one round trip)
+        self.consolidated_query = os.getenv('SNOWFLAKE_CONSOLIDATED_QUERY', 'false').lower() == 'true'
+        # Rows per batch for the streaming iter_query_* methods
+        self.fetch_batch_rows = int(os.getenv('SNOWFLAKE_FETCH_BATCH_ROWS', str(self.FETCH_BATCH_ROWS)))
+        # Unix socket of a running session broker holding a warm, authenticated session
+        self.broker_socket = os.getenv('SNOWFLAKE_BROKER_SOCKET')
+        # Persistent on-disk cache of query results (set QUERY_CACHE_ENABLED=false to disable)
+        self.result_cache = QueryResultCache() if os.getenv('QUERY_CACHE_ENABLED', 'true').lower() != 'false' else None
         
         if not all([self.user, self.account, self.warehouse, self.database]):
             raise ValueError("Missing required Snowflake environment variables. Please check your .env file.")
@@ -64,45 +256,90 @@ class SnowflakeDataConnector:
         print(f"   Warehouse: {self.warehouse}")
         print(f"   Authenticator: {self.authenticator}")
     
-    def _load_customer_queries(self) -> Dict[str, str]:
-        """Load SQL query templates from JSON file."""
+    def _load_customer_queries(self, filename: str = "customer_queries.json") -> Dict[str, str]:
+        """Load SQL query templates from JSON file, with get_cust_orders in the configured shape."""
         try:
             # Try to load from Final_Pipeline directory first
-            queries_path = Path(__file__).parent / "customer_queries.json"
+            queries_path = Path(__file__).parent / filename
             if not queries_path.exists():
                 # Fall back to parent directory
-                queries_path = Path(__file__).parent.parent / "customer_queries.json"
+                queries_path = Path(__file__).parent.parent / filename
             
             with open(queries_path, 'r') as file:
                 queries = json.load(file)
+            queries = self._select_orders_shape(queries)
             print(f"✅ Successfully loaded {len(queries)} query templates from {queries_path}")
             return queries
         except Exception as e:
             print(f"❌ Error loading customer queries: {e}")
             raise
     
+    @staticmethod
+    def _select_orders_shape(queries: Dict[str, str]) -> Dict[str, str]:
+        """
+        Pick the get_cust_orders template for SNOWFLAKE_ORDERS_SHAPE.
+        
+        'aggregated' (default) uses get_cust_orders_agg, which sums quantities per product in
+        Snowflake; 'lines' keeps one row per order line; 'product_ids' uses get_cust_orders_ids,
+        which also skips the product catalog join, and product names and categories are joined
+        in locally from the product dimension cache. Whichever is picked is served as
+        get_cust_orders, and format_frames_for_pipeline() handles every shape.
+        """
+        shape = os.getenv('SNOWFLAKE_ORDERS_SHAPE', 'aggregated').lower()
+        if shape == 'product_ids' and not ARROW_AVAILABLE:
+            print("⚠️ SNOWFLAKE_ORDERS_SHAPE=product_ids needs pyarrow for the product dimension cache, using aggregated")
+            shape = 'aggregated'
+        orders_template = {
+            'aggregated': queries.get('get_cust_orders_agg'),
+            'product_ids': queries.get('get_cust_orders_ids'),
+        }.get(shape)
+        selected = {}
+        for query_name, query_template in queries.items():
+            if query_name in ('get_cust_orders_agg', 'get_cust_orders_ids'):
+                continue
+            if query_name == 'get_cust_orders' and orders_template:
+                query_template = orders_template
+            selected[query_name] = query_template
+        return selected
+    
+    @staticmethod
+    def _bind_template(query_template: str) -> str:
+        """Convert a {customer_id} query template to a statement with a :1 bind variable."""
+        return query_template.replace('{customer_id}', ':1')
+    
+    @staticmethod
+    def _bind_customer_id_filter(query_template: str, batch_size: int) -> str:
+        """Convert a {customer_id_filter} bulk template to an IN-list of batch_size bind variables."""
+        bind_list = ', '.join(f':{i}' for i in range(1, batch_size + 1))
+        return query_template.replace('{customer_id_filter}', f'IN ({bind_list})')
+    
+    def _connection_parameters(self) -> Dict[str, Any]:
+        """Build snowflake.connector.connect() parameters from the loaded credentials."""
+        # Build connection parameters matching working script pattern
+        credentials = {
+            "user": self.user,
+            "account": self.account,
+            "authenticator": self.authenticator,
+            "database": self.database,
+            "warehouse": self.warehouse,
+            "insecure_mode": True,  # For corporate environments
+            "paramstyle": "numeric",  # Server-side binding of :1, :2, ... in query templates
+        }
+        
+        # Add schema if provided
+        if self.schema:
+            credentials["schema"] = self.schema
+        
+        # Add password if provided (but typically not needed for SSO)
+        if self.password:
+            credentials['password'] = self.password
+        return credentials
+    
     def connect(self) -> bool:
         """Establish connection to Snowflake."""
         try:
             print("🔗 Connecting to Snowflake with browser authentication...")
-            
-            # Build connection parameters matching working script pattern
-            credentials = {
-                "user": self.user,
-                "account": self.account,
-                "authenticator": self.authenticator,
-                "database": self.database,
-                "warehouse": self.warehouse,
-                "insecure_mode": True,  # For corporate environments
-            }
-            
-            # Add schema if provided
-            if self.schema:
-                credentials["schema"] = self.schema
-            
-            # Add password if provided (but typically not needed for SSO)
-            if self.password:
-                credentials['password'] = self.password
+            credentials = self._connection_parameters()
             
             print("📖 Opening browser for authentication...")
             self.connection = snowflake.connector.connect(**credentials)
@@ -123,6 +360,9 @@ class SnowflakeDataConnector:
     
     def disconnect(self):
         """Close the Snowflake connection."""
+        if self.broker:
+            # The broker owns the session; just stop using it
+            self.broker = None
         if self.connection:
             self.connection.close()
             print("✅ Disconnected from Snowflake")
@@ -138,32 +378,526 @@ class SnowflakeDataConnector:
         Returns:
             Dict[str, Any]: Dictionary containing all customer data
         """
+        try:
+            queries_to_run = self.customer_queries.items() if query_keys is None else [(k, self.customer_queries[k]) for k in query_keys if k in self.customer_queries]
+            cached_data = self._get_cached_results(customer_id, queries_to_run)
+            uncached_names = [query_name for query_name, _ in queries_to_run if query_name not in cached_data]
+            if self.consolidated_query and len(uncached_names) > 1:
+                fetched_data = self._run_consolidated_query(uncached_names, customer_id)
+            else:
+                fetched_data = self._run_queries([
+                    (query_name, self.customer_queries[query_name], [self._bind_customer_id(customer_id)])
+                    for query_name in uncached_names
+                ])
+            self._store_cached_results(customer_id, fetched_data)
+            customer_data = {query_name: cached_data.get(query_name, fetched_data.get(query_name)) for query_name, _ in queries_to_run}
+        except Exception as e:
+            print(f"❌ Error executing queries for customer {customer_id}: {e}")
+            raise
+        
+        return CustomerQueryResults(customer_data) if self.use_arrow else customer_data
+    
+    def get_customer_data_bulk(self, customer_ids: List[str], query_keys: list = None,
+                               batch_size: int = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Get data for many customers at once, running each query template once per batch.
+        
+        Uses the templates in customer_bulk_queries.json, which filter on an IN-list of
+        customer IDs and tag every row with a BULK_CUSTOMER_ID column. Rows are split back
+        out per customer so each entry has the same shape as get_customer_data().
+        
+        Args:
+            customer_ids (List[str]): Customer IDs to query for
+            query_keys (list, optional): List of query keys to run. If None, run all.
+            batch_size (int, optional): Maximum customer IDs per IN-list. Defaults to
+                SNOWFLAKE_BULK_BATCH_SIZE (1000).
+            
+        Returns:
+            Dict[str, Dict[str, Any]]: Customer ID -> {query_name: rows}
+        """
+        batch_size = batch_size or self.bulk_batch_size
+        query_names = list(self.customer_queries.keys()) if query_keys is None else [k for k in query_keys if k in self.customer_queries]
+        queries_to_run = [(query_name, self.customer_queries[query_name]) for query_name in query_names]
+        
+        # Keep the caller's customer ID strings as keys, matched on their numeric value
+        id_lookup = {self._normalize_customer_id(cid): str(cid) for cid in customer_ids}
+        bulk_data = {cid: {} for cid in id_lookup.values()}
+        
+        # Customers with every requested result in the query cache skip the warehouse
+        normalized_ids = []
+        for normalized_id, customer_id in id_lookup.items():
+            cached_data = self._get_cached_results(customer_id, queries_to_run, verbose=False)
+            if len(cached_data) == len(queries_to_run):
+                bulk_data[customer_id] = cached_data
+            else:
+                normalized_ids.append(normalized_id)
+        if len(normalized_ids) < len(id_lookup):
+            print(f"📋 Query cache: {len(id_lookup) - len(normalized_ids)} of {len(id_lookup)} customers fully cached")
+        
+        # Every batch binds the same number of IDs so all batches share one statement text
+        bind_size = min(batch_size, len(normalized_ids))
+        bulk_statements = {}
+        for query_name in query_names:
+            query_template = self.customer_bulk_queries.get(query_name)
+            if query_template is None:
+                raise KeyError(f"No bulk query template for '{query_name}' in customer_bulk_queries.json")
+            bulk_statements[query_name] = self._bind_customer_id_filter(query_template, bind_size)
+        
+        for start in range(0, len(normalized_ids), batch_size):
+            batch = normalized_ids[start:start + batch_size]
+            # Pad a short final batch by repeating its last ID
+            bind_values = [int(cid) for cid in batch] + [int(batch[-1])] * (bind_size - len(batch))
+            print(f"📦 Running bulk queries for customers {start + 1}-{start + len(batch)} of {len(normalized_ids)}...")
+            
+            batch_queries = [(query_name, bulk_statements[query_name], bind_values) for query_name in query_names]
+            
+            try:
+                batch_results = self._run_queries(batch_queries, customers=len(batch))
+            except Exception as e:
+                print(f"❌ Error executing bulk queries: {e}")
+                raise
+            
+            for query_name, result in batch_results.items():
+                if isinstance(result, pd.DataFrame):
+                    self._split_bulk_frame(query_name, result, batch, id_lookup, bulk_data)
+                    continue
+                for customer_id in batch:
+                    bulk_data[id_lookup[customer_id]].setdefault(query_name, [])
+                for row in result:
+                    row_customer_id = self._normalize_customer_id(row.pop('BULK_CUSTOMER_ID'))
+                    if row_customer_id in id_lookup:
+                        bulk_data[id_lookup[row_customer_id]][query_name].append(row)
+            
+            for customer_id in batch:
+                self._store_cached_results(id_lookup[customer_id], bulk_data[id_lookup[customer_id]])
+        
+        if self.use_arrow:
+            return {cid: CustomerQueryResults(customer_data) for cid, customer_data in bulk_data.items()}
+        return bulk_data
+    
+    def _split_bulk_frame(self, query_name: str, frame: pd.DataFrame, batch: List[str],
+                          id_lookup: Dict[str, str], bulk_data: Dict[str, Dict[str, Any]]):
+        """Split a bulk query DataFrame into per-customer frames keyed by BULK_CUSTOMER_ID."""
+        row_customer_ids = pd.to_numeric(frame['BULK_CUSTOMER_ID']).astype('int64').astype(str)
+        frame = frame.drop(columns=['BULK_CUSTOMER_ID'])
+        groups = {cid: group.reset_index(drop=True) for cid, group in frame.groupby(row_customer_ids, sort=False)}
+        for customer_id in batch:
+            bulk_data[id_lookup[customer_id]][query_name] = groups.get(customer_id, frame.iloc[0:0])
+    
+    def _get_cached_results(self, customer_id: str, queries_to_run, verbose: bool = True) -> Dict[str, Any]:
+        """Look up each query's result for a customer in the persistent query cache."""
+        cached_data = {}
+        if not self.result_cache:
+            return cached_data
+        
+        queries_to_run = list(queries_to_run)
+        for query_name, query_template in queries_to_run:
+            start_time = time.time()
+            result = self.result_cache.get(query_name, query_template, customer_id)
+            if result is not None:
+                cached_data[query_name] = result
+                self.telemetry.record(query_name, time.time() - start_time, result, cache_hit=True)
+        if verbose and cached_data:
+            print(f"📋 Query cache: {len(cached_data)}/{len(queries_to_run)} results cached for customer {customer_id}")
+        return cached_data
+    
+    def _store_cached_results(self, customer_id: str, customer_data: Dict[str, Any]):
+        """Save freshly fetched query results to the persistent query cache."""
+        if not self.result_cache:
+            return
+        for query_name, result in customer_data.items():
+            self.result_cache.put(query_name, self.customer_queries[query_name], customer_id, result)
+    
+    def _ensure_connected(self):
+        """Connect to Snowflake (or the session broker, when one is configured) on first use."""
+        if self.broker or self.connection:
+            return
+        with self._connect_lock:
+            if not (self.broker or self.connection):
+                self._connect_once()
+    
+    def _connect_once(self):
+        """Open the broker client or a direct connection."""
+        if self.broker_socket:
+            # Imported here because the broker module builds on this one
+            from snowflake_session_broker import SessionBrokerClient
+            broker = SessionBrokerClient(self.broker_socket)
+            if broker.ping():
+                print(f"🔌 Using Snowflake session broker at {self.broker_socket}")
+                self.broker = broker
+                return
+            print(f"⚠️ Session broker not reachable at {self.broker_socket}, connecting directly")
         if not self.connection:
             if not self.connect():
                 raise RuntimeError("Failed to connect to Snowflake")
+    
+    def _run_queries(self, queries: List[Tuple[str, str, list]], customers: int = 1) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Run (query_name, statement, bind_values) queries and return {query_name: rows} in the order given.
+        
+        With max_concurrent_queries > 1 the queries are submitted together on separate
+        cursors, so the total wait is roughly the slowest query rather than the sum.
+        Every execution is recorded in self.telemetry as covering the given number of customers.
+        """
+        results = {}
+        if not queries:
+            return results
+        self._ensure_connected()
+        if self.max_concurrent_queries <= 1 or len(queries) <= 1:
+            for query_name, query, params in queries:
+                results[query_name] = self._timed_query(query_name, query, params, customers)
+                print(f"✅ Query '{query_name}' executed successfully - {len(results[query_name])} rows returned")
+            return results
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_queries, len(queries))) as executor:
+            futures = {query_name: executor.submit(self._timed_query, query_name, query, params, customers)
+                       for query_name, query, params in queries}
+            for query_name, future in futures.items():
+                results[query_name] = future.result()
+                print(f"✅ Query '{query_name}' executed successfully - {len(results[query_name])} rows returned")
+        return results
+    
+    def _timed_query(self, query_name: str, query: str, params: list, customers: int = 1) -> Any:
+        """Execute a query and record its wall time, result size and query ID in the telemetry."""
+        query_info = {}
+        start_time = time.time()
+        result = self._execute_query(query, params, query_info)
+        self.telemetry.record(query_name, time.time() - start_time, result,
+                              query_id=query_info.get('query_id'), customers=customers)
+        return result
+    
+    def compile_consolidated_query(self, query_names: List[str]) -> str:
+        """
+        Compile single-customer templates into one statement that returns a single row.
+        
+        Each template runs as a subquery whose rows are packed into one semi-structured
+        column named after the upper-cased query name, so all templates share one network
+        round trip and one compilation. Every template binds the customer ID as :1.
+        """
+        key = tuple(query_names)
+        if key not in self._consolidated_statements:
+            columns, sources = [], []
+            for index, query_name in enumerate(query_names):
+                statement = self.customer_queries[query_name].strip().rstrip(';')
+                # Newline so a trailing -- comment in the template can't swallow the closing parenthesis
+                sources.append(f"(SELECT {self.CONSOLIDATED_ROWS_SQL} AS rows_{index} FROM ({statement}\n) q) t{index}")
+                columns.append(f't{index}.rows_{index} AS "{query_name.upper()}"')
+            self._consolidated_statements[key] = "SELECT " + ", ".join(columns) + "\nFROM " + ",\n".join(sources)
+        return self._consolidated_statements[key]
+    
+    def _run_consolidated_query(self, query_names: List[str], customer_id: str) -> Dict[str, Any]:
+        """
+        Run query templates for one customer as a single consolidated statement.
+        
+        Returns:
+            Dict[str, Any]: {query_name: rows} in the same shape _run_queries() returns
+        """
+        self._ensure_connected()
+        statement = self.compile_consolidated_query(query_names)
+        params = [self._bind_customer_id(customer_id)]
+        schemas = {query_name: self._template_schema(query_name, params) for query_name in query_names} if self.use_arrow else {}
+        query_info = {}
+        start_time = time.time()
+        result = self._execute_query(statement, params, query_info)
+        self.telemetry.record(self.CONSOLIDATED_QUERY_NAME, time.time() - start_time, result,
+                              query_id=query_info.get('query_id'))
+        packed = result.iloc[0].to_dict() if isinstance(result, pd.DataFrame) else result[0]
         
-        customer_data = {}
+        results = {}
+        for query_name in query_names:
+            rows = self._unpack_consolidated_rows(packed.get(query_name.upper()))
+            rows = self._sort_rows(rows, self._result_order(self.customer_queries[query_name]))
+            if self.use_arrow:
+                results[query_name] = self._cast_to_schema(pd.DataFrame.from_records(rows), schemas[query_name])
+            else:
+                results[query_name] = rows
+        print(f"✅ Consolidated query executed successfully - {len(query_names)} templates in one round trip")
+        return results
+    
+    def _template_schema(self, query_name: str, params: list) -> List[Tuple[str, str]]:
+        """
+        Get a template's result columns as (column, kind) pairs.
         
+        Described once per process, and kept in the query result cache across runs (keyed by
+        the template's hash, like the results), so consolidated runs don't pay a round trip
+        per template for it.
+        """
+        if query_name not in self._template_schemas:
+            query = self.customer_queries[query_name]
+            schema = self.result_cache.get_schema(query) if self.result_cache else None
+            if schema is None:
+                schema = self._describe_query(query, params)
+                if self.result_cache:
+                    self.result_cache.put_schema(query, schema)
+            self._template_schemas[query_name] = [tuple(column) for column in schema]
+        return self._template_schemas[query_name]
+    
+    def _describe_query(self, query: str, params: list = None) -> List[Tuple[str, str]]:
+        """Get a query's result columns as (column, kind) pairs without running it."""
+        with get_priority_lanes().slot('snowflake'):
+            if self.broker:
+                return self.broker.describe(query, params)
+            return self._describe_columns(self.connection, query, params)
+    
+    @staticmethod
+    def _describe_columns(connection, query: str, params: list = None) -> List[Tuple[str, str]]:
+        """Describe a query's result columns on a new cursor of the given connection."""
+        cursor = connection.cursor()
         try:
-            queries_to_run = self.customer_queries.items() if query_keys is None else [(k, self.customer_queries[k]) for k in query_keys if k in self.customer_queries]
-            for query_name, query_template in queries_to_run:
-                formatted_query = query_template.format(customer_id=customer_id)
-                cursor = self.connection.cursor()
-                cursor.execute(formatted_query)
-                columns = [desc[0] for desc in cursor.description]
-                rows = cursor.fetchall()
-                results = []
-                for row in rows:
-                    row_dict = dict(zip(columns, row))
-                    results.append(row_dict)
+            return [(column.name.upper(), 'int' if column.type_code == 0 and not column.scale
+                     else 'float' if column.type_code == 0 else SNOWFLAKE_TYPE_KINDS.get(column.type_code, 'string'))
+                    for column in cursor.describe(query, params)]
+        finally:
+            cursor.close()
+    
+    def _cast_to_schema(self, frame: pd.DataFrame, schema: List[Tuple[str, str]]) -> pd.DataFrame:
+        """
+        Give an unpacked consolidated result the columns and dtypes the per-template path returns.
+        
+        Packing rows into a semi-structured value turns dates and timestamps into strings and
+        numbers into whatever JSON holds, so without this the same template would give
+        differently typed frames (and cache entries and checkpoint fingerprints) per mode.
+        """
+        return pd.DataFrame({column: self._cast_column(frame[column] if column in frame.columns
+                                                       else pd.Series(None, index=frame.index, dtype=object), kind)
+                             for column, kind in schema}, index=frame.index)
+    
+    def _cast_column(self, values: pd.Series, kind: str) -> pd.Series:
+        """Cast one unpacked column to its kind (see SNOWFLAKE_TYPE_KINDS)."""
+        present = values.notna()
+        if kind == 'int':
+            values = pd.to_numeric(values)
+            return values.astype('int64') if present.all() else values.astype(self.NULLABLE_INT_DTYPE)
+        if kind == 'float':
+            return pd.to_numeric(values).astype('float64')
+        if kind == 'date':
+            return pd.to_datetime(values).dt.date.astype(object).where(present, None)
+        if kind == 'datetime':
+            return pd.to_datetime(values).astype(f'datetime64[{self.TIMESTAMP_UNIT}]')
+        if kind == 'datetime_tz':
+            return pd.to_datetime(values, utc=True).astype(f'datetime64[{self.TIMESTAMP_UNIT}, UTC]')
+        if kind == 'bool':
+            return values.astype(bool) if present.all() else values.astype(object)
+        if kind == 'json':
+            # Fetched semi-structured values are JSON text
+            return values.map(lambda value: value if value is None or isinstance(value, str)
+                              else json.dumps(value, indent=2)).astype(object).where(present, None)
+        return values
+    
+    @staticmethod
+    def _unpack_consolidated_rows(value: Any) -> List[Dict[str, Any]]:
+        """Unpack a consolidated column (JSON array of row objects) into row dictionaries."""
+        if value is None:
+            return []
+        rows = json.loads(value) if isinstance(value, str) else value
+        return [{column.upper(): column_value for column, column_value in row.items()} for row in rows]
+    
+    @staticmethod
+    def _result_order(query_template: str) -> List[Tuple[str, bool, bool]]:
+        """
+        Parse a template's trailing ORDER BY into (column, descending, nulls_first) keys.
+        
+        Array aggregation doesn't keep row order, so consolidated results are re-sorted
+        on these keys. Qualified names (c_ord.order_date_est) are matched on the column name.
+        """
+        match = _TRAILING_ORDER_BY.search(query_template)
+        if not match:
+            return []
+        order = []
+        for key in match.group('keys').split(','):
+            words = key.split()
+            if not words:
+                continue
+            descending = len(words) > 1 and words[1].lower() == 'desc'
+            # Snowflake puts NULLs last ascending and first descending unless told otherwise
+            nulls_first = descending
+            if 'nulls' in [word.lower() for word in words]:
+                nulls_first = words[-1].lower() == 'first'
+            order.append((words[0].split('.')[-1].upper(), descending, nulls_first))
+        return order
+    
+    @staticmethod
+    def _sort_rows(rows: List[Dict[str, Any]], order: List[Tuple[str, bool, bool]]) -> List[Dict[str, Any]]:
+        """Sort row dictionaries on (column, descending, nulls_first) keys, skipping columns not in the rows."""
+        if not rows:
+            return rows
+        # Stable sorts from the last key to the first give a multi-key sort
+        for column, descending, nulls_first in reversed(order):
+            if column not in rows[0]:
+                continue
+            present = sorted((row for row in rows if row.get(column) is not None),
+                             key=lambda row: row[column], reverse=descending)
+            missing = [row for row in rows if row.get(column) is None]
+            rows = missing + present if nulls_first else present + missing
+        return rows
+    
+    def _execute_query(self, query: str, params: list = None, query_info: Dict[str, Any] = None) -> Any:
+        """
+        Execute a query with bind values on a new cursor.
+        
+        Returns a DataFrame built straight from the Arrow result batches when use_arrow is
+        enabled, otherwise a list of row dictionaries. The Snowflake query ID is stored
+        in query_info['query_id'] when a dict is passed. Each query holds a Snowflake slot
+        of this run's priority lane while it runs, and is cancelled if it runs past the
+        run's deadline.
+        """
+        with get_priority_lanes().slot('snowflake'):
+            timeout = call_timeout()
+            if self.broker:
+                return self.broker.execute(query, params, self.use_arrow, query_info, timeout=timeout)
+            return self._fetch_query(self.connection, query, params, self.use_arrow, query_info, timeout)
+    
+    def _open_cursor(self):
+        """Open a cursor for a streaming query."""
+        return self.connection.cursor()
+    
+    def _execute_cursor(self, cursor, query: str, params: list = None, timeout: float = None):
+        """Run a statement on a cursor; Snowflake cancels it after timeout seconds when given."""
+        if timeout:
+            cursor.execute(query, params, timeout=max(1, int(timeout)))
+        else:
+            cursor.execute(query, params)
+    
+    def _ensure_direct_connection(self):
+        """Connect directly for streaming queries, even when a session broker is in use."""
+        self._ensure_connected()
+        if self.connection:
+            return
+        with self._connect_lock:
+            if not self.connection:
+                # The broker returns whole results, so it can't stream a cohort-sized one
+                print("🔗 Streaming query: connecting to Snowflake directly instead of through the session broker")
+                if not self.connect():
+                    raise RuntimeError("Failed to connect to Snowflake")
+    
+    @contextmanager
+    def _streaming_cursor(self, query: str, params: list = None):
+        """
+        Run a streaming query on a cursor of a direct connection and hand out the cursor.
+        
+        Like _execute_query, the query holds a Snowflake slot of this run's priority lane
+        until the caller is done with the cursor, and is cancelled if it runs past the
+        run's deadline.
+        """
+        self._ensure_direct_connection()
+        with get_priority_lanes().slot('snowflake'):
+            timeout = call_timeout()
+            cursor = self._open_cursor()
+            try:
+                self._execute_cursor(cursor, query, params, timeout)
+                yield cursor
+            finally:
                 cursor.close()
-                customer_data[query_name] = results
-                print(f"✅ Query '{query_name}' executed successfully - {len(results)} rows returned")
-        except Exception as e:
-            print(f"❌ Error executing queries for customer {customer_id}: {e}")
-            raise
+    
+    def _result_columns(self, cursor) -> List[str]:
+        """Column names of the cursor's current result."""
+        return [desc[0] for desc in cursor.description]
+    
+    def cohort_statement(self, query_name: str) -> str:
+        """Get a bulk template with the customer filter removed, i.e. run for every customer."""
+        query_template = self.customer_bulk_queries.get(query_name)
+        if query_template is None:
+            raise KeyError(f"No bulk query template for '{query_name}' in customer_bulk_queries.json")
+        return query_template.replace('{customer_id_filter}', 'IS NOT NULL')
+    
+    def iter_query_batches(self, query: str, params: list = None, batch_size: int = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Run a query and yield its rows as lists of up to batch_size row dictionaries.
+        
+        Rows are pulled with fetchmany(), so only one batch is held as Python objects at a
+        time, and the connector downloads result chunks as they are consumed. Streaming
+        always uses a direct connection, never the session broker.
         
-        return customer_data
+        Args:
+            query (str): SQL statement
+            params (list, optional): Bind values
+            batch_size (int, optional): Rows per batch. Defaults to SNOWFLAKE_FETCH_BATCH_ROWS (10000)
+        """
+        batch_size = batch_size or self.fetch_batch_rows
+        with self._streaming_cursor(query, params) as cursor:
+            columns = self._result_columns(cursor)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+    
+    def iter_query_rows(self, query: str, params: list = None, batch_size: int = None) -> Iterator[Dict[str, Any]]:
+        """Run a query and yield its rows one dictionary at a time, fetched batch_size rows at once."""
+        for batch in self.iter_query_batches(query, params, batch_size):
+            yield from batch
+    
+    def stream_template(self, query_name: str, customer_id: str = None, batch_size: int = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Run a query template and yield its rows in batches.
+        
+        With a customer ID the single-customer template is run; without one the bulk
+        template is run for the whole cohort, e.g. for cohort-level analyzers.
+        """
+        if customer_id is not None:
+            query, params = self.customer_queries[query_name], [self._bind_customer_id(customer_id)]
+        else:
+            query, params = self.cohort_statement(query_name), None
+        return self.iter_query_batches(query, params, batch_size)
+    
+    def iter_query_frames(self, query: str, params: list = None) -> Iterator[pd.DataFrame]:
+        """
+        Run a query and yield its result as a series of DataFrames, one per result batch.
+        
+        For results too large to hold in memory at once, such as whole-cohort exports.
+        Streaming always uses a direct connection, never the session broker.
+        """
+        with self._streaming_cursor(query, params) as cursor:
+            try:
+                yield from cursor.fetch_pandas_batches()
+            except NotSupportedError:
+                # Result was not returned in Arrow format
+                columns = self._result_columns(cursor)
+                while True:
+                    rows = cursor.fetchmany(self.fetch_batch_rows)
+                    if not rows:
+                        break
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+    
+    @staticmethod
+    def _fetch_query(connection, query: str, params: list, use_arrow: bool, query_info: Dict[str, Any] = None,
+                     timeout: float = None) -> Any:
+        """Run a query on a new cursor of the given connection and fetch its result, within timeout seconds when given."""
+        cursor = connection.cursor()
+        try:
+            if timeout:
+                # Snowflake cancels the statement after this many whole seconds
+                cursor.execute(query, params, timeout=max(1, int(timeout)))
+            else:
+                cursor.execute(query, params)
+            if query_info is not None:
+                query_info['query_id'] = cursor.sfqid
+            columns = [desc[0] for desc in cursor.description]
+            if use_arrow:
+                try:
+                    return cursor.fetch_pandas_all()
+                except NotSupportedError:
+                    # Result was not returned in Arrow format
+                    return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    
+    @classmethod
+    def _bind_customer_id(cls, customer_id: Any) -> Any:
+        """Bind numeric customer IDs as numbers so they compare against NUMBER columns directly."""
+        try:
+            return int(cls._normalize_customer_id(customer_id))
+        except ValueError:
+            return str(customer_id)
+    
+    @staticmethod
+    def _normalize_customer_id(customer_id: Any) -> str:
+        """Normalize a customer ID to its plain numeric string form for IN-lists and row matching."""
+        try:
+            return str(int(Decimal(str(customer_id).strip())))
+        except (InvalidOperation, ValueError):
+            raise ValueError(f"Invalid customer ID for bulk query: {customer_id!r}")
     
     def format_data_for_pipeline(self, customer_id: str, customer_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -184,14 +918,20 @@ class SnowflakeDataConnector:
             'address_data': {}
         }
         
-        # Process get_cust_orders (order data - now returns top products by quantity)
+        # Process get_cust_orders (order data - per-product totals, or one row per order line)
         if 'get_cust_orders' in customer_data:
-            for row in customer_data['get_cust_orders']:
+            order_rows = customer_data['get_cust_orders']
+            if order_rows and 'NAME' not in order_rows[0]:
+                order_rows = _frame_to_rows(self._with_product_details(pd.DataFrame(order_rows)))
+            for row in order_rows:
+                quantity = row.get('TOTAL_QUANTITY', row.get('ORDER_LINE_QUANTITY'))
+                line_count = row.get('LINE_COUNT')
                 order_record = {
                     'CustomerID': str(customer_id),
                     'ProductID': str(row.get('PRODUCT_ID', '')),
                     'ProductName': str(row.get('NAME', '')),
-                    'Quantity': int(row.get('TOTAL_QUANTITY', 1))
+                    'Quantity': int(quantity) if quantity is not None else 1,
+                    'LineCount': int(line_count) if line_count is not None else 1
                 }
                 formatted_data['order_data'].append(order_record)
         
@@ -236,6 +976,94 @@ class SnowflakeDataConnector:
         
         return formatted_data
     
+    def format_frames_for_pipeline(self, customer_id: str, customer_data: Mapping[str, Any]) -> Dict[str, pd.DataFrame]:
+        """
+        Format Snowflake data into the order, review and pet DataFrames used by the agents.
+        
+        Produces the same columns as format_data_for_pipeline() with column-wise operations,
+        reading frames directly when customer_data is a CustomerQueryResults.
+        
+        Args:
+            customer_id (str): Customer ID
+            customer_data (Mapping[str, Any]): Raw data from Snowflake
+            
+        Returns:
+            Dict[str, pd.DataFrame]: 'order_data', 'review_data' and 'pet_data' frames
+        """
+        def query_frame(query_name: str) -> pd.DataFrame:
+            if isinstance(customer_data, CustomerQueryResults):
+                return customer_data.frame(query_name)
+            return pd.DataFrame(customer_data.get(query_name) or [])
+        
+        formatted_frames = {'order_data': pd.DataFrame(), 'review_data': pd.DataFrame(), 'pet_data': pd.DataFrame()}
+        
+        # Process get_cust_orders (order data)
+        orders = query_frame('get_cust_orders') if 'get_cust_orders' in customer_data else pd.DataFrame()
+        if not orders.empty:
+            orders = self._with_product_details(orders)
+            quantity_column = 'TOTAL_QUANTITY' if 'TOTAL_QUANTITY' in orders.columns else 'ORDER_LINE_QUANTITY'
+            formatted_frames['order_data'] = pd.DataFrame({
+                'CustomerID': str(customer_id),
+                'ProductID': self._string_column(orders, 'PRODUCT_ID'),
+                'ProductName': self._string_column(orders, 'NAME'),
+                'Quantity': self._count_column(orders, quantity_column),
+                'LineCount': self._count_column(orders, 'LINE_COUNT')
+            })
+        
+        # Process get_pet_profiles (pet data)
+        pets = query_frame('get_pet_profiles') if 'get_pet_profiles' in customer_data else pd.DataFrame()
+        if not pets.empty:
+            formatted_frames['pet_data'] = pd.DataFrame({
+                'CustomerID': self._string_column(pets, 'CUSTOMER_ID', customer_id),
+                'PetName': self._string_column(pets, 'PET_NAME'),
+                'PetType': self._string_column(pets, 'PET_TYPE'),
+                'PetBreed': self._string_column(pets, 'PET_BREED'),
+                'Weight': self._string_column(pets, 'WEIGHT'),
+                'Gender': self._string_column(pets, 'GENDER'),
+                'PetAge': self._string_column(pets, 'PET_AGE'),
+                'Medication': self._string_column(pets, 'MEDICATION')
+            })
+        
+        # Process get_cust_reviews (review data)
+        reviews = query_frame('get_cust_reviews') if 'get_cust_reviews' in customer_data else pd.DataFrame()
+        if not reviews.empty:
+            formatted_frames['review_data'] = pd.DataFrame({
+                'CustomerID': self._string_column(reviews, 'CUSTOMER_ID', customer_id),
+                'ReviewID': self._string_column(reviews, 'REVIEW_ID'),
+                'ReviewTitle': self._string_column(reviews, 'REVIEW_TITLE'),
+                'ReviewText': self._string_column(reviews, 'REVIEW_TXT')
+            })
+        
+        return formatted_frames
+    
+    def _with_product_details(self, orders: pd.DataFrame) -> pd.DataFrame:
+        """Join product names and categories into order rows that only carry product IDs."""
+        if 'NAME' in orders.columns or 'PRODUCT_ID' not in orders.columns:
+            return orders
+        if self.product_dimensions is None:
+            with self._product_dimensions_lock:
+                if self.product_dimensions is None:
+                    self.product_dimensions = ProductDimensionCache(self)
+        return self.product_dimensions.enrich(orders)
+    
+    @staticmethod
+    def _count_column(frame: pd.DataFrame, column: str) -> pd.Series:
+        """Get a column as ints, with 1 where the column or value is missing (one order line)."""
+        if column not in frame.columns:
+            return pd.Series(1, index=frame.index)
+        return pd.to_numeric(frame[column]).fillna(1).astype(int)
+    
+    @staticmethod
+    def _string_column(frame: pd.DataFrame, column: str, default: Any = '') -> pd.Series:
+        """Get a column as strings, matching str() of the row values (NULL becomes 'None')."""
+        if column not in frame.columns:
+            return pd.Series(str(default), index=frame.index)
+        values = frame[column]
+        if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            # Integer columns with NULLs come back as floats from Arrow
+            values = values.astype('Int64')
+        return values.astype(object).where(values.notna(), 'None').astype(str)
+    
     def get_customer_orders_dataframe(self, customer_id: str) -> pd.DataFrame:
         """
         Get customer orders as a pandas DataFrame for the pipeline agents.
@@ -247,12 +1075,7 @@ class SnowflakeDataConnector:
             pd.DataFrame: Customer orders data
         """
         customer_data = self.get_customer_data(customer_id)
-        formatted_data = self.format_data_for_pipeline(customer_id, customer_data)
-        
-        if formatted_data['order_data'] and len(formatted_data['order_data']) > 0:
-            return pd.DataFrame(formatted_data['order_data'])
-        else:
-            return pd.DataFrame()
+        return self.format_frames_for_pipeline(customer_id, customer_data)['order_data']
     
     def get_customer_reviews_dataframe(self, customer_id: str) -> pd.DataFrame:
         """
@@ -265,12 +1088,7 @@ class SnowflakeDataConnector:
             pd.DataFrame: Customer reviews data
         """
         customer_data = self.get_customer_data(customer_id)
-        formatted_data = self.format_data_for_pipeline(customer_id, customer_data)
-        
-        if formatted_data['review_data'] and len(formatted_data['review_data']) > 0:
-            return pd.DataFrame(formatted_data['review_data'])
-        else:
-            return pd.DataFrame()
+        return self.format_frames_for_pipeline(customer_id, customer_data)['review_data']
     
     def get_customer_pets_dataframe(self, customer_id: str) -> pd.DataFrame:
         """
@@ -283,12 +1101,7 @@ class SnowflakeDataConnector:
             pd.DataFrame: Customer pets data
         """
         customer_data = self.get_customer_data(customer_id)
-        formatted_data = self.format_data_for_pipeline(customer_id, customer_data)
-        
-        if formatted_data['pet_data'] and len(formatted_data['pet_data']) > 0:
-            return pd.DataFrame(formatted_data['pet_data'])
-        else:
-            return pd.DataFrame()
+        return self.format_frames_for_pipeline(customer_id, customer_data)['pet_data']
     
     def get_customer_address(self, customer_id: str) -> Dict[str, str]:
         """
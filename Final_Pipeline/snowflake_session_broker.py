@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Snowflake Session Broker for Chewy Playback Pipeline
+Holds warm, authenticated Snowflake connections in one long-lived process and runs
+queries for pipeline workers over a Unix socket, so each pipeline run skips the
+connection setup and SSO login.
+
+Run it once (python snowflake_session_broker.py) and point pipeline runs at it with
+SNOWFLAKE_BROKER_SOCKET.
+"""
+
+import io
+import os
+import json
+import time
+import socket
+import itertools
+import threading
+import socketserver
+import pandas as pd
+from typing import Dict, List, Any, Optional, Tuple, Callable
+from snowflake_data_connector import SnowflakeDataConnector, ARROW_AVAILABLE
+from query_result_cache import _ResultEncoder
+from priority_lanes import INTERACTIVE, BULK, current_priority
+
+try:
+    import snowflake.connector
+    from snowflake.connector.errors import DatabaseError
+    SNOWFLAKE_AVAILABLE = True
+except ImportError:
+    SNOWFLAKE_AVAILABLE = False
+
+if ARROW_AVAILABLE:
+    import pyarrow as pa
+
+DEFAULT_SOCKET_PATH = "/tmp/chewy_snowflake_broker.sock"
+
+# Snowflake error codes for a session that has gone away (no longer exists, expired, token expired)
+SESSION_EXPIRED_ERRNOS = {390111, 390112, 390114}
+# Connector error codes for a connection that failed or was closed before the statement was sent
+CONNECTION_LOST_ERRNOS = {250001, 250002}
+
+
+def _frame_to_arrow_bytes(frame: pd.DataFrame) -> bytes:
+    """Serialize a DataFrame as an Arrow IPC stream."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class SnowflakeSessionBroker:
+    """
+    Pool of long-lived Snowflake connections shared by all pipeline runs.
+
+    Each connection keeps its session alive with client_session_keep_alive and a
+    periodic heartbeat, and is reopened transparently when the session is lost.
+    Queries are spread round-robin over the pool, each on its own cursor. The last
+    interactive_sessions of the pool only serve interactive requests, so a web request
+    never queues behind bulk queries on a busy session.
+    """
+
+    def __init__(self, socket_path: str = None, pool_size: int = None, heartbeat_seconds: float = None,
+                 interactive_sessions: int = None):
+        """
+        Initialize the session broker.
+
+        Args:
+            socket_path (str, optional): Unix socket to serve on. Defaults to SNOWFLAKE_BROKER_SOCKET
+                or /tmp/chewy_snowflake_broker.sock
+            pool_size (int, optional): Number of Snowflake connections. Defaults to SNOWFLAKE_BROKER_POOL_SIZE (2)
+            heartbeat_seconds (float, optional): Idle connection check interval. Defaults to
+                SNOWFLAKE_BROKER_HEARTBEAT_MINUTES (10 minutes)
+            interactive_sessions (int, optional): Sessions reserved for interactive requests. Defaults
+                to SNOWFLAKE_BROKER_INTERACTIVE_SESSIONS (1); always leaves bulk at least one session
+        """
+        if not SNOWFLAKE_AVAILABLE:
+            raise ImportError("snowflake-connector-python is not installed. Please install it first.")
+
+        # The connector supplies the credentials and result fetching
+        self.connector = SnowflakeDataConnector()
+        self.socket_path = socket_path or os.getenv('SNOWFLAKE_BROKER_SOCKET') or DEFAULT_SOCKET_PATH
+        self.pool_size = max(1, pool_size or int(os.getenv('SNOWFLAKE_BROKER_POOL_SIZE', '2')))
+        self.heartbeat_seconds = heartbeat_seconds or float(os.getenv('SNOWFLAKE_BROKER_HEARTBEAT_MINUTES', '10')) * 60
+        if interactive_sessions is None:
+            interactive_sessions = int(os.getenv('SNOWFLAKE_BROKER_INTERACTIVE_SESSIONS', '1'))
+        self.interactive_sessions = max(0, min(interactive_sessions, self.pool_size - 1))
+
+        self._connections = [None] * self.pool_size
+        self._slot_locks = [threading.Lock() for _ in range(self.pool_size)]
+        self._next_slot = {INTERACTIVE: itertools.count(), BULK: itertools.count()}
+        self._stop = threading.Event()
+        self.server = None
+        self.stats = {'queries': 0, 'interactive_queries': 0, 'errors': 0, 'reconnects': 0, 'started_at': time.time()}
+
+    def _connection_parameters(self) -> Dict[str, Any]:
+        """Connection parameters for long-lived sessions."""
+        credentials = self.connector._connection_parameters()
+        credentials["client_session_keep_alive"] = True
+        # Reuse the SSO token for the other pool connections instead of opening the browser again
+        credentials["client_store_temporary_credential"] = True
+        return credentials
+
+    def _get_connection(self, slot: int, reconnect: bool = False):
+        """Get the connection for a pool slot, opening or reopening it if needed."""
+        with self._slot_locks[slot]:
+            connection = self._connections[slot]
+            if connection is not None and not reconnect and not connection.is_closed():
+                return connection
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                self.stats['reconnects'] += 1
+                print(f"🔄 Reconnecting broker session {slot + 1}/{self.pool_size}...")
+            else:
+                print(f"🔗 Opening broker session {slot + 1}/{self.pool_size}...")
+            self._connections[slot] = snowflake.connector.connect(**self._connection_parameters())
+            print(f"✅ Broker session {slot + 1}/{self.pool_size} connected")
+            return self._connections[slot]
+
+    @staticmethod
+    def _is_session_error(error: Exception) -> bool:
+        """
+        Tell a lost or expired session apart from any other error. Only these are retried:
+        Snowflake rejected the statement without running it, so running it again can't run
+        it twice. A failing statement, or a network error once it was sent, is not retried.
+        """
+        return getattr(error, 'errno', None) in SESSION_EXPIRED_ERRNOS | CONNECTION_LOST_ERRNOS
+
+    def _pick_slot(self, priority: str) -> int:
+        """Next pool slot for a request: interactive requests use the reserved sessions, bulk the others."""
+        bulk_sessions = self.pool_size - self.interactive_sessions
+        if priority == INTERACTIVE and self.interactive_sessions:
+            return bulk_sessions + next(self._next_slot[INTERACTIVE]) % self.interactive_sessions
+        return next(self._next_slot[BULK]) % bulk_sessions
+
+    def execute(self, query: str, params: list = None, arrow: bool = True, query_info: Dict[str, Any] = None,
+                priority: str = BULK, timeout: float = None) -> Any:
+        """
+        Run a query on the next pool connection for its priority class, reconnecting and
+        retrying once if the session was lost. A timeout (seconds) cancels the query.
+
+        Returns:
+            Any: A DataFrame when arrow is requested and available, otherwise a list of row dictionaries
+        """
+        use_arrow = arrow and ARROW_AVAILABLE
+        result = self._on_session(priority, lambda connection: SnowflakeDataConnector._fetch_query(
+            connection, query, params, use_arrow, query_info, timeout))
+        self.stats['queries'] += 1
+        if priority == INTERACTIVE:
+            self.stats['interactive_queries'] += 1
+        return result
+
+    def describe(self, query: str, params: list = None, priority: str = BULK) -> List[Tuple[str, str]]:
+        """Get a query's result columns as (column, kind) pairs, on the next pool connection for its priority class."""
+        return self._on_session(priority, lambda connection: SnowflakeDataConnector._describe_columns(
+            connection, query, params))
+
+    def _on_session(self, priority: str, run: Callable[[Any], Any]) -> Any:
+        """Call run(connection) on the next pool connection for a priority class, reconnecting and retrying once if the session was lost."""
+        slot = self._pick_slot(priority)
+        connection = self._get_connection(slot)
+        try:
+            return run(connection)
+        except DatabaseError as e:
+            if not self._is_session_error(e):
+                raise
+            print(f"⚠️ Broker session {slot + 1} lost ({e}), reconnecting")
+            return run(self._get_connection(slot, reconnect=True))
+
+    def warm_up(self):
+        """Open every pool connection ahead of the first request."""
+        for slot in range(self.pool_size):
+            try:
+                self._get_connection(slot)
+            except Exception as e:
+                print(f"❌ Failed to open broker session {slot + 1}: {e}")
+
+    def _heartbeat_loop(self):
+        """Ping open connections periodically and reopen any whose session has gone away."""
+        while not self._stop.wait(self.heartbeat_seconds):
+            for slot in range(self.pool_size):
+                connection = self._connections[slot]
+                if connection is None:
+                    continue
+                try:
+                    SnowflakeDataConnector._fetch_query(connection, "SELECT 1", None, False)
+                except Exception as e:
+                    print(f"⚠️ Broker session {slot + 1} heartbeat failed ({e}), reconnecting")
+                    try:
+                        self._get_connection(slot, reconnect=True)
+                    except Exception as reconnect_error:
+                        print(f"❌ Failed to reconnect broker session {slot + 1}: {reconnect_error}")
+
+    def _encode_result(self, result: Any) -> Tuple[str, bytes]:
+        """Encode a query result for the wire as (format, payload)."""
+        if isinstance(result, pd.DataFrame):
+            return 'arrow', _frame_to_arrow_bytes(result)
+        return 'json', json.dumps(result, cls=_ResultEncoder).encode('utf-8')
+
+    def handle_request(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """Handle one decoded request and return (response header, payload)."""
+        op = request.get('op', 'query')
+        if op == 'ping':
+            return {'status': 'ok', 'length': 0}, b''
+        if op == 'stats':
+            payload = json.dumps({**self.stats, 'pool_size': self.pool_size,
+                                  'interactive_sessions': self.interactive_sessions,
+                                  'open_sessions': sum(c is not None and not c.is_closed() for c in self._connections)}).encode('utf-8')
+            return {'status': 'ok', 'format': 'json', 'length': len(payload)}, payload
+        if op not in ('query', 'describe'):
+            return {'status': 'error', 'error': f"Unknown operation '{op}'", 'length': 0}, b''
+        try:
+            if op == 'describe':
+                payload = json.dumps(self.describe(request['query'], request.get('params'),
+                                                   request.get('priority', BULK))).encode('utf-8')
+                return {'status': 'ok', 'format': 'json', 'length': len(payload)}, payload
+            query_info = {}
+            result = self.execute(request['query'], request.get('params'), request.get('arrow', True), query_info,
+                                  request.get('priority', BULK), request.get('timeout'))
+            result_format, payload = self._encode_result(result)
+            return {'status': 'ok', 'format': result_format, 'query_id': query_info.get('query_id'),
+                    'length': len(payload)}, payload
+        except Exception as e:
+            self.stats['errors'] += 1
+            return {'status': 'error', 'error': str(e), 'length': 0}, b''
+
+    def serve_forever(self, warm_up: bool = True):
+        """Serve requests on the Unix socket until interrupted."""
+        if os.path.exists(self.socket_path):
+            if SessionBrokerClient(self.socket_path).ping():
+                raise RuntimeError(f"A session broker is already running at {self.socket_path}")
+            # Left over from a broker that didn't shut down cleanly
+            os.unlink(self.socket_path)
+
+        broker = self
+
+        class _RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        header, payload = broker.handle_request(json.loads(line))
+                    except json.JSONDecodeError as e:
+                        header, payload = {'status': 'error', 'error': f"Invalid request: {e}", 'length': 0}, b''
+                    self.wfile.write(json.dumps(header).encode('utf-8') + b'\n' + payload)
+                    self.wfile.flush()
+
+        # Create the socket owner-only: anyone who can connect runs SQL with our credentials
+        previous_umask = os.umask(0o077)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        self.server.daemon_threads = True
+        os.chmod(self.socket_path, 0o600)
+        print(f"🔌 Snowflake session broker listening on {self.socket_path} ({self.pool_size} sessions)")
+
+        # Bind first, then warm up in the background so clients can already connect and wait
+        if warm_up:
+            threading.Thread(target=self.warm_up, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping session broker...")
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop serving and close all Snowflake connections."""
+        self._stop.set()
+        if self.server:
+            self.server.server_close()
+            self.server = None
+        for slot, connection in enumerate(self._connections):
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                self._connections[slot] = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        print("✅ Session broker stopped")
+
+
+class SessionBrokerClient:
+    """
+    Client used by SnowflakeDataConnector to run queries through a session broker.
+
+    Each request uses its own socket connection, so one client can be shared by the
+    connector's concurrent query threads.
+    """
+
+    def __init__(self, socket_path: str = None, timeout: float = None):
+        self.socket_path = socket_path or os.getenv('SNOWFLAKE_BROKER_SOCKET') or DEFAULT_SOCKET_PATH
+        # Long enough for the broker's first SSO login plus a slow query
+        self.timeout = timeout or float(os.getenv('SNOWFLAKE_BROKER_TIMEOUT', '900'))
+
+    def _request(self, request: Dict[str, Any], timeout: float = None) -> Tuple[Dict[str, Any], bytes]:
+        """Send one request and read back (response header, payload)."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout or self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as response:
+                header = json.loads(response.readline())
+                payload = response.read(header.get('length', 0))
+        if header.get('status') != 'ok':
+            raise RuntimeError(f"Session broker request failed: {header.get('error')}")
+        return header, payload
+
+    def ping(self) -> bool:
+        """Check whether a broker is listening on the socket."""
+        try:
+            self._request({'op': 'ping'}, timeout=5)
+            return True
+        except (OSError, ValueError, RuntimeError):
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Get query, error and reconnect counts from the broker."""
+        _, payload = self._request({'op': 'stats'})
+        return json.loads(payload)
+
+    def execute(self, query: str, params: list = None, arrow: bool = True, query_info: Dict[str, Any] = None,
+                timeout: float = None) -> Any:
+        """
+        Run a query through the broker at this process's priority, storing its Snowflake
+        query ID in query_info when given. With a timeout (seconds) the broker cancels the
+        query, and the client stops waiting shortly after.
+
+        Returns:
+            Any: A DataFrame when arrow is requested, otherwise a list of row dictionaries
+        """
+        header, payload = self._request({'op': 'query', 'query': query, 'params': params, 'arrow': arrow,
+                                         'priority': current_priority(), 'timeout': timeout},
+                                        timeout=timeout + 5 if timeout else None)
+        if query_info is not None:
+            query_info['query_id'] = header.get('query_id')
+        if header.get('format') == 'arrow':
+            return pa.ipc.open_stream(payload).read_pandas()
+        rows = json.loads(payload)
+        return pd.DataFrame.from_records(rows) if arrow else rows
+
+    def describe(self, query: str, params: list = None) -> List[Tuple[str, str]]:
+        """Get a query's result columns as (column, kind) pairs through the broker, without running it."""
+        _, payload = self._request({'op': 'describe', 'query': query, 'params': params, 'priority': current_priority()})
+        return [tuple(column) for column in json.loads(payload)]
+
+
+def main():
+    """Run the session broker, or report on a running one."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Snowflake Session Broker")
+    parser.add_argument("--socket", help=f"Unix socket path (default: SNOWFLAKE_BROKER_SOCKET or {DEFAULT_SOCKET_PATH})")
+    parser.add_argument("--pool-size", type=int, help="Number of Snowflake sessions to keep open (default: 2)")
+    parser.add_argument("--heartbeat-minutes", type=float, help="Minutes between session heartbeats (default: 10)")
+    parser.add_argument("--interactive-sessions", type=int,
+                        help="Sessions reserved for interactive requests (default: SNOWFLAKE_BROKER_INTERACTIVE_SESSIONS or 1)")
+    parser.add_argument("--no-warm-up", action="store_true", help="Open sessions on first request instead of at startup")
+    parser.add_argument("--status", action="store_true", help="Print stats for a running broker and exit")
+
+    args = parser.parse_args()
+
+    if args.status:
+        client = SessionBrokerClient(args.socket)
+        if not client.ping():
+            print(f"❌ No session broker running at {client.socket_path}")
+            return
+        stats = client.stats()
+        print(f"📊 Session broker at {client.socket_path}: {stats['open_sessions']}/{stats['pool_size']} sessions open "
+              f"({stats.get('interactive_sessions', 0)} interactive), {stats['queries']} queries "
+              f"({stats.get('interactive_queries', 0)} interactive), {stats['errors']} errors, {stats['reconnects']} reconnects")
+        return
+
+    broker = SnowflakeSessionBroker(
+        socket_path=args.socket,
+        pool_size=args.pool_size,
+        heartbeat_seconds=args.heartbeat_minutes * 60 if args.heartbeat_minutes else None,
+        interactive_sessions=args.interactive_sessions
+    )
+    broker.serve_forever(warm_up=not args.no_warm_up)
+
+
+if __name__ == "__main__":
+    main()
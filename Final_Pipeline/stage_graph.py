@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Stage Graph for Chewy Playback Pipeline
+Runs a customer's pipeline stages as a dependency graph: every stage starts as soon as
+the stages it depends on have finished, so independent stages (breed prediction,
+narrative, analyzers) overlap and a customer takes about as long as its longest chain.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Callable, Iterable
+
+
+class StageSkipped(Exception):
+    """Raised in place of a stage's result when one of its dependencies failed."""
+
+
+class StageGraph:
+    """
+    A set of named stages with dependencies, run concurrently on a thread pool.
+
+    Each stage is called with a dict of its dependencies' results. A stage that raises is
+    recorded in errors, and stages that depend on it (directly or not) are skipped; stages
+    that don't depend on it still run.
+    """
+
+    def __init__(self, name: str = "stages"):
+        """
+        Initialize an empty stage graph.
+
+        Args:
+            name (str): Label used in log messages, e.g. the customer ID
+        """
+        self.name = name
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], depends_on: Iterable[str] = ()) -> 'StageGraph':
+        """
+        Add a stage.
+
+        Args:
+            name (str): Stage name
+            func (Callable): Called with {dependency name: result}; its return value is the stage result
+            depends_on (Iterable[str]): Stages that must finish first (added before or after this one)
+
+        Returns:
+            StageGraph: self, so stages can be chained
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already in the graph")
+        self.stages[name] = {'func': func, 'depends_on': list(depends_on)}
+        return self
+
+    def _check(self):
+        """Reject unknown dependencies and cycles before anything runs."""
+        for name, stage in self.stages.items():
+            unknown = [dependency for dependency in stage['depends_on'] if dependency not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage '{name}' depends on unknown stages: {', '.join(unknown)}")
+        visiting, done = set(), set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through '{name}'")
+            visiting.add(name)
+            for dependency in self.stages[name]['depends_on']:
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _run_stage(self, name: str) -> Any:
+        """Run one stage with its dependencies' results and time it."""
+        stage = self.stages[name]
+        start_time = time.time()
+        try:
+            return stage['func']({dependency: self.results[dependency] for dependency in stage['depends_on']})
+        finally:
+            self.timings[name] = {'start': start_time - self._started_at, 'seconds': time.time() - start_time}
+
+    def run(self, max_workers: int = None) -> Dict[str, Any]:
+        """
+        Run every stage once its dependencies have finished.
+
+        Args:
+            max_workers (int, optional): Stages run at once. Defaults to the number of stages
+
+        Returns:
+            Dict[str, Any]: Stage name -> result, for the stages that succeeded (see self.errors for the rest)
+        """
+        self._check()
+        self.results, self.errors, self.timings = {}, {}, {}
+        self._started_at = time.time()
+        pending = list(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(self.stages), 1)) as executor:
+            while pending or running:
+                # Start (or skip) everything whose dependencies are settled
+                for name in list(pending):
+                    depends_on = self.stages[name]['depends_on']
+                    failed = [dependency for dependency in depends_on if dependency in self.errors]
+                    if failed:
+                        self.errors[name] = StageSkipped(f"skipped because {', '.join(failed)} failed")
+                        pending.remove(name)
+                    elif all(dependency in self.results for dependency in depends_on):
+                        running[executor.submit(self._run_stage, name)] = name
+                        pending.remove(name)
+                if not running:
+                    # Only skipped stages were left
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        print(f"  ❌ [{self.name}] Stage '{name}' failed: {e}")
+                        self.errors[name] = e
+        return self.results
+
+    def critical_path_seconds(self) -> float:
+        """Wall time from the start of the run to the end of the last stage."""
+        return max((timing['start'] + timing['seconds'] for timing in self.timings.values()), default=0.0)
+
+    def summary(self) -> List[str]:
+        """One line per stage with its start offset, duration and outcome, in start order."""
+        lines = []
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1]['start']):
+            outcome = 'failed' if name in self.errors else 'ok'
+            lines.append(f"{name}: +{timing['start']:.2f}s for {timing['seconds']:.2f}s ({outcome})")
+        for name, error in self.errors.items():
+            if isinstance(error, StageSkipped):
+                lines.append(f"{name}: {error}")
+        return lines
@@ -5,6 +5,7 @@ import subprocess
 import sys
 from pathlib import Path
 import re
+import socket
 import threading
 import time
 
@@ -14,11 +15,63 @@ app = Flask(__name__)
 OUTPUT_DIR = "Final_Pipeline/Output"
 PERSONALITY_BADGES_DIR = "personalityzipped"
 PIPELINE_SCRIPT = "Final_Pipeline/chewy_playback_pipeline.py"
+# Users wait on a loading page, so run all Snowflake query templates at once
+PIPELINE_CONCURRENT_QUERIES = "10"
+# Single-customer runs fetch each stage's templates in one consolidated round trip
+USE_CONSOLIDATED_QUERY = os.getenv("PIPELINE_CONSOLIDATED_QUERY", "true").lower() != "false"
+# Long-lived Snowflake session broker shared by pipeline runs, so they skip connection setup and SSO
+SESSION_BROKER_SCRIPT = "Final_Pipeline/snowflake_session_broker.py"
+SESSION_BROKER_SOCKET = os.getenv("SNOWFLAKE_BROKER_SOCKET", "/tmp/chewy_snowflake_broker.sock")
+USE_SESSION_BROKER = os.getenv("USE_SNOWFLAKE_BROKER", "true").lower() != "false"
 
 # Global tracking for running pipelines
 running_pipelines = set()
 pipeline_lock = threading.Lock()
 
+broker_lock = threading.Lock()
+broker_process = None
+
+def session_broker_listening():
+    """Check whether something accepts connections on the broker socket"""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2)
+            sock.connect(SESSION_BROKER_SOCKET)
+        return True
+    except OSError:
+        return False
+
+def ensure_session_broker():
+    """Start the Snowflake session broker in the background unless one is already running"""
+    global broker_process
+    
+    if not USE_SESSION_BROKER:
+        return False
+    
+    with broker_lock:
+        if broker_process is not None and broker_process.poll() is None:
+            return True
+        if session_broker_listening():
+            # Another app instance (or a manually started broker) already owns the socket
+            return True
+        try:
+            project_dir = os.path.dirname(os.path.abspath(__file__))
+            cmd = [sys.executable, SESSION_BROKER_SCRIPT, "--socket", SESSION_BROKER_SOCKET]
+            broker_process = subprocess.Popen(cmd, cwd=project_dir, env=os.environ.copy())
+            # The broker binds its socket before logging in, so this wait is short
+            for _ in range(20):
+                if session_broker_listening():
+                    print(f"🔌 Started Snowflake session broker at {SESSION_BROKER_SOCKET}")
+                    return True
+                if broker_process.poll() is not None:
+                    break
+                time.sleep(0.5)
+            print("⚠️ Snowflake session broker did not come up, pipelines will connect directly")
+            return False
+        except Exception as e:
+            print(f"⚠️ Could not start Snowflake session broker: {e}")
+            return False
+
 def run_pipeline_for_customer(customer_id):
     """Run the chewy_playback_pipeline.py script for a specific customer"""
     global running_pipelines
@@ -40,11 +93,18 @@ def run_pipeline_for_customer(customer_id):
         os.chdir(project_dir)
         
         # Run the pipeline script in background and redirect immediately
-        cmd = [sys.executable, PIPELINE_SCRIPT, "--customers", customer_id]
+        # A customer is waiting on the page, so this run goes ahead of bulk runs for OpenAI and Snowflake
+        cmd = [sys.executable, PIPELINE_SCRIPT, "--customers", customer_id,
+               "--concurrent-queries", PIPELINE_CONCURRENT_QUERIES, "--priority", "interactive"]
+        if USE_CONSOLIDATED_QUERY:
+            cmd.append("--consolidated-query")
         print(f"🚀 Pipeline started for customer {customer_id} - redirecting to experience...")
         
         # Use existing environment variables for Snowflake credentials
         env = os.environ.copy()
+        # Pipeline falls back to its own connection if the broker isn't reachable
+        if ensure_session_broker():
+            env["SNOWFLAKE_BROKER_SOCKET"] = SESSION_BROKER_SOCKET
         
         # Start pipeline in background (non-blocking) with environment variables
         process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
@@ -561,4 +621,7 @@ def badge_image(filename):
     return send_from_directory(PERSONALITY_BADGES_DIR, filename)
 
 if __name__ == '__main__':
+    # Only the reloader's serving process starts the broker, so it isn't started twice
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        ensure_session_broker()
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
@@ -0,0 +1,6 @@
+"""Make the pipeline modules importable the way they import each other (from Final_Pipeline/)."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "Final_Pipeline"))
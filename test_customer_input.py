@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Tests for customer ID streaming and sharding (Final_Pipeline/customer_input.py)
+
+import pytest
+from customer_input import parse_shard, in_shard, iter_customer_ids, select_customers, batched
+
+
+def test_parse_shard():
+    assert parse_shard('3/16') == (3, 16)
+    assert parse_shard('0/1') == (0, 1)
+    for spec in ('16/16', '-1/4', '1/0', '1', 'a/b'):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_shards_partition_the_customers():
+    customer_ids = [str(customer_id) for customer_id in range(1000, 3000)]
+    shards = [[cid for cid in customer_ids if in_shard(cid, (index, 8))] for index in range(8)]
+    assert sorted(cid for shard in shards for cid in shard) == sorted(customer_ids)
+    # Every shard gets a share of the customers
+    assert all(len(shard) > 100 for shard in shards)
+    # The assignment is stable
+    assert [cid for cid in customer_ids if in_shard(cid, (3, 8))] == shards[3]
+    assert all(in_shard(cid, None) for cid in customer_ids)
+
+
+def test_plain_file_skips_blank_and_comment_lines(tmp_path):
+    path = tmp_path / 'ids.txt'
+    path.write_text("# cohort\n1183376\n\n  1234567  \n# done\n")
+    assert list(iter_customer_ids(str(path))) == ['1183376', '1234567']
+
+
+def test_csv_header_picks_the_customer_id_column(tmp_path):
+    path = tmp_path / 'ids.csv'
+    path.write_text("email,Customer_ID,segment\na@example.com,101,x\nb@example.com,102,y\n")
+    assert list(iter_customer_ids(str(path))) == ['101', '102']
+
+
+def test_csv_without_header_uses_the_first_column(tmp_path):
+    path = tmp_path / 'ids.csv'
+    path.write_text("101,x\n102,y\n")
+    assert list(iter_customer_ids(str(path))) == ['101', '102']
+
+
+def test_unknown_header_row_is_skipped(tmp_path):
+    path = tmp_path / 'ids.csv'
+    path.write_text("id,segment\n101,x\n")
+    assert list(iter_customer_ids(str(path))) == ['101']
+
+
+def test_duplicates_are_dropped_within_a_batch_only():
+    customer_ids = ['1', '2', '1', '3', '4', '3', '5']
+    assert list(select_customers(customer_ids)) == customer_ids
+    assert list(batched(customer_ids, 2)) == [['1', '2'], ['1', '3'], ['4', '3'], ['5']]
+    assert list(batched(customer_ids, 10)) == [['1', '2', '3', '4', '5']]
+    assert list(batched([], 3)) == []
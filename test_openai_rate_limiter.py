@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Tests for the shared OpenAI token buckets (Final_Pipeline/openai_rate_limiter.py)
+
+import pytest
+import openai_rate_limiter
+from openai_rate_limiter import OpenAIRateLimiter
+
+
+class FakeClock:
+    """Stands in for time.time() so bucket refills are exact."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(openai_rate_limiter.time, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def make_limiter(tmp_path, monkeypatch):
+    monkeypatch.setenv('OPENAI_RATE_LIMIT', '1')
+    monkeypatch.delenv('OPENAI_RATE_LIMITS', raising=False)
+
+    def make(limits, reserve=0.0):
+        monkeypatch.setenv('OPENAI_INTERACTIVE_RESERVE', str(reserve))
+        return OpenAIRateLimiter(limits, state_path=str(tmp_path / 'buckets.json'))
+
+    return make
+
+
+def test_requests_refill_continuously(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 60, 'tpm': 0}})
+    for _ in range(60):
+        assert limiter.try_acquire('m', priority='interactive') == 0
+    # One request frees up per second
+    assert limiter.try_acquire('m', priority='interactive') == pytest.approx(1.0)
+    clock.now += 1.0
+    assert limiter.try_acquire('m', priority='interactive') == 0
+
+
+def test_tokens_wait_for_the_missing_share(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 1000, 'tpm': 600}})
+    assert limiter.try_acquire('m', 600, priority='interactive') == 0
+    # 300 tokens at 10 tokens per second
+    assert limiter.try_acquire('m', 300, priority='interactive') == pytest.approx(30.0)
+    clock.now += 30.0
+    assert limiter.try_acquire('m', 300, priority='interactive') == 0
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 1000, 'tpm': 600}})
+    assert limiter.try_acquire('m', 10000, priority='interactive') == 0
+    assert limiter.try_acquire('m', 10000, priority='interactive') == pytest.approx(60.0)
+
+
+def test_bulk_leaves_the_interactive_reserve(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 10, 'tpm': 0}}, reserve=0.2)
+    bulk = 0
+    while limiter.try_acquire('m', priority='bulk') == 0:
+        bulk += 1
+    interactive = 0
+    while limiter.try_acquire('m', priority='interactive') == 0:
+        interactive += 1
+    assert (bulk, interactive) == (8, 2)
+
+
+def test_settle_returns_unused_tokens(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 1000, 'tpm': 600}})
+    assert limiter.try_acquire('m', 600, priority='interactive') == 0
+    limiter.settle('m', 600, 200)
+    assert limiter.status()['m']['tokens'] == 400
+    assert limiter.try_acquire('m', 400, priority='interactive') == 0
+
+
+def test_pause_holds_every_request(make_limiter, clock):
+    limiter = make_limiter({'m': {'rpm': 1000, 'tpm': 0}})
+    limiter.pause('m', 5.0)
+    assert limiter.try_acquire('m', priority='interactive') == pytest.approx(5.0)
+    clock.now += 5.0
+    assert limiter.try_acquire('m', priority='interactive') == 0
+
+
+def test_budgets_are_off_unless_configured(tmp_path, monkeypatch, clock):
+    monkeypatch.delenv('OPENAI_RATE_LIMIT', raising=False)
+    monkeypatch.delenv('OPENAI_RATE_LIMITS', raising=False)
+    state_path = tmp_path / 'buckets.json'
+    limiter = OpenAIRateLimiter(state_path=str(state_path))
+    assert not limiter.enabled
+    for _ in range(1000):
+        assert limiter.try_acquire('gpt-4', 5000) == 0
+    assert not state_path.exists()
+    # A 429 still pauses the model, in this process only
+    limiter.pause('gpt-4', 2.0)
+    assert limiter.try_acquire('gpt-4') == pytest.approx(2.0)
+    assert not state_path.exists()
+
+
+def test_configured_budgets_turn_the_limiter_on(tmp_path, monkeypatch):
+    monkeypatch.delenv('OPENAI_RATE_LIMIT', raising=False)
+    monkeypatch.setenv('OPENAI_RATE_LIMITS', '{"gpt-4": {"rpm": 10000, "tpm": 300000}}')
+    limiter = OpenAIRateLimiter(state_path=str(tmp_path / 'buckets.json'))
+    assert limiter.enabled
+    assert limiter.limits['gpt-4'] == {'rpm': 10000, 'tpm': 300000}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Tests for stage checkpoints (Final_Pipeline/pipeline_checkpoint.py) and the pipeline's reuse rules
+
+from types import SimpleNamespace
+import pytest
+from pipeline_checkpoint import CustomerCheckpoint, fingerprint
+
+
+def test_fingerprint_ignores_key_order_only():
+    assert fingerprint({'a': 1, 'b': [1, 2]}) == fingerprint({'b': [1, 2], 'a': 1})
+    assert fingerprint({'a': 1}) != fingerprint({'a': 2})
+    assert fingerprint([1, 2]) != fingerprint([2, 1])
+    # Inputs are hashed separately, not concatenated
+    assert fingerprint('ab', 'c') != fingerprint('a', 'bc')
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint = CustomerCheckpoint(tmp_path, 101)
+    assert not checkpoint.has('breed')
+    assert checkpoint.record('breed') is None
+    assert checkpoint.save('breed', {'Rex': 'Beagle'}, 'abc')
+    assert checkpoint.has('breed')
+    assert checkpoint.load('breed') == {'Rex': 'Beagle'}
+    assert checkpoint.record('breed')['fingerprint'] == 'abc'
+    checkpoint.clear()
+    assert not checkpoint.has('breed')
+
+
+def test_unreadable_checkpoint_is_ignored(tmp_path):
+    checkpoint = CustomerCheckpoint(tmp_path, '101')
+    checkpoint.state_dir.mkdir(parents=True)
+    (checkpoint.state_dir / 'breed.json').write_text('{"stage": "bre')
+    assert checkpoint.record('breed') is None
+
+
+@pytest.fixture
+def reused_stage(tmp_path):
+    """Call ChewyPlaybackPipeline._reused_stage on a stand-in with just the state it reads."""
+    pipeline = pytest.importorskip('chewy_playback_pipeline')
+
+    def reuse(stage, inputs=None, resume=False, incremental=False):
+        owner = SimpleNamespace(resume=resume, incremental=incremental,
+                                _checkpoint=lambda customer_id: CustomerCheckpoint(tmp_path, customer_id))
+        return pipeline.ChewyPlaybackPipeline._reused_stage(owner, '101', stage, inputs, quiet=True)
+
+    return reuse
+
+
+def test_incremental_reuses_only_unchanged_inputs(tmp_path, reused_stage):
+    rows = [{'PET_NAME': 'Rex', 'BREED': 'Beagle'}]
+    found, result, input_fingerprint = reused_stage('breed', lambda: [rows], incremental=True)
+    assert (found, result, input_fingerprint) == (False, None, fingerprint(rows))
+
+    CustomerCheckpoint(tmp_path, '101').save('breed', {'Rex': 'Beagle'}, input_fingerprint)
+    assert reused_stage('breed', lambda: [rows], incremental=True) == (True, {'Rex': 'Beagle'}, input_fingerprint)
+
+    changed = [{'PET_NAME': 'Rex', 'BREED': 'Basset Hound'}]
+    assert reused_stage('breed', lambda: [changed], incremental=True) == (False, None, fingerprint(changed))
+
+
+def test_incremental_never_reuses_stages_without_inputs(tmp_path, reused_stage):
+    CustomerCheckpoint(tmp_path, '101').save('image', 'https://example.com/rex.png')
+    assert reused_stage('image', incremental=True) == (False, None, None)
+    assert reused_stage('image', resume=True) == (True, 'https://example.com/rex.png', None)
+
+
+def test_resume_reuses_whatever_is_stored(tmp_path, reused_stage):
+    CustomerCheckpoint(tmp_path, '101').save('breed', {'Rex': 'Beagle'}, 'stale')
+    assert reused_stage('breed', lambda: [['new rows']], resume=True) == (True, {'Rex': 'Beagle'}, 'stale')
+    # Without --resume or --incremental checkpoints aren't read, or fingerprinted
+    assert reused_stage('breed', lambda: [['new rows']]) == (False, None, None)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Tests for the interactive/bulk concurrency slots (Final_Pipeline/priority_lanes.py)
+
+import json
+import subprocess
+import sys
+import pytest
+from priority_lanes import PriorityLanes, INTERACTIVE, BULK
+from run_deadline import RunDeadline, DeadlineExceeded, set_run_deadline
+
+LANES = {'image': {'slots': 3, 'reserved': 1}}
+
+
+@pytest.fixture(autouse=True)
+def lanes_env(monkeypatch):
+    for name in ('PIPELINE_LANES_ENABLED', 'PIPELINE_LANES', 'PIPELINE_PRIORITY'):
+        monkeypatch.delenv(name, raising=False)
+    yield
+    set_run_deadline(None)
+
+
+@pytest.fixture
+def lanes(tmp_path, monkeypatch):
+    monkeypatch.setenv('PIPELINE_LANES_ENABLED', '1')
+    return PriorityLanes(LANES, state_path=tmp_path / 'lanes.json')
+
+
+def test_lanes_are_off_unless_turned_on(tmp_path, monkeypatch):
+    lanes = PriorityLanes(LANES, state_path=tmp_path / 'lanes.json')
+    assert not lanes.enabled
+    with lanes.slot('image'):
+        pass
+    assert lanes.capacity('image') is None
+    # Off means no state file updates at all
+    assert not (tmp_path / 'lanes.json').exists()
+
+    monkeypatch.setenv('PIPELINE_LANES', json.dumps(LANES))
+    assert PriorityLanes(state_path=tmp_path / 'lanes.json').enabled
+    monkeypatch.setenv('PIPELINE_LANES_ENABLED', 'false')
+    assert not PriorityLanes(state_path=tmp_path / 'lanes.json').enabled
+
+
+def test_bulk_leaves_the_reserved_slots_to_interactive(lanes):
+    assert lanes.try_acquire('image', 'bulk-1', BULK)
+    assert lanes.try_acquire('image', 'bulk-2', BULK)
+    assert not lanes.try_acquire('image', 'bulk-3', BULK)
+    assert lanes.try_acquire('image', 'interactive-1', INTERACTIVE)
+    assert not lanes.try_acquire('image', 'interactive-2', INTERACTIVE)
+
+    status = lanes.status()['image']
+    assert status['held'] == {INTERACTIVE: 1, BULK: 2}
+    assert status['waiting'] == {INTERACTIVE: 1, BULK: 1}
+    assert (lanes.capacity('image', BULK), lanes.capacity('image', INTERACTIVE), lanes.capacity('llm')) == (2, 3, None)
+
+
+def test_bulk_waits_while_interactive_is_waiting(lanes):
+    for index in range(3):
+        assert lanes.try_acquire('image', f'held-{index}', INTERACTIVE)
+    assert not lanes.try_acquire('image', 'interactive', INTERACTIVE)
+    lanes.release('image', 'held-0')
+    lanes.release('image', 'held-1')
+    # A bulk slot is free, but the waiting interactive call goes first
+    assert not lanes.try_acquire('image', 'bulk', BULK)
+    assert lanes.try_acquire('image', 'interactive', INTERACTIVE)
+    lanes.release('image', 'held-2')
+    assert lanes.try_acquire('image', 'bulk', BULK)
+
+
+def test_leases_of_exited_processes_are_dropped(lanes):
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    lease = {'pid': child.pid, 'priority': BULK, 'since': 0}
+    lanes.state_path.write_text(json.dumps({'image': {'leases': {'a': lease, 'b': lease}, 'waiting': {}}}))
+    assert lanes.status()['image']['held'] == {INTERACTIVE: 0, BULK: 0}
+    assert lanes.try_acquire('image', 'bulk', BULK)
+
+
+def test_slot_is_released_after_use(lanes):
+    with lanes.slot('image', BULK):
+        assert lanes.status()['image']['held'][BULK] == 1
+    assert lanes.status()['image']['held'][BULK] == 0
+    assert lanes.stats()['waits'] == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_waiting_stops_at_the_run_deadline(lanes):
+    lanes.try_acquire('image', 'bulk-1', BULK)
+    lanes.try_acquire('image', 'bulk-2', BULK)
+    set_run_deadline(RunDeadline(0))
+    with pytest.raises(DeadlineExceeded, match='image slot'):
+        with lanes.slot('image', BULK):
+            pass
+    # The caller stopped waiting, so interactive calls aren't held up by it
+    assert lanes.status()['image']['waiting'][BULK] == 0
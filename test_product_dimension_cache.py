@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Tests for the memory-mapped product catalog (Final_Pipeline/product_dimension_cache.py)
+
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+from product_dimension_cache import ProductDimensionCache
+
+
+class FakeConnector:
+    """Stands in for the data connector: serves the catalog in two frames, or fails."""
+    def __init__(self, products):
+        self.products = products
+        self.fail = False
+        self.refreshes = 0
+
+    def iter_query_frames(self, query, params=None):
+        self.refreshes += 1
+        if self.fail:
+            raise ConnectionError("warehouse unavailable")
+        rows = [{'product_id': product_id, 'name': name, 'category_level3': category}
+                for product_id, (name, category) in self.products.items()]
+        yield pd.DataFrame(rows[:1])
+        yield pd.DataFrame(rows[1:])
+
+
+@pytest.fixture
+def connector():
+    return FakeConnector({1: ('Kibble', 'Dry Food'), 2: ('Squeaky Bone', 'Toys')})
+
+
+def make_stale(cache):
+    old = os.stat(cache.cache_path).st_mtime - cache.max_age_seconds - 60
+    os.utime(cache.cache_path, (old, old))
+
+
+def test_enrich_fills_in_product_details(tmp_path, connector):
+    cache = ProductDimensionCache(connector, cache_path=tmp_path / 'products.arrow', max_age_seconds=3600)
+    orders = pd.DataFrame({'PRODUCT_ID': ['2', 1, 999, None], 'QUANTITY': [1, 2, 3, 4]})
+    enriched = cache.enrich(orders)
+    assert enriched['NAME'].tolist()[:2] == ['Squeaky Bone', 'Kibble']
+    assert enriched['CATEGORY_LEVEL3'].tolist()[:2] == ['Toys', 'Dry Food']
+    # Unknown and missing IDs get empty details
+    assert enriched[['NAME', 'CATEGORY_LEVEL3']].iloc[2:].isna().all().all()
+    assert enriched['QUANTITY'].tolist() == [1, 2, 3, 4]
+    assert 'NAME' not in orders.columns
+    assert connector.refreshes == 1
+
+
+def test_empty_orders_skip_the_catalog(tmp_path, connector):
+    cache = ProductDimensionCache(connector, cache_path=tmp_path / 'products.arrow')
+    enriched = cache.enrich(pd.DataFrame({'PRODUCT_ID': []}))
+    assert list(enriched.columns) == ['PRODUCT_ID', 'NAME', 'CATEGORY_LEVEL3']
+    assert connector.refreshes == 0
+
+
+def test_another_processes_refresh_is_picked_up(tmp_path, connector):
+    path = tmp_path / 'products.arrow'
+    reader = ProductDimensionCache(FakeConnector({}), cache_path=path, max_age_seconds=3600)
+    writer = ProductDimensionCache(connector, cache_path=path, max_age_seconds=3600)
+    writer.refresh()
+    assert reader.enrich(pd.DataFrame({'PRODUCT_ID': [3]}))['NAME'].isna().all()
+
+    connector.products[3] = ('Catnip', 'Toys')
+    writer.refresh()
+    assert reader.enrich(pd.DataFrame({'PRODUCT_ID': [3]}))['NAME'].tolist() == ['Catnip']
+    assert reader.connector.refreshes == 0
+
+
+def test_stale_catalog_is_refreshed_in_a_long_lived_process(tmp_path, connector):
+    cache = ProductDimensionCache(connector, cache_path=tmp_path / 'products.arrow', max_age_seconds=3600)
+    cache.table()
+    connector.products[3] = ('Catnip', 'Toys')
+    make_stale(cache)
+    assert cache.enrich(pd.DataFrame({'PRODUCT_ID': [3]}))['NAME'].tolist() == ['Catnip']
+    assert connector.refreshes == 2
+
+
+def test_failed_refresh_keeps_the_cached_catalog(tmp_path, connector):
+    cache = ProductDimensionCache(connector, cache_path=tmp_path / 'products.arrow', max_age_seconds=3600)
+    cache.table()
+    make_stale(cache)
+    connector.fail = True
+    assert cache.enrich(pd.DataFrame({'PRODUCT_ID': [1]}))['NAME'].tolist() == ['Kibble']
+    # No retry on every lookup until REFRESH_RETRY_SECONDS have passed
+    cache.table()
+    assert connector.refreshes == 2
+    assert list(tmp_path.iterdir()) == [cache.cache_path]
+
+    # Without a cached catalog the failure is raised
+    empty = ProductDimensionCache(connector, cache_path=tmp_path / 'other.arrow')
+    with pytest.raises(ConnectionError):
+        empty.table()
+
+
+def test_max_age_zero_refreshes_once_per_process(tmp_path, connector):
+    path = tmp_path / 'products.arrow'
+    ProductDimensionCache(connector, cache_path=path, max_age_seconds=3600).table()
+    cache = ProductDimensionCache(connector, cache_path=path, max_age_seconds=0)
+    cache.table()
+    cache.table()
+    assert connector.refreshes == 2
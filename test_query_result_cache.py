@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Tests for the on-disk query result cache (Final_Pipeline/query_result_cache.py)
+
+import json
+import pandas as pd
+import pytest
+import query_result_cache
+from query_result_cache import QueryResultCache
+
+QUERY = "select * from orders where customer_id = ?"
+
+
+class FakeClock:
+    """Stands in for time.time() so expiry and access order are exact."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(query_result_cache.time, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return QueryResultCache(str(tmp_path / 'cache.sqlite'), ttl_seconds=3600, max_bytes=10 * 1024 * 1024)
+
+
+def test_round_trip(cache):
+    rows = [{'PRODUCT_ID': 1, 'NAME': 'Kibble'}]
+    cache.put('get_cust_orders', QUERY, '101', rows)
+    assert cache.get('get_cust_orders', QUERY, '101') == rows
+    frame = pd.DataFrame({'PRODUCT_ID': [1, 2], 'NAME': ['Kibble', 'Treats']})
+    cache.put('get_cust_orders', QUERY, '102', frame)
+    pd.testing.assert_frame_equal(pd.DataFrame(cache.get('get_cust_orders', QUERY, '102')), frame)
+    assert cache.get('get_cust_orders', QUERY, '103') is None
+
+
+def test_edited_template_misses(cache):
+    cache.put('get_cust_orders', QUERY, '101', [{'A': 1}])
+    assert cache.get('get_cust_orders', QUERY + " limit 10", '101') is None
+
+
+def test_entries_expire_after_the_ttl(cache, clock):
+    cache.put('get_cust_orders', QUERY, '101', [{'A': 1}])
+    clock.now += 3599
+    assert cache.get('get_cust_orders', QUERY, '101') == [{'A': 1}]
+    clock.now += 2
+    assert cache.get('get_cust_orders', QUERY, '101') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = QueryResultCache(str(tmp_path / 'cache.sqlite'), ttl_seconds=3600, max_bytes=10 ** 9)
+    row = [{'NAME': 'x' * 1000}]
+    for customer_id in ('1', '2', '3', '4'):
+        clock.now += 1
+        cache.put('q', QUERY, customer_id, row)
+    clock.now += 1
+    assert cache.get('q', QUERY, '1') is not None  # now the most recently used
+    cache.max_bytes = len(json.dumps(row)) * 3
+    cache._evict_if_needed()
+    # Down to 90% of three entries: the two least recently used go
+    assert cache.get('q', QUERY, '2') is None
+    assert cache.get('q', QUERY, '3') is None
+    assert cache.get('q', QUERY, '4') is not None
+    assert cache.get('q', QUERY, '1') is not None
+
+
+def test_expired_entries_are_evicted_every_n_puts(cache, clock):
+    cache.EVICT_EVERY_PUTS = 3
+    cache.EVICT_INTERVAL_SECONDS = 10 ** 9
+    cache.put('q', QUERY, '1', [{'A': 1}])
+    clock.now += 3601
+    cache.put('q', QUERY, '2', [{'A': 1}])
+    # The expired entry lingers until the third write
+    assert cache.stats()['entries'] == 2
+    cache.put('q', QUERY, '3', [{'A': 1}])
+    assert cache.stats()['entries'] == 2
+    assert cache.get('q', QUERY, '2') == [{'A': 1}]
+
+
+def test_clear_customers(cache):
+    for customer_id in ('1', '2'):
+        cache.put('q', QUERY, customer_id, [{'A': 1}])
+    cache.clear(['1'])
+    assert cache.get('q', QUERY, '1') is None
+    assert cache.get('q', QUERY, '2') == [{'A': 1}]
+
+
+def test_template_schemas_are_kept_per_template(cache, clock):
+    cache.put_schema(QUERY, [['PRODUCT_ID', 'int'], ['NAME', 'string']])
+    assert cache.get_schema(QUERY) == [['PRODUCT_ID', 'int'], ['NAME', 'string']]
+    assert cache.get_schema(QUERY + " limit 10") is None
+    clock.now += 3601
+    assert cache.get_schema(QUERY) is None
+
+    cache.put_schema(QUERY, [['PRODUCT_ID', 'int']])
+    cache.clear(['101'])
+    assert cache.get_schema(QUERY) == [['PRODUCT_ID', 'int']]
+    cache.clear()
+    assert cache.get_schema(QUERY) is None
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Tests for per-template query telemetry (Final_Pipeline/query_telemetry.py)
+
+import json
+import pandas as pd
+import pytest
+from query_telemetry import QueryTelemetry
+
+
+def test_executions_and_cache_hits_are_aggregated_per_template():
+    telemetry = QueryTelemetry()
+    telemetry.record('get_cust_orders', 2.0, [{'A': 1}, {'A': 2}], query_id='q-1')
+    telemetry.record('get_cust_orders', 4.0, pd.DataFrame({'A': [1]}), query_id='q-2')
+    telemetry.record('get_cust_orders', 0.001, [{'A': 1}], cache_hit=True)
+    telemetry.record('get_cust_pets', 1.0, [], query_id='q-3')
+
+    orders = telemetry.summary()['get_cust_orders']
+    assert (orders['executions'], orders['cache_hits'], orders['rows']) == (2, 1, 4)
+    # Latencies only count executions, not cache lookups
+    assert (orders['total_seconds'], orders['max_seconds'], orders['p50_seconds']) == (6.0, 4.0, 3.0)
+    assert orders['bytes'] > 0
+    # Slowest template first
+    assert list(telemetry.summary()) == ['get_cust_orders', 'get_cust_pets']
+
+    totals = telemetry.totals()
+    assert (totals['executions'], totals['cache_hits'], totals['cache_hit_ratio']) == (3, 1, '25.0%')
+    assert totals['query_seconds'] == 7.0
+
+
+def test_latency_reservoir_is_bounded():
+    telemetry = QueryTelemetry()
+    telemetry.RESERVOIR_SIZE = 50
+    for index in range(1000):
+        telemetry.record('q', index / 1000, [])
+    stats = telemetry.templates['q']
+    assert stats['executions'] == 1000
+    assert len(stats['latencies']) == 50
+    assert telemetry.summary()['q']['max_seconds'] == 0.999
+
+
+def test_only_the_slowest_executions_are_kept():
+    telemetry = QueryTelemetry()
+    telemetry.SLOWEST_EXECUTIONS = 3
+    for index, seconds in enumerate([0.5, 3.0, 0.1, 2.0, 1.0]):
+        telemetry.record('q', seconds, [], query_id=f'q-{index}')
+    telemetry.record('q', 9.0, [], cache_hit=True)
+    slowest = telemetry.slowest_executions()
+    assert [execution['seconds'] for execution in slowest] == [3.0, 2.0, 1.0]
+    assert [execution['query_id'] for execution in slowest] == ['q-1', 'q-3', 'q-4']
+
+
+@pytest.mark.parametrize('pct, expected', [(0, 1.0), (50, 2.5), (95, 3.85), (100, 4.0)])
+def test_percentile_interpolates(pct, expected):
+    assert QueryTelemetry.percentile([4.0, 1.0, 3.0, 2.0], pct) == pytest.approx(expected)
+    assert QueryTelemetry.percentile([], pct) == 0.0
+
+
+def test_report_and_reset(tmp_path):
+    telemetry = QueryTelemetry()
+    telemetry.record('q', 1.5, [{'A': 1}], query_id='q-1')
+    report_path = telemetry.write_report(tmp_path / 'Output' / 'query_report.json', extra={'customers': 1})
+    report = json.loads(report_path.read_text())
+    assert report['customers'] == 1
+    assert report['totals']['executions'] == 1
+    assert report['templates']['q']['p95_seconds'] == 1.5
+    assert report['slowest_executions'][0]['query_id'] == 'q-1'
+
+    telemetry.reset()
+    assert telemetry.summary() == {}
+    assert telemetry.slowest_executions() == []
+    assert telemetry.totals()['cache_hit_ratio'] == '0%'
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Tests for run deadlines (Final_Pipeline/run_deadline.py) and how narrative generation and
+# the pipeline degrade under one
+
+import sys
+from pathlib import Path
+import pytest
+import run_deadline
+from run_deadline import (RunDeadline, DeadlineExceeded, set_run_deadline, call_timeout,
+                          resolve_deadline_seconds, DEFAULT_INTERACTIVE_DEADLINE_SECONDS)
+
+# The narrative agent imports its neighbours the way the pipeline puts them on the path
+sys.path.append(str(Path(__file__).parent / 'Final_Pipeline' / 'Agents' / 'Narrative_Generation_Agent'))
+
+
+class FakeMonotonic:
+    """Stands in for time.monotonic() so the time left is exact."""
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeMonotonic()
+    monkeypatch.setattr(run_deadline.time, 'monotonic', fake)
+    yield fake
+    set_run_deadline(None)
+
+
+def test_deadline_counts_down(clock):
+    deadline = RunDeadline(30)
+    clock.now += 12
+    assert (deadline.elapsed(), deadline.remaining()) == (12, 18)
+    assert deadline.allows(18) and not deadline.allows(19)
+    assert deadline.timeout() == 18
+    assert deadline.timeout(cap=5) == 5
+    clock.now += 20
+    assert deadline.remaining() == 0 and deadline.expired()
+    with pytest.raises(DeadlineExceeded, match='30s deadline'):
+        deadline.timeout()
+
+
+def test_call_timeout_follows_the_current_run(clock):
+    assert call_timeout(60) == 60
+    assert call_timeout() is None
+    set_run_deadline(RunDeadline(10))
+    assert call_timeout(60) == 10
+    assert call_timeout(4) == 4
+    clock.now += 10
+    with pytest.raises(DeadlineExceeded):
+        call_timeout(60)
+
+
+def test_resolve_deadline_seconds(monkeypatch):
+    monkeypatch.delenv('PIPELINE_DEADLINE_SECONDS', raising=False)
+    assert resolve_deadline_seconds() is None
+    assert resolve_deadline_seconds(priority='bulk') is None
+    assert resolve_deadline_seconds(priority='interactive') == DEFAULT_INTERACTIVE_DEADLINE_SECONDS
+    assert resolve_deadline_seconds(12, priority='interactive') == 12
+    # 0 turns the interactive default off
+    assert resolve_deadline_seconds(0, priority='interactive') is None
+    monkeypatch.setenv('PIPELINE_DEADLINE_SECONDS', '45')
+    assert resolve_deadline_seconds(priority='bulk') == 45
+    assert resolve_deadline_seconds(5) == 5
+
+
+@pytest.fixture
+def letter_system(monkeypatch):
+    """A PetLetterLLMSystem whose LLM calls are replaced by canned results."""
+    pet_letter = pytest.importorskip('pet_letter_llm_system')
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    system = pet_letter.PetLetterLLMSystem()
+    system.calls = []
+
+    def generated(name, result):
+        def generate(*args):
+            system.calls.append(name)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return generate
+
+    system.generated = generated
+    monkeypatch.setattr(system, '_generate_pet_letter', generated('letter', 'Dear human'))
+    monkeypatch.setattr(system, '_generate_visual_prompt', generated('visual_prompt', 'A beagle on a porch'))
+    monkeypatch.setattr(system, '_generate_personality_badge', generated('personality_badge', {'badge': 'The Explorer'}))
+    return system
+
+
+PET_DATA = {'101': {'Rex': {'breed': 'Beagle', 'traits': 'curious, adventurous, loves hiking'}}}
+REVIEWS = {'reviews': [{'review_text': 'Rex loves it', 'rating': 5}]}
+
+
+def test_without_a_deadline_nothing_is_left_out(letter_system):
+    output = letter_system.generate_output(PET_DATA, REVIEWS)
+    assert output['degraded'] == []
+    assert output['visual_prompt'] == 'A beagle on a porch'
+    assert output['personality_badge'] == {'badge': 'The Explorer'}
+
+
+def test_short_deadline_keeps_the_letter_only(letter_system, clock):
+    output = letter_system.generate_output(PET_DATA, REVIEWS, deadline=RunDeadline(5))
+    assert output['letter'] == 'Dear human'
+    assert output['degraded'] == ['visual_prompt', 'personality_badge']
+    assert output['visual_prompt'] is None
+    # The badge comes from the pets' traits instead of the LLM
+    assert output['personality_badge']['badge'] == 'The Explorer'
+    assert output['personality_badge']['deterministic']
+    assert letter_system.calls == ['letter']
+
+    assert letter_system.complete_output(PET_DATA, REVIEWS, output) == {
+        'visual_prompt': 'A beagle on a porch', 'personality_badge': {'badge': 'The Explorer'}}
+
+
+def test_call_cut_short_by_the_deadline_is_left_out(letter_system, clock, monkeypatch):
+    monkeypatch.setattr(letter_system, '_generate_visual_prompt',
+                        letter_system.generated('visual_prompt', DeadlineExceeded("Starting a call")))
+    output = letter_system.generate_output(PET_DATA, REVIEWS, deadline=RunDeadline(60))
+    assert output['degraded'] == ['visual_prompt']
+    assert output['personality_badge'] == {'badge': 'The Explorer'}
+    # Without a deadline failures aren't swallowed
+    with pytest.raises(DeadlineExceeded):
+        letter_system.generate_output(PET_DATA, REVIEWS)
+
+    monkeypatch.setattr(letter_system, '_generate_visual_prompt',
+                        letter_system.generated('visual_prompt', 'A beagle on a porch'))
+    assert letter_system.complete_output(PET_DATA, REVIEWS, output) == {'visual_prompt': 'A beagle on a porch'}
+
+
+@pytest.fixture
+def pipeline(clock):
+    """A ChewyPlaybackPipeline with just the deadline state its postpone helpers read."""
+    module = pytest.importorskip('chewy_playback_pipeline')
+    pipeline = module.ChewyPlaybackPipeline.__new__(module.ChewyPlaybackPipeline)
+    pipeline.deadline = RunDeadline(30)
+    pipeline.postponed = {}
+    return pipeline
+
+
+def test_narrative_complete(pipeline):
+    complete = type(pipeline)._narrative_complete
+    assert complete({'collective_letter': 'Dear human', 'degraded': []})
+    assert not complete({'collective_letter': 'Dear human', 'degraded': ['visual_prompt']})
+    assert not complete({'collective_letter': ''})
+    assert not complete({})
+
+
+def test_stages_cut_short_are_postponed(pipeline, clock):
+    narrative = {'collective_letter': 'Dear human', 'degraded': ['personality_badge']}
+    assert pipeline._note_postponed('101', 'narrative', narrative) is narrative
+    assert pipeline._note_postponed('101', 'breed', {'Rex': 'Beagle'}) == {'Rex': 'Beagle'}
+    assert pipeline.postponed == {'101': {'stages': ['narrative']}}
+
+    clock.now += 31
+    pipeline._note_postponed('101', 'breed', {'Rex': 'Beagle'})
+    pipeline._note_postponed('102', 'narrative', {'collective_letter': ''})
+    assert pipeline.postponed == {'101': {'stages': ['narrative', 'breed']}, '102': {'stages': ['narrative']}}
+
+    assert not pipeline._image_fits('103', {'collective_visual_prompt': 'A beagle'})
+    assert pipeline.postponed['103'] == {'stages': ['image']}
+
+
+def test_without_a_deadline_nothing_is_postponed(pipeline):
+    pipeline.deadline = None
+    pipeline._note_postponed('101', 'narrative', {'collective_letter': '', 'degraded': ['visual_prompt']})
+    assert pipeline._image_fits('101', {})
+    assert pipeline.postponed == {}
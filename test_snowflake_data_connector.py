@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# Tests for the Snowflake connector's query plumbing (Final_Pipeline/snowflake_data_connector.py),
+# run against a stand-in for the warehouse
+
+import pandas as pd
+import pytest
+from query_telemetry import QueryTelemetry
+from snowflake_data_connector import SnowflakeDataConnector, CustomerQueryResults
+
+BULK_ORDERS = "select customer_id as bulk_customer_id, product_id from orders where customer_id {customer_id_filter}"
+
+
+def make_connector(use_arrow=True, **attributes):
+    """A connector with just the state the query methods read, and no connection."""
+    connector = SnowflakeDataConnector.__new__(SnowflakeDataConnector)
+    connector.customer_queries = {'get_cust_orders': "select product_id from orders where customer_id = :1"}
+    connector.customer_bulk_queries = {'get_cust_orders': BULK_ORDERS}
+    connector.bulk_batch_size = 1000
+    connector.use_arrow = use_arrow
+    connector.result_cache = None
+    connector.telemetry = QueryTelemetry()
+    for name, value in attributes.items():
+        setattr(connector, name, value)
+    return connector
+
+
+class FakeWarehouse:
+    """Stands in for _run_queries: returns one row per (customer, product) for the bound IDs."""
+    def __init__(self, products, use_arrow=True):
+        self.products = products
+        self.use_arrow = use_arrow
+        self.calls = []
+
+    def __call__(self, queries, customers=1):
+        results = {}
+        for query_name, statement, params in queries:
+            self.calls.append((statement, params, customers))
+            # Padding repeats an ID, which the IN-list matches only once
+            rows = [{'BULK_CUSTOMER_ID': customer_id, 'PRODUCT_ID': product_id}
+                    for customer_id in dict.fromkeys(params) for product_id in self.products.get(customer_id, [])]
+            results[query_name] = pd.DataFrame(rows, columns=['BULK_CUSTOMER_ID', 'PRODUCT_ID']) if self.use_arrow else rows
+        return results
+
+
+def test_batches_share_one_padded_statement(monkeypatch):
+    connector = make_connector()
+    warehouse = FakeWarehouse({1: [10], 2: [20], 3: [30], 4: [40], 5: [50]})
+    monkeypatch.setattr(connector, '_run_queries', warehouse)
+    connector.get_customer_data_bulk(['1', '2', '3', '4', '5'], batch_size=2)
+
+    statements = {statement for statement, params, customers in warehouse.calls}
+    assert len(statements) == 1
+    assert 'IN (:1, :2)' in statements.pop()
+    assert [params for statement, params, customers in warehouse.calls] == [[1, 2], [3, 4], [5, 5]]
+    assert [customers for statement, params, customers in warehouse.calls] == [2, 2, 1]
+
+
+def test_frames_are_split_per_customer(monkeypatch):
+    connector = make_connector()
+    monkeypatch.setattr(connector, '_run_queries', FakeWarehouse({101: [1, 2], 103: [3]}))
+    bulk_data = connector.get_customer_data_bulk(['101', '102', '103'])
+
+    assert all(isinstance(customer_data, CustomerQueryResults) for customer_data in bulk_data.values())
+    orders = bulk_data['101'].frame('get_cust_orders')
+    assert list(orders.columns) == ['PRODUCT_ID']
+    assert orders['PRODUCT_ID'].tolist() == [1, 2]
+    assert bulk_data['103'].frame('get_cust_orders')['PRODUCT_ID'].tolist() == [3]
+    # Customers without rows get an empty result with the same columns
+    assert bulk_data['102'].frame('get_cust_orders').empty
+    assert list(bulk_data['102'].frame('get_cust_orders').columns) == ['PRODUCT_ID']
+
+
+def test_rows_are_split_per_customer(monkeypatch):
+    connector = make_connector(use_arrow=False)
+    monkeypatch.setattr(connector, '_run_queries', FakeWarehouse({101: [1, 2]}, use_arrow=False))
+    bulk_data = connector.get_customer_data_bulk(['101', '102'])
+    assert bulk_data == {'101': {'get_cust_orders': [{'PRODUCT_ID': 1}, {'PRODUCT_ID': 2}]},
+                         '102': {'get_cust_orders': []}}
+
+
+def test_callers_customer_id_strings_are_kept(monkeypatch):
+    connector = make_connector()
+    warehouse = FakeWarehouse({101: [1]})
+    monkeypatch.setattr(connector, '_run_queries', warehouse)
+    bulk_data = connector.get_customer_data_bulk([' 101.0'])
+    assert list(bulk_data) == [' 101.0']
+    assert warehouse.calls[0][1] == [101]
+    assert bulk_data[' 101.0'].frame('get_cust_orders')['PRODUCT_ID'].tolist() == [1]
+
+
+def test_invalid_customer_ids_are_rejected():
+    connector = make_connector()
+    with pytest.raises(ValueError, match='Invalid customer ID'):
+        connector.get_customer_data_bulk(['101', 'abc'])
+    assert SnowflakeDataConnector._bind_customer_id('abc') == 'abc'
+    assert SnowflakeDataConnector._bind_customer_id('0101') == 101
+
+
+CONSOLIDATED_ORDERS = "select order_id, order_date_est, quantity from orders where customer_id = :1\norder by c_ord.order_date_est, quantity desc"
+
+
+def test_consolidated_rows_are_unpacked():
+    packed = '[{"order_id": 1, "Quantity": 2}, {"order_id": 2}]'
+    assert SnowflakeDataConnector._unpack_consolidated_rows(packed) == [{'ORDER_ID': 1, 'QUANTITY': 2}, {'ORDER_ID': 2}]
+    assert SnowflakeDataConnector._unpack_consolidated_rows([{'a': 1}]) == [{'A': 1}]
+    assert SnowflakeDataConnector._unpack_consolidated_rows(None) == []
+
+
+@pytest.mark.parametrize('template, order', [
+    (CONSOLIDATED_ORDERS, [('ORDER_DATE_EST', False, False), ('QUANTITY', True, True)]),
+    ("select * from t order by \n total_quantity desc nulls last;", [('TOTAL_QUANTITY', True, False)]),
+    ("select * from t order by a nulls first limit 10", [('A', False, True)]),
+    # An ORDER BY inside a window or subquery isn't the result order
+    ("select row_number() over (order by a) as n from t", []),
+    ("select * from t", []),
+])
+def test_result_order_is_parsed_from_the_template(template, order):
+    assert SnowflakeDataConnector._result_order(template) == order
+
+
+def test_rows_are_sorted_on_several_keys_with_nulls_placed():
+    rows = [{'D': '2025-02-01', 'Q': 1}, {'D': None, 'Q': 5}, {'D': '2025-01-01', 'Q': None},
+            {'D': '2025-01-01', 'Q': 3}]
+    by_date_then_quantity = SnowflakeDataConnector._sort_rows(rows, [('D', False, False), ('Q', True, True)])
+    assert by_date_then_quantity == [{'D': '2025-01-01', 'Q': None}, {'D': '2025-01-01', 'Q': 3},
+                                     {'D': '2025-02-01', 'Q': 1}, {'D': None, 'Q': 5}]
+    # Keys missing from the rows are skipped
+    assert SnowflakeDataConnector._sort_rows(rows, [('MISSING', False, False)]) == rows
+    assert SnowflakeDataConnector._sort_rows([], [('D', False, False)]) == []
+
+
+def test_unpacked_columns_are_cast_to_the_template_schema():
+    connector = make_connector()
+    frame = pd.DataFrame.from_records([
+        {'ID': 1, 'MAYBE_ID': None, 'PRICE': 2, 'DAY': '2025-01-02', 'AT': '2025-01-02 03:04:05.000',
+         'AT_TZ': '2025-01-02 03:04:05.000 +0100', 'FLAG': True, 'TRAITS': ['shy'], 'NAME': 'Rex'},
+        {'ID': 2, 'MAYBE_ID': 7, 'PRICE': 2.5, 'DAY': None, 'AT': None,
+         'AT_TZ': None, 'FLAG': False, 'TRAITS': None, 'NAME': None},
+    ])
+    schema = [('ID', 'int'), ('MAYBE_ID', 'int'), ('PRICE', 'float'), ('DAY', 'date'), ('AT', 'datetime'),
+              ('AT_TZ', 'datetime_tz'), ('FLAG', 'bool'), ('TRAITS', 'json'), ('NAME', 'string'), ('GONE', 'string')]
+    cast = connector._cast_to_schema(frame, schema)
+
+    assert list(cast.columns) == [column for column, kind in schema]
+    assert cast['ID'].dtype == 'int64'
+    # Integer columns with NULLs come back as float64, as the connector fetches them
+    assert cast['MAYBE_ID'].dtype == 'float64' and pd.isna(cast['MAYBE_ID'][0])
+    assert cast['PRICE'].tolist() == [2.0, 2.5]
+    assert cast['DAY'].tolist() == [pd.Timestamp('2025-01-02').date(), None]
+    assert cast['AT'].dtype == 'datetime64[ns]'
+    assert cast['AT_TZ'][0] == pd.Timestamp('2025-01-02 02:04:05', tz='UTC')
+    assert cast['FLAG'].dtype == 'bool'
+    assert cast['TRAITS'].tolist() == ['[\n  "shy"\n]', None]
+    assert cast['GONE'].isna().all()
+
+
+def test_consolidated_query_matches_per_template_results(monkeypatch):
+    connector = make_connector(customer_queries={'get_cust_orders': CONSOLIDATED_ORDERS}, connection=object(),
+                               broker=None, _consolidated_statements={},
+                               _template_schemas={'get_cust_orders': [('ORDER_ID', 'int'), ('ORDER_DATE_EST', 'date'),
+                                                                      ('QUANTITY', 'int')]})
+    statements = []
+
+    def execute_query(query, params=None, query_info=None):
+        statements.append((query, params))
+        packed = ('[{"ORDER_ID": 2, "ORDER_DATE_EST": "2025-03-01", "QUANTITY": 1},'
+                  ' {"ORDER_ID": 1, "ORDER_DATE_EST": "2025-01-01", "QUANTITY": 4}]')
+        return pd.DataFrame([{'GET_CUST_ORDERS': packed}])
+
+    monkeypatch.setattr(connector, '_execute_query', execute_query)
+    orders = connector._run_consolidated_query(['get_cust_orders'], '0101')['get_cust_orders']
+
+    assert statements[0][1] == [101]
+    assert 'AS "GET_CUST_ORDERS"' in statements[0][0]
+    pd.testing.assert_frame_equal(orders, pd.DataFrame({
+        'ORDER_ID': [1, 2],
+        'ORDER_DATE_EST': [pd.Timestamp('2025-01-01').date(), pd.Timestamp('2025-03-01').date()],
+        'QUANTITY': [4, 1],
+    }))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Tests for the Snowflake session broker (Final_Pipeline/snowflake_session_broker.py),
+# with the Snowflake connections replaced by stand-ins
+
+import os
+import stat
+import threading
+import time
+import pandas as pd
+import pytest
+import snowflake_session_broker
+from priority_lanes import INTERACTIVE, BULK
+from snowflake_data_connector import SnowflakeDataConnector
+from snowflake_session_broker import SnowflakeSessionBroker, SessionBrokerClient
+
+
+class FakeDatabaseError(Exception):
+    """Stands in for snowflake.connector.errors.DatabaseError."""
+    def __init__(self, errno):
+        super().__init__(f"error {errno}")
+        self.errno = errno
+
+
+def make_broker(socket_path=None, pool_size=3, interactive_sessions=1):
+    """A broker with its pool state but no Snowflake connector; connections are handed out by number."""
+    broker = SnowflakeSessionBroker.__new__(SnowflakeSessionBroker)
+    broker.socket_path = str(socket_path)
+    broker.pool_size = pool_size
+    broker.interactive_sessions = interactive_sessions
+    broker.heartbeat_seconds = 3600
+    broker._connections = [None] * pool_size
+    broker._slot_locks = [threading.Lock() for _ in range(pool_size)]
+    broker._next_slot = {INTERACTIVE: iter(range(10 ** 6)), BULK: iter(range(10 ** 6))}
+    broker._stop = threading.Event()
+    broker.server = None
+    broker.stats = {'queries': 0, 'interactive_queries': 0, 'errors': 0, 'reconnects': 0, 'started_at': time.time()}
+    broker.opened = []
+
+    def get_connection(slot, reconnect=False):
+        broker.opened.append((slot, reconnect))
+        return f"session {slot}{' (reopened)' if reconnect else ''}"
+
+    broker._get_connection = get_connection
+    return broker
+
+
+@pytest.fixture
+def database_error(monkeypatch):
+    monkeypatch.setattr(snowflake_session_broker, 'DatabaseError', FakeDatabaseError, raising=False)
+    return FakeDatabaseError
+
+
+def test_interactive_requests_use_the_reserved_sessions():
+    broker = make_broker(pool_size=3, interactive_sessions=1)
+    assert [broker._pick_slot(BULK) for _ in range(4)] == [0, 1, 0, 1]
+    assert [broker._pick_slot(INTERACTIVE) for _ in range(2)] == [2, 2]
+    # Without reserved sessions interactive requests share the bulk rotation
+    broker = make_broker(pool_size=2, interactive_sessions=0)
+    assert [broker._pick_slot(INTERACTIVE), broker._pick_slot(BULK)] == [0, 1]
+
+
+def test_only_lost_sessions_are_retried(database_error):
+    broker = make_broker()
+    calls = []
+
+    def run(connection):
+        calls.append(connection)
+        if len(calls) == 1:
+            raise database_error(390112)
+        return 'rows'
+
+    assert broker._on_session(BULK, run) == 'rows'
+    assert calls == ['session 0', 'session 0 (reopened)']
+    assert broker.opened == [(0, False), (0, True)]
+
+
+@pytest.mark.parametrize('error', [FakeDatabaseError(2003), FakeDatabaseError(None), TimeoutError('read timed out')])
+def test_other_errors_are_not_retried(database_error, error):
+    broker = make_broker()
+    calls = []
+
+    def run(connection):
+        calls.append(connection)
+        raise error
+
+    with pytest.raises(type(error)):
+        broker._on_session(BULK, run)
+    assert len(calls) == 1
+    assert not SnowflakeSessionBroker._is_session_error(error)
+    assert SnowflakeSessionBroker._is_session_error(FakeDatabaseError(250001))
+
+
+@pytest.fixture
+def served_broker(tmp_path, monkeypatch, database_error):
+    """A broker serving on a Unix socket in tmp_path, stopped after the test."""
+    # serve_forever's own chmod would hide whether the socket was created owner-only
+    monkeypatch.setattr(snowflake_session_broker.os, 'chmod', lambda path, mode: None)
+    monkeypatch.setattr(snowflake_session_broker, 'ARROW_AVAILABLE', True)
+    broker = make_broker(tmp_path / 'broker.sock')
+    thread = threading.Thread(target=broker.serve_forever, kwargs={'warm_up': False}, daemon=True)
+    thread.start()
+    client = SessionBrokerClient(broker.socket_path, timeout=5)
+    deadline = time.time() + 5
+    while not client.ping():
+        assert time.time() < deadline, "broker did not start"
+        time.sleep(0.01)
+    yield broker, client
+    broker.server.shutdown()
+    thread.join(timeout=5)
+
+
+def test_socket_is_owner_only(served_broker):
+    broker, client = served_broker
+    assert stat.S_IMODE(os.stat(broker.socket_path).st_mode) & 0o077 == 0
+
+
+def test_requests_round_trip_over_the_socket(served_broker, monkeypatch):
+    broker, client = served_broker
+
+    def fetch_query(connection, query, params, use_arrow, query_info=None, timeout=None):
+        query_info['query_id'] = 'q-1'
+        rows = [{'CUSTOMER_ID': params[0], 'SESSION': connection}]
+        return pd.DataFrame(rows) if use_arrow else rows
+
+    monkeypatch.setattr(SnowflakeDataConnector, '_fetch_query', staticmethod(fetch_query))
+    monkeypatch.setattr(SnowflakeDataConnector, '_describe_columns',
+                        staticmethod(lambda connection, query, params: [('CUSTOMER_ID', 'int')]))
+
+    query_info = {}
+    frame = client.execute("select :1", [101], query_info=query_info)
+    pd.testing.assert_frame_equal(frame, pd.DataFrame([{'CUSTOMER_ID': 101, 'SESSION': 'session 0'}]))
+    assert query_info == {'query_id': 'q-1'}
+    assert client.execute("select :1", [102], arrow=False) == [{'CUSTOMER_ID': 102, 'SESSION': 'session 1'}]
+    assert client.describe("select :1", [101]) == [('CUSTOMER_ID', 'int')]
+    assert client.stats()['queries'] == 2
+
+    monkeypatch.setattr(SnowflakeDataConnector, '_fetch_query', staticmethod(lambda *args: 1 / 0))
+    with pytest.raises(RuntimeError, match='division by zero'):
+        client.execute("select 1")
+    assert client.stats()['errors'] == 1
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Tests for the per-customer stage dependency graph (Final_Pipeline/stage_graph.py)
+
+import threading
+import pytest
+from stage_graph import StageGraph, StageSkipped
+
+
+def test_stages_get_their_dependencies_results():
+    graph = StageGraph()
+    graph.add('narrative', lambda done: 'letter')
+    graph.add('image', lambda done: f"image of {done['narrative']}", depends_on=['narrative'])
+    graph.add('breed', lambda done: sorted(done))
+    results = graph.run()
+    assert results == {'narrative': 'letter', 'image': 'image of letter', 'breed': []}
+    assert graph.errors == {}
+
+
+def test_independent_stages_run_concurrently():
+    started = threading.Event()
+    graph = StageGraph()
+    graph.add('breed', lambda done: started.wait(timeout=5))
+    graph.add('narrative', lambda done: started.set())
+    # breed only finishes if narrative runs while it waits
+    assert graph.run()['breed'] is True
+
+
+def test_failure_skips_dependents_only():
+    def fail(done):
+        raise RuntimeError("no letter")
+
+    graph = StageGraph()
+    graph.add('narrative', fail)
+    graph.add('image', lambda done: 'image', depends_on=['narrative'])
+    graph.add('upload', lambda done: 'uploaded', depends_on=['image'])
+    graph.add('breed', lambda done: 'breed')
+    results = graph.run()
+    assert results == {'breed': 'breed'}
+    assert isinstance(graph.errors['narrative'], RuntimeError)
+    assert isinstance(graph.errors['image'], StageSkipped)
+    assert isinstance(graph.errors['upload'], StageSkipped)
+    assert 'image' in str(graph.errors['upload'])
+
+
+def test_cycles_are_rejected_before_anything_runs():
+    calls = []
+    graph = StageGraph()
+    graph.add('a', lambda done: calls.append('a'), depends_on=['c'])
+    graph.add('b', lambda done: calls.append('b'), depends_on=['a'])
+    graph.add('c', lambda done: calls.append('c'), depends_on=['b'])
+    graph.add('d', lambda done: calls.append('d'))
+    with pytest.raises(ValueError, match='cycle'):
+        graph.run()
+    assert calls == []
+
+
+def test_unknown_and_duplicate_stages_are_rejected():
+    graph = StageGraph()
+    graph.add('image', lambda done: None, depends_on=['narrative'])
+    with pytest.raises(ValueError, match='unknown'):
+        graph.run()
+    with pytest.raises(ValueError, match='already'):
+        graph.add('image', lambda done: None)
+
+
+def test_summary_reports_every_stage():
+    graph = StageGraph(name='101')
+    graph.add('narrative', lambda done: 1 / 0)
+    graph.add('image', lambda done: None, depends_on=['narrative'])
+    graph.run()
+    summary = graph.summary()
+    assert any(line.startswith('narrative:') and '(failed)' in line for line in summary)
+    assert any(line.startswith('image:') and 'skipped' in line for line in summary)
+    assert graph.critical_path_seconds() >= 0